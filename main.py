@@ -1,15 +1,45 @@
-from source import get_config, TeleRagService
+import argparse
 import asyncio
+import os
 
+from source import get_config
 
-async def main():
+
+ROLES = ("all", "bot", "ingest", "query")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="TeleRag service")
+    parser.add_argument(
+        "--role",
+        choices=ROLES,
+        default="all",
+        help="Which part of the service to run. 'all' starts the monolith.",
+    )
+    parser.add_argument(
+        "--cpus",
+        default=None,
+        help="Comma separated list of CPU cores to pin the process to, e.g. 0,1.",
+    )
+    return parser.parse_args()
+
+
+async def main(role: str):
     """
-    Main function to start the TeleRagService.
+    Main function to start the TeleRagService or one of its roles.
     """
     settings = get_config()
-    service = TeleRagService(settings)
+    if role == "all":
+        from source import TeleRagService
+        service = TeleRagService(settings)
+    else:
+        from source.Roles import create_role
+        service = create_role(role, settings)
     await service.start()
     await service.idle()
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    args = parse_args()
+    if args.cpus:
+        os.sched_setaffinity(0, {int(cpu) for cpu in args.cpus.split(",")})
+    asyncio.run(main(args.role))
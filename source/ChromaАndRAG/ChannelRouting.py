@@ -0,0 +1,159 @@
+"""
+Routing of a question to the channels that are likely to answer it.
+
+ChannelIndex keeps a few centers per channel, summaries of the embeddings of the
+channel's posts, maintained incrementally (online k-means) as posts are embedded.
+A question is compared with the centers, and only the top channels are fetched,
+embedded and searched, which matters for users who follow dozens of channels.
+A channel without centers yet has not been indexed and is always searched.
+
+ChannelIndex is state of the process. Every ingest process (or the monolith) builds
+its own from the posts it embeds. It is not shared between ingest workers and
+not kept across restarts. A channel that only another worker has indexed is
+not indexed here, so it is searched: routing can only search more channels, never fewer.
+"""
+from dataclasses import dataclass, field
+from typing import Dict, Hashable, List, Optional, Sequence
+
+import numpy as np
+
+from source.Metrics import REGISTRY
+
+
+ROUTED_CHANNELS = REGISTRY.counter(
+    "telerag_routed_channels_total",
+    "Channels of questions by routing decision: searched, skipped, or not indexed yet.",
+    ("decision",),
+)
+
+# Weight of a center's history. Older posts fade out past it, so a center
+# follows what the channel writes about now.
+_MAX_WEIGHT = 1000.0
+
+
+@dataclass
+class _Channel:
+    # Sums of unit embeddings assigned to each center, one row per center
+    sums: np.ndarray
+    weights: np.ndarray
+    last_post_id: int = -1
+    units: Optional[np.ndarray] = field(default=None, repr=False)
+
+    def centers(self) -> np.ndarray:
+        if self.units is None:
+            self.units = _normalize(self.sums)
+        return self.units
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class ChannelIndex:
+    def __init__(self, centers: int = 3):
+        if centers < 1:
+            raise ValueError("ChannelIndex needs at least one center per channel.")
+        self.centers = centers
+        self._channels: Dict[Hashable, _Channel] = {}
+        # Centers of all channels in one matrix, rebuilt after updates
+        self._matrix: Optional[np.ndarray] = None
+        self._owners: List[Hashable] = []
+
+    def __len__(self) -> int:
+        return len(self._channels)
+
+    def __contains__(self, channel_id: Hashable) -> bool:
+        return channel_id in self._channels
+
+    def add(
+        self,
+        channel_ids: Sequence[Hashable],
+        post_ids: Sequence[Optional[int]],
+        embeddings: np.ndarray
+    ):
+        """
+        Update the centers with embedded posts, one row per post.
+        Posts that are not newer than the last indexed post of their channel
+        (fetched again for another question) are skipped, a post without an id is always added.
+        """
+        if not len(channel_ids):
+            return
+        embeddings = _normalize(np.asarray(embeddings, dtype=np.float32))
+        rows: Dict[Hashable, List[int]] = {}
+        for row, (channel_id, post_id) in enumerate(zip(channel_ids, post_ids)):
+            channel = self._channels.get(channel_id)
+            if channel is None or post_id is None or post_id > channel.last_post_id:
+                rows.setdefault(channel_id, []).append(row)
+        for channel_id, channel_rows in rows.items():
+            newest = max(
+                (post_ids[row] for row in channel_rows if post_ids[row] is not None),
+                default=-1)
+            self._update(channel_id, embeddings[channel_rows], newest)
+        if rows:
+            self._matrix = None
+
+    def _update(self, channel_id: Hashable, vectors: np.ndarray, newest: int):
+        channel = self._channels.get(channel_id)
+        if channel is None:
+            # The first posts seed the centers
+            seeds = vectors[:self.centers]
+            channel = self._channels[channel_id] = _Channel(
+                sums=seeds.astype(np.float64), weights=np.ones(len(seeds)))
+            vectors = vectors[len(seeds):]
+        elif len(channel.sums) < self.centers:
+            seeds = vectors[:self.centers - len(channel.sums)]
+            channel.sums = np.vstack((channel.sums, seeds))
+            channel.weights = np.concatenate((channel.weights, np.ones(len(seeds))))
+            vectors = vectors[len(seeds):]
+        if len(vectors):
+            nearest = np.argmax(vectors @ channel.centers().T, axis=1)
+            np.add.at(channel.sums, nearest, vectors)
+            np.add.at(channel.weights, nearest, 1.0)
+            heavy = channel.weights > _MAX_WEIGHT
+            if heavy.any():
+                scale = _MAX_WEIGHT / channel.weights[heavy]
+                channel.sums[heavy] *= scale[:, None]
+                channel.weights[heavy] = _MAX_WEIGHT
+        channel.units = None
+        channel.last_post_id = max(channel.last_post_id, newest)
+
+    def forget(self, channel_id: Hashable):
+        if self._channels.pop(channel_id, None) is not None:
+            self._matrix = None
+
+    def scores(self, query_embedding: Sequence[float]) -> Dict[Hashable, float]:
+        """Similarity of the question to every indexed channel, its best center."""
+        if not self._channels:
+            return {}
+        if self._matrix is None:
+            self._owners = [
+                channel_id for channel_id, channel in self._channels.items()
+                for _ in range(len(channel.sums))]
+            self._matrix = np.vstack(
+                [channel.centers() for channel in self._channels.values()]).astype(np.float32)
+        query = _normalize(np.asarray(query_embedding, dtype=np.float32))
+        scores: Dict[Hashable, float] = {}
+        for channel_id, score in zip(self._owners, (self._matrix @ query).tolist()):
+            if score > scores.get(channel_id, -2.0):
+                scores[channel_id] = score
+        return scores
+
+    def route(self, query_embedding: Sequence[float], channel_ids: Sequence[Hashable], top: int) -> List[Hashable]:
+        """
+        The channels of channel_ids to search for the question: the top most similar
+        indexed channels and every channel that is not indexed yet, in their original order.
+        """
+        if top <= 0 or len(channel_ids) <= top:
+            ROUTED_CHANNELS.labels(decision="searched").inc(len(channel_ids))
+            return list(channel_ids)
+        scores = self.scores(query_embedding)
+        known = [channel_id for channel_id in channel_ids if channel_id in scores]
+        chosen = set(sorted(known, key=scores.__getitem__, reverse=True)[:top])
+        unknown = len(channel_ids) - len(known)
+        ROUTED_CHANNELS.labels(decision="searched").inc(len(chosen))
+        ROUTED_CHANNELS.labels(decision="skipped").inc(len(known) - len(chosen))
+        ROUTED_CHANNELS.labels(decision="not_indexed").inc(unknown)
+        return [
+            channel_id for channel_id in channel_ids
+            if channel_id in chosen or channel_id not in scores]
@@ -43,9 +43,9 @@ class RagClient:
         collection = self.client.get_collection(str(channel_id))
         if collection:
             self.client.delete_collection(str(channel_id))
-            await self.rag_logger.info(f"Deleted collection {channel_id} from RAG database.")
+            self.rag_logger.info("Deleted collection %s from RAG database.", channel_id)
         else:
-            await self.rag_logger.warning(f"Collection {channel_id} not found in RAG database.")
+            self.rag_logger.warning("Collection %s not found in RAG database.", channel_id)
 
     async def query(self, user_id: int, request: str, channel_ids: List[int]):
         """
@@ -102,7 +102,7 @@ class RagClient:
                     metadatas=[{"channel_name": channel_name}],
                     ids=[sha256(chunk.encode('utf-8')).hexdigest()],
                 )
-            await self.rag_logger.info(f"Added new message to collection {channel_id} ({channel_name})")
+            self.rag_logger.info("Added new message to collection %s (%s)", channel_id, channel_name)
 
     async def _query_loop(self):
         while True:
@@ -110,7 +110,7 @@ class RagClient:
             if not self.running:
                 break
             user_id, request, channel_ids = await self.channel_request_queue.get()
-            await self.rag_logger.info(f"Started processing RAG request for {user_id} with request: {request}.")
+            self.rag_logger.info("Started processing RAG request for %s with request: %s.", user_id, request)
             responses = []
             for channel_id in channel_ids:
                 collection = self.client.get_collection(str(channel_id))
@@ -154,7 +154,7 @@ class RagClient:
             )
             elapsed = time.monotonic() - start
             await self.rag_response_queue.put((user_id, response.choices[0].message.content))
-            await self.rag_logger.info(f"Generated response for {user_id} in {elapsed:.2f} seconds")
+            self.rag_logger.info("Generated response for %s in %.2f seconds", user_id, elapsed)
 
     def stop(self):
         """
@@ -0,0 +1,158 @@
+"""
+Context of the LLM prompt within a token budget.
+
+Retrieved passages are taken in rank order. A passage that mostly repeats the
+passages taken before it is dropped, a long one is cut to the passage budget, and
+passages are added until the context budget is spent. The context lists every
+source once with its passages under it, so prompt size and LLM latency do not
+depend on how verbose the channels are.
+"""
+import re
+from typing import Dict, List, Optional, Sequence, Set, Tuple, TYPE_CHECKING
+
+from source.Metrics import REGISTRY
+
+# tokenizers comes with sentence_transformers, it is imported by TokenCounter.load()
+if TYPE_CHECKING:
+    from tokenizers import Tokenizer
+
+
+CONTEXT_TOKENS = REGISTRY.counter(
+    "telerag_context_tokens_total",
+    "Tokens of retrieved passages, and of the contexts packed from them.",
+    ("kind",),
+)
+
+_WORD_RE = re.compile(r"\w+|[^\w\s]")
+_PREFIX_RE = re.compile(r"^!ПОСТ С КАНАЛ(?:А|ОВ) ")
+# A passage this much covered by the passages before it adds nothing
+_OVERLAP = 0.8
+_SHINGLE = 3
+# Less room than this is not worth a cut passage
+_MIN_PASSAGE_TOKENS = 32
+
+
+def _estimate(word: str) -> int:
+    # Errs on the high side: BPE vocabularies of the LLMs take 3-4 characters
+    # of Latin text per token and fewer of Cyrillic
+    return (len(word) + 2) // 3
+
+
+class TokenCounter:
+    """
+    Counts tokens of text with a local Hugging Face tokenizer,
+    or estimates them from the words when there is none.
+    """
+
+    def __init__(self, name: str = ""):
+        self.name = name
+        self._tokenizer: Optional["Tokenizer"] = None
+
+    @property
+    def exact(self) -> bool:
+        return self._tokenizer is not None
+
+    def load(self):
+        """Load the tokenizer (blocking, from the local cache or the Hub). Raises if it is not available."""
+        if self.name and self._tokenizer is None:
+            from tokenizers import Tokenizer
+            self._tokenizer = Tokenizer.from_pretrained(self.name)
+
+    def count(self, text: str) -> int:
+        if self._tokenizer is not None:
+            return len(self._tokenizer.encode(text, add_special_tokens=False).ids)
+        return sum(_estimate(match.group()) for match in _WORD_RE.finditer(text))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """The longest beginning of text of at most max_tokens tokens, cut between words."""
+        if max_tokens <= 0:
+            return ""
+        if self._tokenizer is not None:
+            encoding = self._tokenizer.encode(text, add_special_tokens=False)
+            if len(encoding.ids) <= max_tokens:
+                return text
+            end = encoding.offsets[max_tokens - 1][1]
+            if end < len(text) and not text[end].isspace():
+                # Do not leave a word cut in half
+                end = max(text.rfind(" ", 0, end), 0) or end
+            return text[:end].rstrip()
+        used = 0
+        end = 0
+        for match in _WORD_RE.finditer(text):
+            used += _estimate(match.group())
+            if used > max_tokens:
+                break
+            end = match.end()
+        else:
+            return text
+        return text[:end]
+
+
+def _shingles(text: str) -> Set[Tuple[str, ...]]:
+    words = text.split()
+    return {
+        tuple(words[start:start + _SHINGLE])
+        for start in range(max(len(words) - _SHINGLE + 1, 1))
+    }
+
+
+class ContextPacker:
+    def __init__(
+        self,
+        budget: int = 2000,
+        passage_budget: int = 400,
+        counter: Optional[TokenCounter] = None
+    ):
+        self.budget = budget
+        self.passage_budget = passage_budget
+        self.counter = counter or TokenCounter()
+
+    def pack(self, documents: Sequence[str], metadatas: Sequence[Optional[dict]]) -> Tuple[str, int]:
+        """
+        Context for the documents of a query, in rank order, the best first.
+        Returns the context and its size in tokens.
+        """
+        count = self.counter.count
+        sources: Dict[str, List[str]] = {}
+        covered: Set[Tuple[str, ...]] = set()
+        used = 0
+        retrieved = 0
+        for document, metadata in zip(documents, metadatas):
+            if not isinstance(metadata, dict):
+                continue
+            source = metadata.get("channel_name", "Unknown")
+            text = document
+            prefix = _PREFIX_RE.match(document)
+            if prefix and document.startswith(f"{source}! ", prefix.end()):
+                # The channels are in the header of the source
+                text = document[prefix.end() + len(source) + 2:]
+            text = text.strip()
+            if not text:
+                continue
+            retrieved += count(text)
+            remaining = self.budget - used
+            if remaining < _MIN_PASSAGE_TOKENS:
+                continue
+
+            shingles = _shingles(text)
+            if len(shingles & covered) >= _OVERLAP * len(shingles):
+                continue
+
+            header = 0 if source in sources else count(f"{source}:\n")
+            text = self.counter.truncate(text, min(self.passage_budget, remaining - header - 2))
+            if not text:
+                continue
+            cost = header + count(f"- {text}\n")
+            if cost > remaining:
+                continue
+            covered |= shingles
+            sources.setdefault(source, []).append(text)
+            used += cost
+
+        CONTEXT_TOKENS.labels(kind="retrieved").inc(retrieved)
+        CONTEXT_TOKENS.labels(kind="packed").inc(used)
+        context = "".join(
+            f"{source}:\n" + "".join(f"- {text}\n" for text in texts)
+            for source, texts in sources.items()
+        )
+        return context, used
@@ -0,0 +1,113 @@
+"""
+Near-duplicate posts. News channels repost each other, so the same story comes
+from many channels of a request.
+
+Posts are compared by MinHash signatures of their word 3-shingles (after
+preprocess_text), candidates are found with LSH banding and confirmed by the
+Jaccard similarity the signatures estimate. Every cluster of near-duplicates is
+embedded, stored and given to the LLM once, as its first post, with all of its channels.
+"""
+import zlib
+from functools import lru_cache
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from source.Metrics import REGISTRY
+
+
+DUPLICATE_POSTS = REGISTRY.counter(
+    "telerag_duplicate_posts_total",
+    "Posts that were collapsed into a near-duplicate from another post of the request.",
+)
+
+NUM_PERM = 128
+# 32 bands of 4 rows: pairs similar above ~0.4 are likely to become candidates
+_BANDS = 32
+_ROWS = NUM_PERM // _BANDS
+# Odd multipliers that combine the hashes of 3 consecutive words into the hash of a shingle
+_SHINGLE_MIX = (np.uint64(0x9E3779B97F4A7C15), np.uint64(0xC2B2AE3D27D4EB4F))
+_SHIFT = np.uint64(32)
+
+
+@lru_cache(maxsize=None)
+def _permutations(num_perm: int) -> Tuple[np.ndarray, np.ndarray]:
+    # The same in every process, signatures are compared across workers
+    generator = np.random.default_rng(1)
+    a = generator.integers(0, 1 << 63, num_perm, dtype=np.uint64) | np.uint64(1)
+    b = generator.integers(0, 1 << 63, num_perm, dtype=np.uint64)
+    return a, b
+
+
+def _shingles(words: List[str]) -> np.ndarray:
+    # crc32, not hash(): str hashes are salted per process
+    hashes = np.fromiter(
+        (zlib.crc32(word.encode()) for word in words), dtype=np.uint64, count=len(words))
+    if len(hashes) < 3:
+        return hashes
+    first, second = _SHINGLE_MIX
+    return hashes[:-2] * first + hashes[1:-1] * second + hashes[2:]
+
+
+def minhash(text: str, num_perm: int = NUM_PERM) -> np.ndarray:
+    """MinHash signature of a preprocessed post. A post without words has none (empty array)."""
+    words = text.split()
+    if not words:
+        return np.empty(0, dtype=np.uint32)
+    a, b = _permutations(num_perm)
+    # Multiply-shift hashing, uint64 arithmetic wraps around. The high half
+    # is the hash value, and the shift commutes with the minimum.
+    values = (_shingles(words)[:, None] * a + b).min(axis=0) >> _SHIFT
+    return values.astype(np.uint32)
+
+
+class NearDuplicateIndex:
+    """
+    LSH index of MinHash signatures. add() puts a post into the cluster of the first
+    earlier post that is at least threshold similar to it, or starts a new cluster.
+    """
+
+    def __init__(self, threshold: float = 0.7):
+        self.threshold = threshold
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(_BANDS)]
+        self._signatures: List[np.ndarray] = []
+        self._representatives: List[int] = []
+
+    def add(self, signature: np.ndarray) -> int:
+        """Add the next post. Returns the index of its cluster's first post."""
+        index = len(self._signatures)
+        self._signatures.append(signature)
+        representative = index
+        if len(signature) == NUM_PERM:
+            candidates = set()
+            for band, buckets in enumerate(self._buckets):
+                bucket = buckets.setdefault(
+                    signature[band * _ROWS:(band + 1) * _ROWS].tobytes(), [])
+                candidates.update(bucket)
+                bucket.append(index)
+            for candidate in sorted(candidates):
+                similarity = np.count_nonzero(
+                    self._signatures[candidate] == signature) / NUM_PERM
+                if similarity >= self.threshold:
+                    representative = self._representatives[candidate]
+                    break
+        self._representatives.append(representative)
+        return representative
+
+    def clusters(self) -> List[List[int]]:
+        """Indexes of the posts of every cluster, the representative first, in order of addition."""
+        clusters: Dict[int, List[int]] = {}
+        for index, representative in enumerate(self._representatives):
+            clusters.setdefault(representative, []).append(index)
+        return list(clusters.values())
+
+
+def cluster_near_duplicates(texts: Sequence[str], threshold: float = 0.7) -> List[List[int]]:
+    """
+    Group preprocessed posts into clusters of near-duplicates, a task of the TaskScheduler.
+    Returns lists of indexes into texts, each starting with the post that represents the cluster.
+    """
+    index = NearDuplicateIndex(threshold)
+    for text in texts:
+        index.add(minhash(text))
+    return index.clusters()
@@ -0,0 +1,31 @@
+"""
+Embedding in the worker processes of the TaskScheduler.
+Every process loads a model once and keeps it for the following tasks.
+"""
+from typing import Dict, List, TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+
+_models: Dict[str, "SentenceTransformer"] = {}
+
+
+def get_model(model_name: str) -> "SentenceTransformer":
+    model = _models.get(model_name)
+    if model is None:
+        from sentence_transformers import SentenceTransformer
+        model = _models[model_name] = SentenceTransformer(model_name)
+    return model
+
+
+def load_model(model_name: str) -> int:
+    """Load the model ahead of the first task. Returns the size of its embeddings."""
+    return get_model(model_name).get_sentence_embedding_dimension()
+
+
+def encode_batch(texts: List[str], model_name: str) -> np.ndarray:
+    """Embeddings of texts, one float32 row per text."""
+    return np.asarray(get_model(model_name).encode(texts), dtype=np.float32)
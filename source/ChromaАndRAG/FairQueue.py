@@ -0,0 +1,139 @@
+import asyncio
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, List, Tuple
+
+
+def request_cost(task: dict) -> int:
+    """Cost of a RAG request in channels: its posts are fetched, embedded and searched per channel."""
+    return max(len(task.get("channels") or task.get("texts") or ()), 1)
+
+
+class FairRequestQueue:
+    """
+    Bounded request queue that is fair across users.
+
+    Every user has its own FIFO. Dequeueing uses deficit round robin: each time a user's
+    turn comes, its deficit grows by `quantum`, and it is served while the deficit covers
+    the cost of its next request. A request's cost is estimated by `cost` (for RAG requests:
+    channels x posts), so a user asking over 50 channels waits proportionally more turns
+    than a user with one channel instead of occupying the queue.
+
+    Has the subset of the asyncio.Queue interface the RAG loop uses. put_nowait() raises
+    asyncio.QueueFull when either the whole queue or the user's own queue is full.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 0,
+        max_per_user: int = 0,
+        quantum: float = 1.0,
+        cost: Callable[[Any], float] = lambda item: 1.0,
+        key: Callable[[Any], Hashable] = lambda item: item["user_id"],
+    ):
+        self.maxsize = maxsize
+        self.max_per_user = max_per_user
+        self.quantum = quantum
+        self._cost = cost
+        self._key = key
+
+        self._queues: Dict[Hashable, Deque[Tuple[float, Any]]] = {}
+        self._deficit: Dict[Hashable, float] = {}
+        self._active: Deque[Hashable] = deque()
+        self._turn_started = False
+        self._size = 0
+        self._getters: Deque[asyncio.Future] = deque()
+
+    def qsize(self) -> int:
+        return self._size
+
+    def empty(self) -> bool:
+        return self._size == 0
+
+    def full(self) -> bool:
+        return 0 < self.maxsize <= self._size
+
+    def user_qsize(self, user_key: Hashable) -> int:
+        return len(self._queues.get(user_key, ()))
+
+    def put_nowait(self, item: Any):
+        if self.full():
+            raise asyncio.QueueFull
+        user_key = self._key(item)
+        queue = self._queues.get(user_key)
+        if queue is None:
+            queue = self._queues[user_key] = deque()
+            self._deficit[user_key] = 0.0
+            self._active.append(user_key)
+        elif 0 < self.max_per_user <= len(queue):
+            raise asyncio.QueueFull
+        queue.append((max(self._cost(item), 0.0), item))
+        self._size += 1
+        self._wakeup()
+
+    async def put(self, item: Any):
+        self.put_nowait(item)
+
+    def get_nowait(self) -> Any:
+        if self._size == 0:
+            raise asyncio.QueueEmpty
+        return self._pop()
+
+    async def get(self) -> Any:
+        while self._size == 0:
+            getter = asyncio.get_running_loop().create_future()
+            self._getters.append(getter)
+            try:
+                await getter
+            except asyncio.CancelledError:
+                woken = getter.done() and not getter.cancelled()
+                getter.cancel()
+                if getter in self._getters:
+                    self._getters.remove(getter)
+                if woken and self._size:
+                    # Pass the wakeup on to the next waiting consumer.
+                    self._wakeup()
+                raise
+        return self._pop()
+
+    def remove(self, user_key: Hashable) -> List[Any]:
+        """
+        Remove and return all queued items of a user.
+        """
+        queue = self._queues.get(user_key)
+        if queue is None:
+            return []
+        self._size -= len(queue)
+        self._drop_user(user_key)
+        return [item for _, item in queue]
+
+    def _pop(self) -> Any:
+        while True:
+            user_key = self._active[0]
+            queue = self._queues[user_key]
+            if not self._turn_started:
+                self._deficit[user_key] += self.quantum
+                self._turn_started = True
+            cost, item = queue[0]
+            if self._deficit[user_key] >= cost:
+                self._deficit[user_key] -= cost
+                queue.popleft()
+                self._size -= 1
+                if not queue:
+                    self._drop_user(user_key)
+                return item
+            self._active.rotate(-1)
+            self._turn_started = False
+
+    def _drop_user(self, user_key: Hashable):
+        if self._active and self._active[0] == user_key:
+            self._turn_started = False
+        del self._queues[user_key]
+        del self._deficit[user_key]
+        self._active.remove(user_key)
+
+    def _wakeup(self):
+        while self._getters:
+            getter = self._getters.popleft()
+            if not getter.done():
+                getter.set_result(None)
+                break
@@ -2,20 +2,54 @@ import os
 import nltk
 import emoji
 import string
+from functools import lru_cache
+from typing import List, Optional
 from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
 
+from source.Logging import Logger
+
 full_path = os.path.dirname(os.path.abspath(__file__))
 
+_PUNCTUATION = str.maketrans('', '', string.punctuation)
 
-def preprocess_text(text: str, lang: str = "russian") -> str:
+
+@lru_cache(maxsize=None)
+def _text_logger() -> Logger:
+    # Created on first use, importing the module must not create the LoggerComposer
+    return Logger("TextProcessing", "network.log")
+
+
+@lru_cache(maxsize=None)
+def _stop_words(lang: str) -> frozenset:
+    # Once per process: nltk checks its data on every download() call
     nltk.download('punkt_tab', download_dir='./../../nltk_data')
     nltk.download('stopwords', download_dir='./../../nltk_data')
     nltk.data.path.append(f'{full_path}/../../nltk_data')
+    return frozenset(stopwords.words(lang))
+
+
+def preprocess_text(text: str, lang: str = "russian") -> str:
+    stop_words = _stop_words(lang)
     text = emoji.replace_emoji(text, replace='')
     text = text.lower()
-    text = text.translate(str.maketrans('', '', string.punctuation))
+    text = text.translate(_PUNCTUATION)
     tokens = word_tokenize(text, language=lang)
-    stop_words = set(stopwords.words(lang))
     tokens = [word for word in tokens if word not in stop_words]
     return ' '.join(tokens)
+
+
+def preprocess_batch(texts: List[str], lang: str = "russian") -> List[Optional[str]]:
+    """
+    preprocess_text() for a batch of posts, one task of the TaskScheduler.
+    Lone surrogates are dropped first. A post that fails is logged and becomes None.
+    """
+    results = []
+    for text in texts:
+        try:
+            sanitized_text = text.encode("utf-16", "surrogatepass").decode("utf-16", "ignore")
+            results.append(preprocess_text(sanitized_text, lang))
+        except Exception as e:
+            _text_logger().error("Error processing text: %s. Error: %s", text, e)
+            results.append(None)
+    return results
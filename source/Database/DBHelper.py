@@ -1,9 +1,11 @@
-from typing import List, Optional
+from typing import List, Optional, TYPE_CHECKING
 
 from source.Logging import Logger
 from source.Database.database import DatabaseManager, User, Channel
 from source.Database.crud import CRUD
-from source.TelegramMessageScrapper.PyroClient import PyroClient
+
+if TYPE_CHECKING:
+    from source.TelegramMessageScrapper.PyroClient import PyroClient
 
 
 class DataBaseHelper:
@@ -16,7 +18,7 @@ class DataBaseHelper:
     def __init__(
         self,
         db_manager: DatabaseManager,
-        scrapper: Optional[PyroClient]
+        scrapper: Optional["PyroClient"]
     ):
         self.logger = Logger("PostgreSQL", "network.log")
         self.db_manager = db_manager
@@ -27,7 +29,7 @@ class DataBaseHelper:
     async def create(
         cls,
         db_url: str = "",
-        scrapper: PyroClient = None
+        scrapper: Optional["PyroClient"] = None
     ) -> "DataBaseHelper":
         """
         Фабричный метод для создания DataBaseHelper.
@@ -43,7 +45,7 @@ class DataBaseHelper:
         await db_manager.init()
         self = cls(db_manager, scrapper)
         await self._setup()
-        await self.logger.info("PostgreSQL connected")
+        self.logger.info("PostgreSQL connected")
         return self
 
     async def _setup(self):
@@ -52,7 +54,7 @@ class DataBaseHelper:
         async with self.db_manager.get_session() as session:
             # Просто проверка что подключение работает
             pass
-        await self.logger.info("PostgreSQL connection established successfully")
+        self.logger.info("PostgreSQL connection established successfully")
 
     # ============= USER METHODS =============
 
@@ -0,0 +1,510 @@
+import asyncio
+import os
+import socket
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import bindparam, insert, text
+from sqlalchemy.dialects.postgresql import JSONB
+
+from source.Logging import Logger
+from source.Database.database import DatabaseManager, RagJob
+
+
+NOTIFY_CHANNEL = "rag_jobs"
+# Префикс NOTIFY о завершении задания, за ним идёт id задания
+FINISHED_PREFIX = "done:"
+
+
+@dataclass
+class JobRecord:
+    id: int
+    user_id: Optional[int]
+    payload: dict
+    attempts: int
+    # Если обработчик выставил result, задание не удаляется,
+    # а ждёт, пока отправитель заберёт результат через wait_result()
+    result: Optional[dict] = None
+    # Задание удалили из таблицы, пока оно выполнялось (cancel_user)
+    cancelled: bool = False
+
+
+class RagJobQueue:
+    """
+    Надёжная очередь заданий RAG поверх таблицы rag_jobs.
+
+    Задания забираются через SELECT ... FOR UPDATE SKIP LOCKED, поэтому
+    любое количество процессов может работать с одной очередью.
+    Взятое задание невидимо для остальных воркеров до locked_until
+    (visibility timeout). Если воркер умер, задание снова станет
+    доступным после истечения таймаута. Новые задания будят воркеров
+    через LISTEN/NOTIFY, опрос таблицы остаётся только как страховка.
+
+    Как и FairRequestQueue, очередь ограничена (max_pending, max_pending_per_user:
+    enqueue() бросает asyncio.QueueFull) и справедлива между пользователями.
+    Задания забираются по fair_tag (start-time fair queuing): задание пользователя
+    начинается не раньше, чем закончится его предыдущее (fair_tag + cost), и не раньше
+    текущего виртуального времени очереди. Пользователь с дорогими запросами
+    (cost - число каналов) ждёт пропорционально дольше, а не занимает очередь.
+    Так же через NOTIFY узнаёт о завершении задания wait_result().
+    Завершённые задания, которые никто не забрал (результат после таймаута
+    ожидания, окончательно упавшие задания без ожидающего), воркеры
+    удаляют через result_retention секунд после завершения.
+    """
+
+    def __init__(
+        self,
+        db_manager: DatabaseManager,
+        queue: str = "rag",
+        visibility_timeout: int = 300,
+        max_attempts: int = 3,
+        retry_backoff: float = 5.0,
+        poll_interval: float = 5.0,
+        result_retention: float = 3600.0,
+        max_pending: int = 0,
+        max_pending_per_user: int = 0,
+        cost: Callable[[Any], float] = lambda payload: 1.0,
+    ):
+        self.logger = Logger("JobQueue", "network.log")
+        self.db_manager = db_manager
+        self.queue = queue
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.poll_interval = poll_interval
+        self.result_retention = result_retention
+        self.max_pending = max_pending
+        self.max_pending_per_user = max_pending_per_user
+        self._cost = cost
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+        self._wakeup = asyncio.Event()
+        # id задания -> событие его завершения, для wait_result()
+        self._finished: Dict[int, asyncio.Event] = {}
+        self._listen_connection = None
+        self._listen_lock = asyncio.Lock()
+        self._running = False
+        self._next_purge = 0.0
+
+    # ============= PRODUCER =============
+
+    async def enqueue(self, payload: dict, user_id: Optional[int] = None) -> int:
+        """
+        Поставить задание в очередь и разбудить воркеров.
+        NOTIFY уходит вместе с коммитом транзакции.
+        Бросает asyncio.QueueFull, если заполнена вся очередь или очередь пользователя.
+        """
+        async with self.db_manager.get_session() as session:
+            # Постановки в одну очередь идут по одной: счётчики и fair_tag
+            # не устаревают до INSERT
+            await session.execute(
+                text("SELECT pg_advisory_xact_lock(hashtext(:queue))"),
+                {"queue": self.queue}
+            )
+            state = (await session.execute(
+                text(
+                    "SELECT count(*) FILTER (WHERE status = 'pending') AS pending, "
+                    "count(*) FILTER (WHERE status = 'pending' "
+                    "  AND user_id IS NOT DISTINCT FROM :user_id) AS user_pending, "
+                    "greatest("
+                    "  coalesce(max(fair_tag + cost) "
+                    "    FILTER (WHERE user_id IS NOT DISTINCT FROM :user_id), 0), "
+                    "  coalesce(max(fair_tag) FILTER (WHERE status = 'running'), 0), "
+                    "  coalesce(min(fair_tag) FILTER (WHERE status = 'pending'), 0)"
+                    ") AS fair_tag "
+                    "FROM rag_jobs WHERE queue = :queue "
+                    "AND status IN ('pending', 'running')"
+                ),
+                {"queue": self.queue, "user_id": user_id}
+            )).one()
+            if (0 < self.max_pending <= state.pending
+                    or 0 < self.max_pending_per_user <= state.user_pending):
+                raise asyncio.QueueFull
+            result = await session.execute(
+                insert(RagJob).values(
+                    queue=self.queue,
+                    user_id=user_id,
+                    payload=payload,
+                    status="pending",
+                    attempts=0,
+                    max_attempts=self.max_attempts,
+                    cost=max(self._cost(payload), 0.0),
+                    fair_tag=state.fair_tag,
+                ).returning(RagJob.id)
+            )
+            job_id = result.scalar_one()
+            await session.execute(
+                text("SELECT pg_notify(:channel, :queue)"),
+                {"channel": NOTIFY_CHANNEL, "queue": self.queue}
+            )
+        self.logger.debug("Enqueued job %s to '%s'", job_id, self.queue)
+        return job_id
+
+    async def cancel_user(
+        self,
+        user_id: int,
+        queues: Optional[Iterable[str]] = None
+    ) -> int:
+        """
+        Отменить все незавершённые задания пользователя в указанных очередях
+        (по умолчанию во всех). Ожидающие задания просто удаляются,
+        выполняющиеся воркер прервёт на ближайшем heartbeat,
+        когда не найдёт свою строку. Возвращает число отменённых заданий.
+        """
+        query = (
+            "DELETE FROM rag_jobs WHERE user_id = :user_id "
+            "AND status IN ('pending', 'running')"
+        )
+        params = {"user_id": user_id}
+        if queues is not None:
+            query += " AND queue = ANY(:queues)"
+            params["queues"] = list(queues)
+        async with self.db_manager.get_session() as session:
+            result = await session.execute(text(query), params)
+        if result.rowcount:
+            self.logger.info(
+                "Cancelled %s jobs of user %s", result.rowcount, user_id)
+        return result.rowcount
+
+    # ============= CONSUMER =============
+
+    async def claim(self, limit: int = 1) -> List[JobRecord]:
+        """
+        Забрать до limit доступных заданий.
+        Задания с истёкшим visibility timeout и исчерпанными попытками
+        помечаются как failed.
+        """
+        async with self.db_manager.get_session() as session:
+            expired = await session.execute(
+                text(
+                    "UPDATE rag_jobs SET status = 'failed', locked_until = NULL, "
+                    "last_error = coalesce(last_error, 'visibility timeout expired'), "
+                    "updated_at = now() "
+                    "WHERE queue = :queue AND status = 'running' "
+                    "AND locked_until < now() AND attempts >= max_attempts "
+                    "RETURNING id"
+                ),
+                {"queue": self.queue}
+            )
+            for row in expired.all():
+                await self._notify_finished(session, row.id)
+            result = await session.execute(
+                text(
+                    "WITH picked AS ("
+                    "  SELECT id FROM rag_jobs"
+                    "  WHERE queue = :queue AND attempts < max_attempts AND ("
+                    "    (status = 'pending' AND available_at <= now())"
+                    "    OR (status = 'running' AND locked_until < now())"
+                    "  )"
+                    "  ORDER BY fair_tag, id"
+                    "  FOR UPDATE SKIP LOCKED"
+                    "  LIMIT :limit"
+                    ") "
+                    "UPDATE rag_jobs AS j SET status = 'running', "
+                    "attempts = j.attempts + 1, "
+                    "locked_until = now() + make_interval(secs => :visibility), "
+                    "locked_by = :worker, updated_at = now() "
+                    "FROM picked WHERE j.id = picked.id "
+                    "RETURNING j.id, j.user_id, j.payload, j.attempts"
+                ),
+                {
+                    "queue": self.queue,
+                    "limit": limit,
+                    "visibility": self.visibility_timeout,
+                    "worker": self.worker_id,
+                }
+            )
+            return [
+                JobRecord(id=row.id, user_id=row.user_id,
+                          payload=row.payload, attempts=row.attempts)
+                for row in result
+            ]
+
+    async def complete(self, job: JobRecord) -> None:
+        """
+        Задание выполнено. Без результата удаляем его из таблицы,
+        с результатом оставляем в статусе done для wait_result()
+        и сообщаем о завершении через NOTIFY.
+        """
+        async with self.db_manager.get_session() as session:
+            if job.result is None:
+                await session.execute(
+                    text("DELETE FROM rag_jobs WHERE id = :id AND locked_by = :worker"),
+                    {"id": job.id, "worker": self.worker_id}
+                )
+                return
+            await session.execute(
+                text(
+                    "UPDATE rag_jobs SET status = 'done', result = :result, "
+                    "locked_until = NULL, updated_at = now() "
+                    "WHERE id = :id AND locked_by = :worker"
+                ).bindparams(bindparam("result", type_=JSONB)),
+                {"id": job.id, "worker": self.worker_id, "result": job.result}
+            )
+            await self._notify_finished(session, job.id)
+
+    async def wait_result(self, job_id: int, timeout: float = 30.0) -> dict:
+        """
+        Дождаться результата задания и убрать его из таблицы.
+        Используется для RPC между ролями. Ждёт NOTIFY о завершении задания,
+        таблица перепроверяется раз в poll_interval секунд на случай,
+        если LISTEN недоступен или уведомление потерялось.
+        Бросает TimeoutError, если задание не завершилось вовремя,
+        и RuntimeError, если оно упало окончательно.
+        """
+        await self._listen()
+        finished = self._finished.setdefault(job_id, asyncio.Event())
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        try:
+            while True:
+                # Сбрасываем до проверки: NOTIFY, пришедший во время
+                # запроса, не потеряется
+                finished.clear()
+                async with self.db_manager.get_session() as session:
+                    result = await session.execute(
+                        text(
+                            "DELETE FROM rag_jobs WHERE id = :id "
+                            "AND status IN ('done', 'failed') "
+                            "RETURNING status, result, last_error"
+                        ),
+                        {"id": job_id}
+                    )
+                    row = result.first()
+                if row is not None:
+                    if row.status == "failed":
+                        raise RuntimeError(f"Job {job_id} failed: {row.last_error}")
+                    return row.result
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise TimeoutError(f"Job {job_id} did not finish in {timeout} seconds")
+                try:
+                    await asyncio.wait_for(
+                        finished.wait(), timeout=min(remaining, self.poll_interval))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._finished.pop(job_id, None)
+
+    async def purge(self) -> int:
+        """
+        Удалить завершённые задания очереди, которые пролежали дольше
+        result_retention секунд: их результат уже никто не заберёт.
+        Возвращает число удалённых заданий.
+        """
+        async with self.db_manager.get_session() as session:
+            result = await session.execute(
+                text(
+                    "DELETE FROM rag_jobs WHERE queue = :queue "
+                    "AND status IN ('done', 'failed') "
+                    "AND updated_at < now() - make_interval(secs => :retention)"
+                ),
+                {"queue": self.queue, "retention": self.result_retention}
+            )
+        if result.rowcount:
+            self.logger.info(
+                "Purged %s finished jobs from '%s'", result.rowcount, self.queue)
+        return result.rowcount
+
+    async def fail(self, job: JobRecord, error: str) -> None:
+        """
+        Задание упало. Если попытки не исчерпаны, возвращаем его в очередь
+        с экспоненциальной задержкой, иначе помечаем как failed.
+        """
+        delay = self.retry_backoff * (2 ** max(job.attempts - 1, 0))
+        async with self.db_manager.get_session() as session:
+            result = await session.execute(
+                text(
+                    "UPDATE rag_jobs SET "
+                    "status = CASE WHEN attempts < max_attempts "
+                    "THEN 'pending' ELSE 'failed' END, "
+                    "available_at = now() + make_interval(secs => :delay), "
+                    "locked_until = NULL, locked_by = NULL, "
+                    "last_error = :error, updated_at = now() "
+                    "WHERE id = :id AND locked_by = :worker "
+                    "RETURNING status"
+                ),
+                {"id": job.id, "worker": self.worker_id,
+                 "delay": delay, "error": error}
+            )
+            row = result.first()
+            if row is not None and row.status == "failed":
+                await self._notify_finished(session, job.id)
+        self.logger.warning(
+            "Job %s failed (attempt %s/%s): %s", job.id, job.attempts, self.max_attempts, error
+        )
+
+    async def release(self, job: JobRecord) -> None:
+        """
+        Вернуть задание в очередь без траты попытки
+        (например, при остановке воркера).
+        """
+        async with self.db_manager.get_session() as session:
+            await session.execute(
+                text(
+                    "UPDATE rag_jobs SET status = 'pending', "
+                    "attempts = greatest(attempts - 1, 0), "
+                    "available_at = now(), locked_until = NULL, "
+                    "locked_by = NULL, updated_at = now() "
+                    "WHERE id = :id AND locked_by = :worker"
+                ),
+                {"id": job.id, "worker": self.worker_id}
+            )
+            await session.execute(
+                text("SELECT pg_notify(:channel, :queue)"),
+                {"channel": NOTIFY_CHANNEL, "queue": self.queue}
+            )
+
+    async def extend(self, job: JobRecord) -> bool:
+        """
+        Продлить visibility timeout для долгого задания.
+        Возвращает False, если задание больше не принадлежит воркеру.
+        """
+        async with self.db_manager.get_session() as session:
+            result = await session.execute(
+                text(
+                    "UPDATE rag_jobs SET "
+                    "locked_until = now() + make_interval(secs => :visibility), "
+                    "updated_at = now() "
+                    "WHERE id = :id AND locked_by = :worker"
+                ),
+                {"id": job.id, "worker": self.worker_id,
+                 "visibility": self.visibility_timeout}
+            )
+        return result.rowcount > 0
+
+    @asynccontextmanager
+    async def lease(self, job: JobRecord):
+        """
+        Держать задание, пока выполняется тело контекста.
+        Успех -> complete, исключение -> fail, отмена -> release.
+        Пока задание в работе, visibility timeout периодически продлевается.
+        Если задание отменили через cancel_user, тело контекста прерывается,
+        а отмена не выходит за его пределы.
+        """
+        heartbeat = asyncio.create_task(
+            self._heartbeat(job, asyncio.current_task()))
+        try:
+            yield job
+        except asyncio.CancelledError:
+            heartbeat.cancel()
+            if job.cancelled:
+                asyncio.current_task().uncancel()
+                self.logger.info("Job %s was cancelled", job.id)
+                return
+            await self.release(job)
+            raise
+        except Exception as e:
+            heartbeat.cancel()
+            await self.fail(job, repr(e))
+        else:
+            heartbeat.cancel()
+            await self.complete(job)
+
+    async def consume(self) -> AsyncIterator[JobRecord]:
+        """
+        Бесконечно отдаёт задания из очереди.
+        Ждёт NOTIFY, а если его нет, перепроверяет таблицу
+        раз в poll_interval секунд (истёкшие таймауты, отложенные retry).
+        Попутно удаляет давно завершённые задания (purge).
+        """
+        self._running = True
+        await self._listen()
+        try:
+            while self._running:
+                self._wakeup.clear()
+                await self._purge_due()
+                jobs = await self.claim()
+                if jobs:
+                    for job in jobs:
+                        yield job
+                    continue
+                try:
+                    await asyncio.wait_for(
+                        self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if not self._finished:
+                await self._unlisten()
+
+    async def stop(self) -> None:
+        self._running = False
+        self._wakeup.set()
+        await self._unlisten()
+
+    async def _purge_due(self) -> None:
+        now = asyncio.get_running_loop().time()
+        if now < self._next_purge:
+            return
+        self._next_purge = now + max(self.result_retention / 10, self.poll_interval)
+        try:
+            await self.purge()
+        except Exception as e:
+            self.logger.warning(
+                "Could not purge finished jobs of '%s': %s", self.queue, e)
+
+    # ============= LISTEN/NOTIFY =============
+
+    async def _heartbeat(self, job: JobRecord, holder: asyncio.Task) -> None:
+        # Продлеваем не реже poll_interval, чтобы отмена задания
+        # замечалась быстро, а не через треть visibility timeout
+        interval = max(min(self.visibility_timeout / 3, self.poll_interval), 1)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                held = await self.extend(job)
+            except Exception as e:
+                self.logger.warning(
+                    "Could not extend visibility of job %s: %s", job.id, e)
+                continue
+            if not held:
+                job.cancelled = True
+                holder.cancel()
+                return
+
+    async def _notify_finished(self, session, job_id: int) -> None:
+        # Уходит вместе с коммитом транзакции, которая завершила задание
+        await session.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": NOTIFY_CHANNEL, "payload": f"{FINISHED_PREFIX}{job_id}"}
+        )
+
+    def _on_notify(self, connection, pid, channel, payload) -> None:
+        if payload.startswith(FINISHED_PREFIX):
+            finished = self._finished.get(int(payload[len(FINISHED_PREFIX):]))
+            if finished is not None:
+                finished.set()
+        elif payload == self.queue:
+            self._wakeup.set()
+
+    async def _listen(self) -> None:
+        """
+        Подписаться на NOTIFY через отдельное asyncpg-соединение из пула.
+        Соединение общее для consume() и wait_result().
+        Если не получилось, работаем только опросом таблицы.
+        """
+        async with self._listen_lock:
+            if self._listen_connection is not None:
+                return
+            try:
+                connection = await self.db_manager.engine.connect()
+                raw = await connection.get_raw_connection()
+                await raw.driver_connection.add_listener(
+                    NOTIFY_CHANNEL, self._on_notify)
+                self._listen_connection = connection
+            except Exception as e:
+                self.logger.warning(
+                    "LISTEN %s failed, falling back to polling: %s", NOTIFY_CHANNEL, e)
+
+    async def _unlisten(self) -> None:
+        connection, self._listen_connection = self._listen_connection, None
+        if connection is None:
+            return
+        try:
+            raw = await connection.get_raw_connection()
+            await raw.driver_connection.remove_listener(
+                NOTIFY_CHANNEL, self._on_notify)
+        finally:
+            await connection.close()
@@ -0,0 +1,29 @@
+"""Add result column to rag_jobs
+
+Revision ID: b41f0c6e8a27
+Revises: 7c2e4a91d5f3
+Create Date: 2026-10-18 14:21:07.518930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b41f0c6e8a27'
+down_revision: Union[str, Sequence[str], None] = '7c2e4a91d5f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('rag_jobs', sa.Column('result', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('rag_jobs', 'result')
@@ -0,0 +1,30 @@
+"""Add cost and fair_tag columns to rag_jobs for fair queuing
+
+Revision ID: d93a5be17c40
+Revises: b41f0c6e8a27
+Create Date: 2026-10-19 11:32:40.184215
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd93a5be17c40'
+down_revision: Union[str, Sequence[str], None] = 'b41f0c6e8a27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('rag_jobs', sa.Column('cost', sa.Float(), server_default='1', nullable=False))
+    op.add_column('rag_jobs', sa.Column('fair_tag', sa.Float(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('rag_jobs', 'fair_tag')
+    op.drop_column('rag_jobs', 'cost')
@@ -22,7 +22,7 @@ class CRUD:
             select(User).where(User.id == user_id)
         )
         if existing_user.scalar_one_or_none():
-            await self.logger.warning(f"User '{user_id}' already exists")
+            self.logger.warning("User '%s' already exists", user_id)
             raise ValueError("User already exists")
         
         user = User(id=user_id, name=name)
@@ -90,7 +90,7 @@ class CRUD:
             select(Channel).where(Channel.id == channel_id)
         )
         if existing_channel.scalar_one_or_none():
-            await self.logger.warning(f"Channel '{channel_id}' already exists")
+            self.logger.warning("Channel '%s' already exists", channel_id)
             raise ValueError("Channel already exists")
         
         channel = Channel(id=channel_id, name=name)
@@ -106,7 +106,7 @@ class CRUD:
         channel = result.scalar_one_or_none()
         
         if not channel:
-            await self.logger.warning(f"Channel '{channel_id}' not found")
+            self.logger.warning("Channel '%s' not found", channel_id)
             raise ValueError("Channel not found")
         
         return channel
@@ -116,8 +116,8 @@ class CRUD:
         channel = await self.get_channel(channel_id)
         
         if channel.subscribers > 0:
-            await self.logger.warning(
-                f"Cannot delete channel '{channel_id}' - has {channel.subscribers} subscribers"
+            self.logger.warning(
+                "Cannot delete channel '%s' - has %s subscribers", channel_id, channel.subscribers
             )
             raise ValueError("Channel has subscribers")
         
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Table, create_engine, BigInteger
+from sqlalchemy import Column, Integer, String, ForeignKey, Table, create_engine, BigInteger, DateTime, Float, Text, Index, func
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base, relationship
 from contextlib import asynccontextmanager
@@ -52,6 +53,42 @@ class Channel(Base):
         return len(self.users)
 
 
+class RagJob(Base):
+    """SQLAlchemy модель задания в очереди RAG"""
+    __tablename__ = 'rag_jobs'
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    queue = Column(String, nullable=False, default='rag')
+    user_id = Column(BigInteger, nullable=True)
+    payload = Column(JSONB, nullable=False)
+    # Результат задания, которого ждёт отправитель (RPC между ролями)
+    result = Column(JSONB, nullable=True)
+
+    # pending -> running -> (удаляется) | done | pending (retry) | failed
+    status = Column(String, nullable=False, default='pending')
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    last_error = Column(Text, nullable=True)
+
+    # Справедливая очередь (start-time fair queuing): задания забираются по fair_tag,
+    # задание пользователя начинается не раньше, чем закончится его предыдущее (fair_tag + cost)
+    cost = Column(Float, nullable=False, default=1.0, server_default='1')
+    fair_tag = Column(Float, nullable=False, default=0.0, server_default='0')
+
+    # Задание невидимо для воркеров до available_at (отложенный retry)
+    # и до locked_until, пока его держит воркер (visibility timeout)
+    available_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    locked_until = Column(DateTime(timezone=True), nullable=True)
+    locked_by = Column(String, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index('ix_rag_jobs_queue_status_available', 'queue', 'status', 'available_at'),
+    )
+
+
 class DatabaseManager:
     """Менеджер для работы с подключением к БД"""
     
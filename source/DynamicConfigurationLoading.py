@@ -1,18 +1,73 @@
+from typing import List
+
 from pydantic_settings import BaseSettings
 
 class TGConfig(BaseSettings):
     LOG_LEVEL: str = "INFO"
+    # text - строки для чтения глазами, json - по JSON-объекту на строку
+    LOG_FORMAT: str = "text"
+    # Логи пишутся пачками: файл сбрасывается, когда в буфере набралось
+    # LOG_FLUSH_SIZE символов или прошло LOG_FLUSH_INTERVAL секунд
+    LOG_FLUSH_SIZE: int = 65536
+    LOG_FLUSH_INTERVAL: float = 1.0
+    # Очередь логов ограничена. Что делать с записями, которые не поместились:
+    # LOOSE - отбросить новую, DROP_OLDEST - отбросить самую старую,
+    # KEEP - ждать места, PRINT - вывести в stderr
+    LOG_QUEUE_SIZE: int = 10000
+    LOG_OVERFLOW_POLICY: str = "LOOSE"
+    LOG_DROP_REPORT_INTERVAL: float = 60.0
+    # Ротация логов: NONE, SIZE ("50 mb"), TIME ("1 day") или TIME_SIZE ("1 day|50 mb").
+    # Старые файлы сжимаются gzip, хранится не больше LOG_KEEP_FILES (0 - все)
+    LOG_ROTATION: str = "SIZE"
+    LOG_ROTATION_AMOUNT: str = "50 mb"
+    LOG_COMPRESS: bool = True
+    LOG_KEEP_FILES: int = 10
+    # Последние записи всех уровней (и ниже LOG_LEVEL) хранятся в памяти,
+    # по LOG_RING_SIZE на уровень (0 отключает), и выгружаются в LOG_DUMP_DIR
+    # по SIGUSR1 или командой администратора /logdump
+    LOG_RING_SIZE: int = 1000
+    LOG_RING_LEVEL: str = "DEBUG"
+    LOG_DUMP_DIR: str = "./logs"
+    # Одинаковые сообщения (по шаблону) пишутся не больше LOG_REPEAT_BURST раз
+    # за LOG_REPEAT_WINDOW секунд, остальные заменяются строкой "repeated N times" (0 отключает)
+    LOG_REPEAT_BURST: int = 10
+    LOG_REPEAT_WINDOW: float = 10.0
 
     RAG_HOST: str = "localhost"
     RAG_PORT: int = 8080
     RAG_N_RESULT: int = 5
     SENTENCE_TRANSFORMER_MODEL: str = "sentence-transformers/all-MiniLM-L6-v2"
+    # Предобработка и эмбеддинги постов в пуле процессов (процесс с моделью ingest или монолит).
+    # Каждый процесс загружает свою копию модели, поэтому по умолчанию их немного.
+    # RAG_WORKER_PROCESSES: 0 - по числу доступных процессу CPU
+    RAG_PROCESS_POOL: bool = True
+    RAG_WORKER_PROCESSES: int = 2
+    # Разделяемая память (МБ), через которую процессы возвращают эмбеддинги без pickle (0 отключает)
+    RAG_SHARED_MEMORY_MB: int = 64
+    # Фоновая загрузка (задачи с "background") уступает вопросам пулы процессов и
+    # Pyrogram, но получает не меньше RAG_BACKGROUND_SHARE выдаваемых слотов
+    RAG_BACKGROUND_SHARE: float = 0.2
+    # Вопрос ищется только в RAG_ROUTE_CHANNELS каналах, ближайших к нему по центрам
+    # их постов (RAG_ROUTING_CENTERS на канал), и в ещё не проиндексированных (0 - во всех)
+    RAG_ROUTE_CHANNELS: int = 10
+    RAG_ROUTING_CENTERS: int = 3
+    # Почти одинаковые посты (репосты) с похожестью не меньше RAG_DEDUP_THRESHOLD
+    # эмбеддятся и попадают в контекст один раз, со всеми своими каналами (0 отключает)
+    RAG_DEDUP_THRESHOLD: float = 0.7
+    # Найденные посты укладываются в RAG_CONTEXT_TOKENS токенов промпта, не больше
+    # RAG_PASSAGE_TOKENS на пост. Токены считает локальный токенизатор Hugging Face
+    # RAG_CONTEXT_TOKENIZER (пустой - оценка по словам, с запасом)
+    RAG_CONTEXT_TOKENS: int = 2000
+    RAG_PASSAGE_TOKENS: int = 400
+    RAG_CONTEXT_TOKENIZER: str = ""
     MISTRAL_API_KEY: str = ""
     MISTRAL_API_MODEL: str = "mistral-7b"
 
     PYRO_API_ID: str = ""
     PYRO_API_HASH: str = ""
     PYRO_HISTORY_LIMIT: int = 100
+    # Сколько каналов читается одновременно
+    PYRO_FETCH_CONCURRENCY: int = 2
 
     # PostgreSQL Configuration (вместо MongoDB)
     POSTGRES_USER: str = "telerag_user"
@@ -21,7 +76,66 @@ class TGConfig(BaseSettings):
     POSTGRES_PORT: int = 5432
     POSTGRES_DB: str = "telerag_db"
 
+    # Очередь запросов RAG: "memory" (asyncio.Queue) или "postgres" (rag_jobs)
+    RAG_QUEUE_BACKEND: str = "memory"
+    RAG_JOB_VISIBILITY_TIMEOUT: int = 300
+    RAG_JOB_MAX_ATTEMPTS: int = 3
+    RAG_JOB_RETRY_BACKOFF: float = 5.0
+    RAG_JOB_POLL_INTERVAL: float = 5.0
+    # Через сколько секунд удаляются завершённые задания, которые никто не забрал
+    RAG_JOB_RESULT_RETENTION: float = 3600.0
+
+    # Допуск запросов: ограничение размера очереди (memory и postgres) и частоты вопросов пользователя
+    RAG_QUEUE_MAX_SIZE: int = 100
+    RAG_QUEUE_MAX_PER_USER: int = 3
+    RAG_USER_RATE: float = 0.1
+    RAG_USER_BURST: int = 3
+    # Новый вопрос пользователя отменяет его предыдущие, ещё не отвеченные
+    RAG_SUPERSEDE_STALE: bool = True
+
     AIOGRAM_API_KEY: str = ""
+    # Telegram id администраторов, JSON-список: [123, 456]
+    ADMIN_USER_IDS: List[int] = []
+
+    # Режим получения обновлений: "polling" или "webhook"
+    BOT_MODE: str = "polling"
+    # Сколько обновлений обрабатывается одновременно (в обоих режимах)
+    BOT_HANDLER_WORKERS: int = 16
+    BOT_UPDATE_QUEUE_SIZE: int = 1000
+
+    WEBHOOK_BASE_URL: str = ""
+    WEBHOOK_PATH: str = "/webhook"
+    WEBHOOK_HOST: str = "0.0.0.0"
+    WEBHOOK_PORT: int = 8080
+    WEBHOOK_SECRET: str = ""
+
+    # Отправка ответов: лимиты Telegram на бота и на один чат
+    DELIVERY_WORKERS: int = 8
+    DELIVERY_GLOBAL_RATE: float = 30.0
+    DELIVERY_CHAT_RATE: float = 1.0
+    DELIVERY_CHAT_BURST: int = 3
+    DELIVERY_MAX_RETRIES: int = 5
+
+    # Метрики в формате Prometheus, 0 отключает HTTP-эндпоинт.
+    # Монолит слушает METRICS_PORT, роли METRICS_PORT + 1 (bot), + 2 (ingest), + 3 (query)
+    METRICS_HOST: str = "127.0.0.1"
+    METRICS_PORT: int = 9470
+    # Мониторинг задержки event loop: период замера (0 отключает)
+    # и задержка, после которой в лог пишется стек главного потока
+    LOOP_MONITOR_INTERVAL: float = 0.1
+    LOOP_LAG_THRESHOLD: float = 0.25
+    # Сэмплирующий профилировщик: включается сразу при старте,
+    # по SIGUSR2 или командой администратора /profile
+    PROFILER_ENABLED: bool = False
+    PROFILER_RATE: float = 100.0
+    PROFILER_DIR: str = "profiles"
+    PROFILER_ROTATE_INTERVAL: float = 60.0
+    PROFILER_KEEP_FILES: int = 60
+    # Трассировка запросов: доля сохраняемых трасс и время,
+    # после которого трасса сохраняется всегда
+    TRACE_SAMPLE_RATE: float = 0.01
+    TRACE_SLOW_THRESHOLD: float = 30.0
+    TRACE_FILE: str = "./logs/traces.jsonl"
 
     class Config:
         env_file = ".env"
@@ -11,32 +11,73 @@ Key Components:
 
 2. Logger Infrastructure:
    - BaseLogger: Abstract base class defining the logger interface.
-   - Logger: Implements asynchronous logging, maintains a message queue, and writes logs to files.
+   - Logger: Checks the level and hands records to the FileGateway of its file without awaiting.
    - LoggerComposer: Manages and registers logger instances, ensuring a singleton pattern for global access.
    - ComposerMeta: A metaclass that automates logger registration to the LoggerComposer.
 
 3. Log Levels and Rotation:
    - LogLevel: Enumerates available log levels (DEBUG, INFO, WARNING, ERROR, etc.).
    - RotType: Defines the rotation type for log files (NONE, TIME, SIZE, TIME_SIZE).
-   - LogPolicy: Specifies policies to handle failed flush attempts (PRINT, LOOSE, KEEP).
-   - FileGateway: Handles file operations, message buffering, and log file rotation based on configured policies.
+   - RepeatFilter: Per logger, writes the first records of a message template in a time window
+     and a "repeated N times" summary instead of the rest, so error storms do not flood the disk.
+   - LogPolicy: What to do with records that do not fit into a gateway's bounded queue or that
+     failed to flush (LOOSE, DROP_OLDEST, KEEP, PRINT).
+   - FileGateway: Owns the one queue of a log file, formats records as text or NDJSON lines
+     and writes them in batches,
+     rotates log files based on configured policies. Rotated files are renamed with a timestamp
+     suffix, gzipped and pruned in a worker thread.
 
 4. Utility Functions:
    - aprint and aprint_err: Asynchronous print functions to stdout and stderr respectively.
-   - stop_logging: Shuts down all loggers and file gateways gracefully.
+   - dump_recent_records: Writes the records kept in the RecordRing (recent records of every
+     level, including those below the file level) to a file.
+   - stop_logging: Shuts down all loggers and file gateways gracefully, writing what is queued.
+
+5. Child Processes:
+   - init_process_logging: Initializer for child processes. Their loggers get ProcessGateways that
+     send records over a multiprocessing queue to the LogListener of the parent, the single writer
+     of the files. Records of one child keep their order.
 
 Usage:
 - Instantiate a Logger (or a subclass) to start logging. The creation process automatically registers
   it via ComposerMeta.
 - Configure logging levels and file rotation settings as needed.
-- Use async methods like info, debug, error, etc., for logging messages.
-- Call stop_logging() after the application completes its logging tasks to ensure proper shutdown.
+- Use methods like info, debug, error, etc., for logging messages. They do not block and are
+  called without await; awaiting one still works, and under LogPolicy.KEEP it waits until the
+  record is queued. Pass %-style arguments or a callable instead of an f-string so that
+  filtered messages are never formatted.
+- Await stop_logging() after the application completes its logging tasks to ensure proper shutdown.
 """
 
-import asyncio, enum, sys, os, aiofiles
+import asyncio, enum, gzip, json, multiprocessing, queue, re, reprlib, shutil, sys, os, threading, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from types import MappingProxyType
-from typing import Optional
+from typing import BinaryIO, Deque, Dict, List, Optional, Tuple
+
+from source.Tracing import current_trace_id
+# Start of the session in the header of a text or a JSON log file
+_HEADER_STAMP_RE = re.compile(rb'[Tt]imestamp"?: ?(\d+)')
+# json.dumps() with arguments builds a new encoder on every call
+_JSON_ENCODER = json.JSONEncoder(ensure_ascii=False, default=str)
+_MILLISECONDS = tuple(f"{ms:03d}" for ms in range(1000))
+
+
+def _json_value(value) -> str:
+    # Encoding a whole dict goes through the slow generic path, scalars do not have to
+    if isinstance(value, str):
+        return _JSON_ENCODER.encode(value)
+    if value is None:
+        return "null"
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if type(value) is int:
+        return str(value)
+    return _JSON_ENCODER.encode(value)
+
 class LoggingCreationException(Exception):
     pass
 class LoggingCancellation(Exception):
@@ -138,9 +179,52 @@ class LoggerComposer:
             )
         return cls._instance
 
-    def __init__(self, loglevel: str):
+    def __init__(
+        self,
+        loglevel: str,
+        flush_size: int = 64 * 1024,
+        flush_interval: float = 1.0,
+        max_queue: int = 10000,
+        policy: str = "LOOSE",
+        report_interval: float = 60.0,
+        rotation: str = "NONE",
+        rotation_amount: str = "",
+        compress: bool = True,
+        keep_files: int = 0,
+        log_format: str = "text",
+        ring_size: int = 0,
+        ring_level: str = "DEBUG",
+        dump_dir: str = "./logs",
+        repeat_burst: int = 0,
+        repeat_window: float = 10.0
+    ):
         self._loggers = {}
+        self._gateways: Dict[str, "FileGateway"] = {}
         self.level = loglevel_dict.get(loglevel, LogLevel.NOTSET)
+        # Passed to every FileGateway created through this composer
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.policy = LogPolicy[policy.upper()]
+        self.report_interval = report_interval
+        # Rotation of every log file, amount as in FileGateway.set_file_rotation()
+        self.rotation = RotType[rotation.upper()]
+        self.rotation_amount = rotation_amount
+        self.compress = compress
+        self.keep_files = keep_files
+        # "text" lines for people or "json" lines for log shippers
+        self.json_format = log_format.lower() == "json"
+        # Recent records of every logger, kept in memory for dump_recent_records()
+        self.ring = RecordRing(ring_size) if ring_size > 0 else None
+        self.ring_level = loglevel_dict.get(ring_level.upper(), LogLevel.DEBUG)
+        self.dump_dir = dump_dir
+        # Every logger writes at most repeat_burst records of a template per repeat_window
+        self.repeat_burst = repeat_burst
+        self.repeat_window = repeat_window
+        # Records of child processes: received by the listener here,
+        # sent to log_queue by the gateways of a child's composer
+        self._listener: Optional[LogListener] = None
+        self.log_queue = None
 
     def __contains__(self, item):
         return item in self._loggers
@@ -159,8 +243,13 @@ class LoggerComposer:
         """
         if name in self._loggers:
             raise ValueError(f"Logger {name} already exists.")
+        logger._ring = self.ring
+        logger._ring_threshold = self.ring_level.value if self.ring is not None else _DISABLED
+        if self.repeat_burst > 0:
+            logger._repeats = RepeatFilter(name, self.repeat_burst, self.repeat_window)
         logger._level = self.level
         gateway.start()
+        self._gateways.setdefault(file_location, gateway)
         self._loggers[name] = (logger, file_location, gateway)
 
     def remove_logger(self, name: str):
@@ -181,19 +270,59 @@ class LoggerComposer:
         """
         Returns file gateway if exists. Otherwise, returns None.
         """
-        for logger in self._loggers.values():
-            if logger[1] == file:
-                return logger[2]
-        return None
+        return self._gateways.get(file)
 
-    def stop_everything(self):
+    def gateway_for(self, file: str) -> 'FileGateway':
+        """
+        Returns the gateway of a file, creating it with the composer's settings.
+        In a child process set up by init_process_logging() it is a ProcessGateway.
         """
-        Stop all loggers. Use this after the app is done.
+        gateway = self._gateways.get(file)
+        if gateway is not None:
+            return gateway
+        if self.log_queue is not None:
+            gateway = ProcessGateway(file, self.log_queue)
+        else:
+            gateway = FileGateway(
+                file,
+                flush_size=self.flush_size,
+                flush_interval=self.flush_interval,
+                max_queue=self.max_queue,
+                policy=self.policy,
+                report_interval=self.report_interval,
+                json_format=self.json_format,
+            )
+            if self.rotation != RotType.NONE:
+                gateway.set_file_rotation(self.rotation, self.rotation_amount)
+                gateway.set_retention(self.compress, self.keep_files)
+        gateway.start()
+        self._gateways[file] = gateway
+        return gateway
+
+    def process_log_queue(self) -> "multiprocessing.Queue":
+        """
+        Queue to pass to init_process_logging() in child processes.
+        Starts the LogListener that writes their records on first use.
+        """
+        if self._listener is None:
+            self._listener = LogListener(self)
+            self._listener.start()
+        return self._listener.queue
+
+    async def stop_everything(self):
         """
+        Stop all loggers and write what they have queued. Use this after the app is done.
+        Waits for the gateways to finish compressing rotated files.
+        """
+        if self._listener is not None:
+            await self._listener.stop()
+            self._listener = None
         for logger in self._loggers.values():
             logger[0].stop()
-            logger[2].stop()
+        for gateway in self._gateways.values():
+            await gateway.stop()
         self._loggers = {}
+        self._gateways = {}
 
     def set_level_if_not_set(self):
         """
@@ -222,12 +351,12 @@ class ComposerMeta(type):
         return cls._instance
 
     @classmethod
-    def _stop_all_sig(cls):
+    async def _stop_all_sig(cls):
         """
         Stop all loggers.
         """
         composer = cls._get_composer()
-        composer.stop_everything()
+        await composer.stop_everything()
 
     def __call__(cls, *args, **kwargs):
         """
@@ -236,17 +365,16 @@ class ComposerMeta(type):
         with all the checks
         """
         composer = cls._get_composer()
-        logger_name = kwargs.get("name", "default")
-        logfile_location = kwargs.get("file", "log.txt")
+        # Loggers are usually created as Logger("Name", "file.log")
+        logger_name = args[0] if len(args) > 0 else kwargs.get("name", "default")
+        logfile_location = args[1] if len(args) > 1 else kwargs.get("file", "log.txt")
 
         logfile_location = "./logs/" + logfile_location
 
         if logger_name in composer:
             return composer.get_logger(logger_name)
 
-        gateway = composer.get_gateway_if_exists(logfile_location)
-        if gateway is None:
-            gateway = FileGateway(logfile_location)
+        gateway = composer.gateway_for(logfile_location)
 
         logger = super().__call__(*args, **kwargs)
         logger._file_gateway = gateway
@@ -271,9 +399,68 @@ class RotType(enum.Enum):
     SIZE = 2
     TIME_SIZE = 3
 
+class LogPolicy(enum.Enum):
+    """
+    What a FileGateway does with records it cannot write: when its queue is full,
+    and with a batch the file refused.
+    """
+    LOOSE = 0        # drop the new record
+    DROP_OLDEST = 1  # drop the oldest queued record to make room
+    KEEP = 2         # the record waits for room: in the log call if it is awaited, else in a task
+    PRINT = 3        # write the record to stderr instead
+
+class _Logged:
+    """
+    What the logging methods return. Logging does not wait for anything, but the methods
+    used to be coroutines, so `await logger.info(...)` has to keep working.
+    """
+    __slots__ = ()
+
+    def __await__(self):
+        return iter(())
+
+
+_LOGGED = _Logged()
+# Queued by a gateway to wake its own task up
+_WAKE = ()
+
+
+class _Blocked:
+    """
+    Returned by a log call under LogPolicy.KEEP whose record went to the backlog
+    of the gateway. The record is queued whether the call is awaited or not,
+    awaiting it waits until the record is in the queue.
+    """
+    __slots__ = ("_queued",)
+
+    def __init__(self, queued: asyncio.Future):
+        self._queued = queued
+
+    def __await__(self):
+        return self._queued.__await__()
+
+_DEBUG = LogLevel.DEBUG.value
+_INFO = LogLevel.INFO.value
+_WARNING = LogLevel.WARNING.value
+_ERROR = LogLevel.ERROR.value
+_FATAL = LogLevel.FATAL.value
+_EXCEPTION = LogLevel.EXCEPTION.value
+_DISABLED = LogLevel.NOTSET.value + 1
+
+
 class Logger(BaseLogger, metaclass=ComposerMeta):
     """
     This is a logger class. It logs messages to the log file. Pretty much nothing to explain. Logger is logger, not a rocket.
+
+    Logging is synchronous and never waits: the level is checked first, then a record is put
+    straight into the queue of the file gateway, which formats and writes it in its own task.
+    Messages may be %-style templates with arguments or callables returning the message,
+    both are only formatted if the record passes the level check. Extra fields become
+    fields of the record in the JSON format and key=value pairs in the text one:
+
+        logger.debug("Retrieved task %s", task)
+        logger.debug(lambda: expensive_summary(posts))
+        logger.info("Answer delivered", extra={"user_id": user_id})
     """
     def __init__(self, name: str = "default", file: str = "log.txt"):
         """
@@ -281,14 +468,27 @@ class Logger(BaseLogger, metaclass=ComposerMeta):
         """
         print("Initialized logger " + name + " at " + file)
         self.name = name
-        self._level = LogLevel.NOTSET
-        self._buffer = []
-        self._message_queue: asyncio.Queue = asyncio.Queue()
-        self._queue_processing_task: Optional[asyncio.Task] = None
         self._logging = True
+        # Set by the composer: records at or above _ring_threshold also go to the ring
+        self._ring: Optional[RecordRing] = None
+        self._ring_threshold = _DISABLED
+        self._repeats: Optional[RepeatFilter] = None
+        self._level = LogLevel.NOTSET
         self._file_gateway: Optional[FileGateway] = None
         self._file_location = file
 
+    @property
+    def _level(self) -> LogLevel:
+        return self.__level
+
+    @_level.setter
+    def _level(self, level: LogLevel):
+        self.__level = level
+        # Plain ints compared on every call, Enum.value is too slow for that
+        self._threshold = level.value if self._logging else _DISABLED
+        # A record is created at all if it goes to the file or to the ring
+        self._record_threshold = min(self._threshold, self._ring_threshold)
+
     def set_level(self, level: LogLevel):
         """
         Set the level of the logger. It will not be changed later.
@@ -297,108 +497,449 @@ class Logger(BaseLogger, metaclass=ComposerMeta):
             return
         self._level = level
 
-    def _create(self):
-        """
-        Create the logger. It creates the log file and starts the logging loop.
-        """
-        if self._queue_processing_task is not None or self._logging is False:
-            return
-        self._queue_processing_task = asyncio.create_task(self._process_queue())
-        self._logging = True
+    def is_enabled_for(self, loglevel: LogLevel) -> bool:
+        return loglevel.value >= self._record_threshold
 
-    async def log(self, loglevel: LogLevel, message: str):
+    def log(self, loglevel: LogLevel, message, *args, extra: Optional[dict] = None) -> _Logged:
         """
         Log a message to the log file.
         """
-        int_level = loglevel.value
-        int_self_level = self._level.value
-        if self._level == LogLevel.QUIET:
-            return
         if loglevel == LogLevel.SIGSTOP:
-            await self._message_queue.put(None)
-            return
-        if int_level >= int_self_level:
-            await self._message_queue.put((loglevel, message))
+            self.stop()
+        elif loglevel.value >= self._record_threshold:
+            return self._emit(loglevel, loglevel.value, message, args, extra)
+        return _LOGGED
+
+    def _emit(self, loglevel: LogLevel, value: int, message, args: tuple, extra: Optional[dict]):
+        # Time and trace are taken here, formatting happens in the gateway's task or on dump
+        created = time.time()
+        write = value >= self._threshold
+        if write and self._repeats is not None:
+            write = self._check_repeats(value, message, created)
+            if not write and value < self._ring_threshold:
+                return _LOGGED
+        record = (created, self.name, loglevel, message, args, current_trace_id(), extra)
+        if value >= self._ring_threshold:
+            self._ring.add(value, record)
+        if write:
+            return self._file_gateway.put(record)
+        return _LOGGED
+
+    def _check_repeats(self, value: int, message, now: float) -> bool:
+        """Whether the RepeatFilter lets the record through, writes the summary of its last window."""
+        # The template is the key, the message is not formatted to be compared. Other
+        # messages, like a dict or an exception, are keyed by their type: they may be
+        # unhashable and must not be kept alive by the filter
+        template = message if message.__class__ is str else getattr(message, "__code__", message.__class__)
+        repeated = self._repeats.allow((value, template), now)
+        if repeated < 0:
+            self._file_gateway.watch_repeats(self._repeats)
+            return False
+        if repeated:
+            self._file_gateway.put(self._repeats.summary((value, template), repeated, now))
+        return True
+
+    def info(self, message, *args, extra: Optional[dict] = None) -> _Logged:
+        if self._record_threshold <= _INFO:
+            return self._emit(LogLevel.INFO, _INFO, message, args, extra)
+        return _LOGGED
+
+    def debug(self, message, *args, extra: Optional[dict] = None) -> _Logged:
+        if self._record_threshold <= _DEBUG:
+            return self._emit(LogLevel.DEBUG, _DEBUG, message, args, extra)
+        return _LOGGED
+
+    def warning(self, message, *args, extra: Optional[dict] = None) -> _Logged:
+        if self._record_threshold <= _WARNING:
+            return self._emit(LogLevel.WARNING, _WARNING, message, args, extra)
+        return _LOGGED
+
+    def error(self, message, *args, extra: Optional[dict] = None) -> _Logged:
+        if self._record_threshold <= _ERROR:
+            return self._emit(LogLevel.ERROR, _ERROR, message, args, extra)
+        return _LOGGED
+
+    def fatal(self, message, *args, extra: Optional[dict] = None) -> _Logged:
+        if self._record_threshold <= _FATAL:
+            return self._emit(LogLevel.FATAL, _FATAL, message, args, extra)
+        return _LOGGED
+
+    def exception(self, message, *args, extra: Optional[dict] = None) -> _Logged:
+        if self._record_threshold <= _EXCEPTION:
+            return self._emit(LogLevel.EXCEPTION, _EXCEPTION, message, args, extra)
+        return _LOGGED
+
+    def stop(self):
+        if self._repeats is not None and self._logging:
+            for record in self._repeats.summaries(time.time(), everything=True):
+                self._file_gateway.put(record)
+        self._logging = False
+        self._threshold = self._record_threshold = _DISABLED
 
-        if self._queue_processing_task is None:
-            self._create()
 
-    async def info(self, message):
-        await self.log(LogLevel.INFO, message)
+# Arguments the ring keeps as they are, anything else is kept as a short repr
+_RING_PLAIN = frozenset((str, int, float, bool, type(None)))
+_ring_repr = reprlib.Repr()
+_ring_repr.maxstring = _ring_repr.maxother = 200
 
-    async def debug(self, message):
-        await self.log(LogLevel.DEBUG, message)
 
-    async def warning(self, message):
-        await self.log(LogLevel.WARNING, message)
+def _ring_value(value):
+    return value if value.__class__ in _RING_PLAIN else _ring_repr.repr(value)
 
-    async def error(self, message):
-        await self.log(LogLevel.ERROR, message)
 
-    async def fatal(self, message):
-        await self.log(LogLevel.FATAL, message)
+class RecordRing:
+    """
+    The most recent records of all loggers, in a preallocated ring per level, so that
+    DEBUG context is at hand after an incident even when the files are written at INFO.
+    Templates are formatted only on dump(), but the ring keeps no objects alive: arguments
+    and extra values other than strings and numbers are stored as reprlib reprs, and
+    callable messages are called, when the record is added. A dump shows the state at log time.
+    """
 
-    async def exception(self, message):
-        await self.log(LogLevel.EXCEPTION, message)
+    def __init__(self, size: int = 1000):
+        self.size = size
+        # Indexed by LogLevel value
+        self._slots: List[List[Optional[tuple]]] = [[None] * size for _ in range(_EXCEPTION + 1)]
+        self._written = [0] * (_EXCEPTION + 1)
+
+    def add(self, level_value: int, record: tuple):
+        created, name, level, message, args, trace_id, extra = record
+        if message.__class__ is not str:
+            # A callable keeps its closure alive, an exception its traceback
+            message, args = FileGateway._message(message, args), ()
+        elif args:
+            args = tuple(map(_ring_value, args))
+        if extra:
+            extra = {key: _ring_value(value) for key, value in extra.items()}
+        record = (created, name, level, message, args, trace_id, extra)
+        written = self._written[level_value]
+        self._slots[level_value][written % self.size] = record
+        self._written[level_value] = written + 1
+
+    def snapshot(self, limit: Optional[int] = None) -> List[tuple]:
+        """The last limit records of all levels, oldest first."""
+        records = [record for slots in self._slots for record in slots if record is not None]
+        records.sort(key=lambda record: record[0])
+        return records[-limit:] if limit else records
 
-    def _apply_decorations(self, level: LogLevel,  message: str) -> str:
+    @staticmethod
+    def write(records: List[tuple], path: str):
+        """Format records into a file. Runs in a worker thread."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temporary = path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            for created, name, level, message, args, trace_id, extra in records:
+                stamp = datetime.fromtimestamp(created).strftime("%m-%d_%H:%M:%S.%f")[:-3]
+                line = f"[{stamp} - {name}/{reversed_loglevel_dict.get(level.value, 'UNKNOWN')}]"
+                if trace_id is not None:
+                    line += f" [trace {trace_id}]"
+                line += " -> " + FileGateway._message(message, args)
+                if extra:
+                    line += " | " + " ".join(f"{key}={value}" for key, value in extra.items())
+                file.write(line + "\n")
+        os.replace(temporary, path)
+
+# Templates a RepeatFilter keeps windows for, f-strings would add a key per message
+_REPEAT_KEYS = 1024
+
+
+class RepeatFilter:
+    """
+    Keeps a logger from writing the same message over and over, like an error path during
+    an outage. Records are keyed by level and template: the message before formatting, the
+    code of a callable message or the type of any other message, so nothing is formatted
+    to be compared. The first
+    burst records of a key in a window of window seconds are written, the rest are only
+    counted and written as one "repeated N times" record when the window ends.
+    """
+
+    def __init__(self, name: str, burst: int, window: float):
+        self.name = name
+        self.burst = burst
+        self.window = window
+        # key -> [window start, records in the window]
+        self._windows: Dict[tuple, list] = {}
+        # Keys with suppressed records in the current window
+        self._suppressing: Dict[tuple, list] = {}
+
+    def allow(self, key: tuple, now: float) -> int:
         """
-        Apply decorations to the message.
+        -1 if the record is suppressed. Otherwise the number of records of the key
+        suppressed in its previous window, to be summarized before this one.
         """
-        level_string = reversed_loglevel_dict.get(level.value, "UNKNOWN")
-        timestamp = datetime.now().strftime("%m-%d_%H:%M:%S")
-        return f"[{timestamp} - {self.name}/{level_string}] -> {message}"
+        entry = self._windows.get(key)
+        if entry is None:
+            if len(self._windows) >= _REPEAT_KEYS:
+                self._forget(now)
+            self._windows[key] = [now, 1]
+            return 0
+        if now - entry[0] >= self.window:
+            repeated = entry[1] - self.burst
+            entry[0] = now
+            entry[1] = 1
+            if repeated > 0:
+                self._suppressing.pop(key, None)
+                return repeated
+            return 0
+        entry[1] += 1
+        if entry[1] <= self.burst:
+            return 0
+        self._suppressing[key] = entry
+        return -1
+
+    def _forget(self, now: float):
+        self._windows = {
+            key: entry for key, entry in self._windows.items()
+            if key in self._suppressing or now - entry[0] < self.window
+        }
+        if len(self._windows) >= _REPEAT_KEYS:
+            self._windows = dict(self._suppressing)
+
+    def next_due(self) -> Optional[float]:
+        """When the first window with suppressed records ends."""
+        if not self._suppressing:
+            return None
+        return min(entry[0] for entry in self._suppressing.values()) + self.window
+
+    def summaries(self, now: float, everything: bool = False) -> List[tuple]:
+        """Summary records of the windows that ended, or of all of them."""
+        records = []
+        for key, entry in list(self._suppressing.items()):
+            if everything or now - entry[0] >= self.window:
+                records.append(self.summary(key, entry[1] - self.burst, now))
+                # The next records of the key start a new window
+                entry[0] = now
+                entry[1] = 0
+                del self._suppressing[key]
+        return records
+
+    def summary(self, key: tuple, repeated: int, now: float) -> tuple:
+        value, template = key
+        if isinstance(template, type):
+            template = f"{template.__qualname__} message"
+        elif not isinstance(template, str):
+            code = getattr(template, "co_filename", None)
+            template = (
+                f"{template.co_name} at {os.path.basename(code)}:{template.co_firstlineno}"
+                if code is not None else repr(template)
+            )
+        return (
+            now, self.name, _LEVELS_BY_VALUE[value],
+            "Message repeated %d more times in %gs: %s",
+            (repeated, self.window, template), None, None,
+        )
 
-    async def _process_queue(self):
-        while self._logging and self._file_gateway:
-            try:
-                level, msg = await self._message_queue.get()
-                if msg is None:
-                    break
-                message = self._apply_decorations(level, msg)
-                await self._file_gateway.enqueue(message)
-            except (asyncio.CancelledError, LoggingCancellation):
-                break
-            except Exception as e:
-                await aprint_err(
-                    f"Logger {self.name} failed to log message: {e}",
-                )
-
-    async def stop(self):
-        self._logging = False
-        await self._message_queue.join()
-        if self._queue_processing_task is not None:
-            self._queue_processing_task.cancel()
-            try:
-                await self._queue_processing_task
-            except asyncio.CancelledError:
-                pass
-        self._queue_processing_task = None
 
 class FileGateway:
     """
     Class made to isolate file interactions from logger or multiple loggers.
+
+    Messages are not written one by one: everything queued is drained into a buffer
+    which is written and flushed in one go (one thread hop) once it holds flush_size
+    characters or the oldest message in it is flush_interval seconds old.
+    The size of the current file is tracked in memory for rotation.
+
+    With json_format every record is written as one JSON object per line (NDJSON)
+    instead of a text line, for log shippers and grep-by-field.
+
+    Summaries of the RepeatFilters of its loggers are written when their windows end.
+
+    The queue holds at most max_queue records. What happens to records that do not fit,
+    or that the file refused, is decided by the policy; how many were lost is written
+    to the log every report_interval seconds.
     """
-    def __init__(self, file_loc: str):
+    def __init__(
+        self,
+        file_loc: str,
+        flush_size: int = 64 * 1024,
+        flush_interval: float = 1.0,
+        max_queue: int = 10000,
+        policy: LogPolicy = LogPolicy.LOOSE,
+        report_interval: float = 60.0,
+        json_format: bool = False
+    ):
         print("Started Logging at " + file_loc)
         self.file_loc = file_loc
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.report_interval = report_interval
         self._start_stamp = int(datetime.now().timestamp())
-        self._message_stream: asyncio.Queue[str] = asyncio.Queue()
+        self._message_stream: asyncio.Queue[Optional[tuple]] = asyncio.Queue(max_queue)
+        # Records lost since the last report, because the queue was full or the write failed
+        self._dropped = 0
+        self._failed = 0
+        self.dropped_total = 0
         self._processing_task: Optional[asyncio.Task] = None
+        # Records waiting for room under LogPolicy.KEEP, queued in order by _drain_backlog()
+        self._backlog: Deque[Tuple[tuple, asyncio.Future]] = deque()
+        self._backlog_task: Optional[asyncio.Task] = None
         self._logging = True
         self._rot_type = RotType.NONE
         self._rot_amt = None
+        self._file: Optional[BinaryIO] = None
+        self._file_size = 0
+        self._compress = False
+        self._keep_files = 0
+        self._compressor: Optional[ThreadPoolExecutor] = None
+        # The formatted timestamp only changes once a second
+        self._stamp_second = -1
+        self._stamp = ""
+        self.json = json_format
+        self._json_constants = {}
+        self._format = self._format_json if json_format else self._format_text
+        # Filters of loggers that are suppressing records, and of the gateway's own errors
+        self._repeat_filters: List[RepeatFilter] = []
+        self._errors = RepeatFilter("FileGateway", 3, report_interval)
 
     def start(self):
         """
-        Start the file gateway.
+        Start the file gateway. Without a running loop it is started by the first record.
         """
         if self._processing_task is not None:
             return
-        self._processing_task = asyncio.create_task(self._stream_process())
+        try:
+            self._processing_task = asyncio.get_running_loop().create_task(
+                self._stream_process())
+        except RuntimeError:
+            pass
+
+    def put(self, record: tuple):
+        """
+        Queue a record (created, logger name, level, message, args, trace id, extra).
+        Returns what the log call returns: something to await.
+        """
+        if not self._logging:
+            # Stopping: nothing may get behind the stop sentinel
+            self._dropped += 1
+            return _LOGGED
+        if self._processing_task is None:
+            self.start()
+        # Behind a backlog a record waits its turn, or it would overtake older ones
+        if not self._backlog:
+            try:
+                self._message_stream.put_nowait(record)
+                return _LOGGED
+            except asyncio.QueueFull:
+                pass
+        if self.policy == LogPolicy.DROP_OLDEST:
+            self._message_stream.get_nowait()
+            self._message_stream.task_done()
+            self._message_stream.put_nowait(record)
+            self._dropped += 1
+        elif self.policy == LogPolicy.KEEP:
+            return self._keep(record)
+        elif self.policy == LogPolicy.PRINT:
+            sys.stderr.write(self._format(record) + "\n")
+        else:
+            self._dropped += 1
+        return _LOGGED
+
+    def _keep(self, record: tuple):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Not on the loop's thread, there is nothing to wait in
+            self._dropped += 1
+            return _LOGGED
+        queued = loop.create_future()
+        self._backlog.append((record, queued))
+        if self._backlog_task is None:
+            self._backlog_task = loop.create_task(self._drain_backlog())
+        return _Blocked(queued)
+
+    async def _drain_backlog(self):
+        try:
+            while self._backlog:
+                record, queued = self._backlog[0]
+                await self._message_stream.put(record)
+                self._backlog.popleft()
+                if not queued.done():
+                    queued.set_result(None)
+        finally:
+            self._backlog_task = None
 
     async def enqueue(self, message: str):
-        await self._message_stream.put(message)
+        """Queue an already formatted line."""
+        await self.put((time.time(), None, None, message, (), None, None))
+
+    def watch_repeats(self, repeats: RepeatFilter):
+        """Write the summary of the filter once its window ends."""
+        if repeats in self._repeat_filters:
+            return
+        self._repeat_filters.append(repeats)
+        if len(self._repeat_filters) == 1 and self._processing_task is not None:
+            # Wake the task up to take the window into account
+            try:
+                self._message_stream.put_nowait(_WAKE)
+            except asyncio.QueueFull:
+                pass
+
+    def _repeat_summaries(self, now: float) -> List[tuple]:
+        records = []
+        for repeats in self._repeat_filters:
+            records.extend(repeats.summaries(now))
+        self._repeat_filters = [repeats for repeats in self._repeat_filters if repeats.next_due()]
+        return records
+
+    @staticmethod
+    def _message(message, args: tuple) -> str:
+        try:
+            if callable(message):
+                return str(message())
+            if args:
+                return message % args
+        except Exception as e:
+            return f"{message!r} % {args!r} failed to format: {e!r}"
+        return str(message)
+
+    def _format_text(self, record: tuple) -> str:
+        created, name, level, message, args, trace_id, extra = record
+        message = self._message(message, args)
+        if name is None:
+            return message
+        second = int(created)
+        if second != self._stamp_second:
+            self._stamp_second = second
+            self._stamp = datetime.fromtimestamp(second).strftime("%m-%d_%H:%M:%S")
+        level_string = reversed_loglevel_dict.get(level.value, "UNKNOWN")
+        if extra:
+            message += " | " + " ".join(f"{key}={value}" for key, value in extra.items())
+        if trace_id is not None:
+            return f"[{self._stamp} - {name}/{level_string}] [trace {trace_id}] -> {message}"
+        return f"[{self._stamp} - {name}/{level_string}] -> {message}"
+
+    def _format_json(self, record: tuple) -> str:
+        """
+        One JSON object per line: ts, logger, level, msg, trace_id and the extra fields.
+        Only msg and the extra fields go through json.dumps, the rest is cached.
+        """
+        created, name, level, message, args, trace_id, extra = record
+        second = int(created)
+        if second != self._stamp_second:
+            self._stamp_second = second
+            self._stamp = '{"ts":"' + time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second)) + "."
+        constants = self._json_constants.get((name, level))
+        if constants is None:
+            level_string = None if level is None else reversed_loglevel_dict.get(level.value, "UNKNOWN")
+            constants = self._json_constants[(name, level)] = (
+                'Z","logger":' + _JSON_ENCODER.encode(name)
+                + ',"level":' + json.dumps(level_string) + ',"msg":'
+            )
+        parts = [
+            self._stamp,
+            _MILLISECONDS[int((created - second) * 1000)],
+            constants,
+            _JSON_ENCODER.encode(self._message(message, args)),
+        ]
+        if trace_id is not None:
+            # Trace ids are hex, nothing to escape
+            parts.append(',"trace_id":"' + trace_id + '"')
+        if extra:
+            for key, value in extra.items():
+                parts.append("," + _JSON_ENCODER.encode(str(key)) + ":" + _json_value(value))
+        parts.append("}")
+        return "".join(parts)
 
     def set_file_rotation(self, rot_type: RotType, amt: str):
         if self._rot_type != RotType.NONE:
@@ -430,20 +971,98 @@ class FileGateway:
                     return True
         return False
 
-    async def _rotate_file(self):
-        self._processing_task.cancel()
-        try:
-            await self._processing_task
-        except asyncio.CancelledError:
-            pass
+    def set_retention(self, compress: bool, keep_files: int):
+        """
+        Gzip rotated files and keep at most keep_files of them (0 keeps all).
+        """
+        self._compress = compress
+        self._keep_files = keep_files
 
-        self._start_stamp = int(datetime.now().timestamp())
+    @property
+    def current_file(self) -> str:
+        """Path of the file that is written now. Rotated files get a timestamp suffix."""
+        return f"{os.path.splitext(self.file_loc)[0]}.log"
+
+    def _open_file(self):
+        """
+        Open the current file and write the session header. Runs in a worker thread.
+        """
+        os.makedirs(os.path.dirname(self.file_loc) or ".", exist_ok=True)
+        self._file = open(self.current_file, mode="ab")
+        self._file_size = os.fstat(self._file.fileno()).st_size
+        # A file left by the previous run is continued, its age counts from its first session
+        self._start_stamp = self._segment_start() if self._file_size else int(time.time())
+        header = self._session_header().encode("utf-8")
+        self._file.write(header)
+        self._file.flush()
+        self._file_size += len(header)
+
+    def _segment_start(self) -> int:
         try:
-            self._processing_task = asyncio.create_task(self._stream_process())
+            with open(self.current_file, "rb") as file:
+                match = _HEADER_STAMP_RE.search(file.read(256))
+        except OSError:
+            match = None
+        return int(match.group(1)) if match else int(time.time())
+
+    def _write(self, data: bytes):
+        """Write and flush a batch. Runs in a worker thread."""
+        self._file.write(data)
+        self._file.flush()
+
+    def _rotated_path(self) -> str:
+        root = os.path.splitext(self.file_loc)[0]
+        now = time.time()
+        # Names sort in rotation order, which pruning relies on
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f"-{int(now * 1000) % 1000:03d}"
+        path = f"{root}_{stamp}.log"
+        suffix = 1
+        while os.path.exists(path) or os.path.exists(path + ".gz"):
+            path = f"{root}_{stamp}-{suffix}.log"
+            suffix += 1
+        return path
+
+    def _rotate_file(self) -> str:
+        """
+        Continue in a new file. Runs in a worker thread.
+        The full file is renamed while it is still open, so the current path
+        always points to a complete file. Returns the new name of the old file.
+        """
+        rotated = self._rotated_path()
+        os.replace(self.current_file, rotated)
+        old_file = self._file
+        try:
+            self._open_file()
         except Exception:
-            await asyncio.sleep(1)
-
-        self._processing_task = asyncio.create_task(self._stream_process())
+            # Keep writing into the renamed file rather than losing records
+            self._file = old_file
+            raise
+        old_file.close()
+        return rotated
+
+    def _compress_and_prune(self, rotated: str):
+        """Runs in the gateway's own worker thread, off the write path."""
+        if self._compress:
+            try:
+                with open(rotated, "rb") as source, gzip.open(rotated + ".gz.tmp", "wb") as target:
+                    shutil.copyfileobj(source, target, 1024 * 1024)
+                os.replace(rotated + ".gz.tmp", rotated + ".gz")
+                os.remove(rotated)
+            except OSError as e:
+                sys.stderr.write(f"FileGateway failed to compress {rotated}: {e}\n")
+        if self._keep_files <= 0:
+            return
+        directory = os.path.dirname(self.file_loc) or "."
+        prefix = os.path.basename(os.path.splitext(self.file_loc)[0]) + "_"
+        rotated_files = sorted(
+            name for name in os.listdir(directory)
+            if name.startswith(prefix) and (name.endswith(".log") or name.endswith(".log.gz"))
+        )
+        for name in rotated_files[:max(len(rotated_files) - self._keep_files, 0)]:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
 
     @staticmethod
     def convert_str_to_size(amt: str):
@@ -466,6 +1085,20 @@ class FileGateway:
         coefficient = time_type_dict.get(time_type.lower(), 1)
         return time_amt * coefficient
 
+    def _session_header(self) -> str:
+        if not self.json:
+            return self.boilerplate_message() + "\n" + "-" * 20 + "\n"
+        now = time.time()
+        return json.dumps({
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(now)) + f".{int(now * 1000) % 1000:03d}Z",
+            "logger": "FileGateway",
+            "level": "INFO",
+            "msg": "Logging session start",
+            "timestamp": int(now),
+            "project": "TELERAG-MONOLITH",
+            "version": "1.0",
+        }) + "\n"
+
     @staticmethod
     def boilerplate_message():
         """
@@ -479,50 +1112,281 @@ class FileGateway:
             f"Version: 1.0\n"
         )
 
+    async def _next_message(self, deadline: Optional[float]):
+        """
+        Wait for a message until deadline (monotonic time).
+        Returns False if the deadline passed first.
+        """
+        if deadline is None:
+            return await self._message_stream.get()
+        try:
+            return await asyncio.wait_for(
+                self._message_stream.get(), max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            return False
+
+    async def _flush(self, pending: List[str]):
+        text = "\n".join(pending) + "\n"
+        data = text.encode("utf-8")
+        try:
+            await asyncio.to_thread(self._write, data)
+        except Exception as e:
+            repeated = self._errors.allow(("write",), time.time())
+            if repeated >= 0:
+                await aprint_err(
+                    f"FileGateway failed to write {len(pending)} messages to file: {e}"
+                    + (f" (and {repeated} more times)" if repeated else ""))
+            if self.policy == LogPolicy.PRINT:
+                await aprint_err(text, end="")
+            else:
+                self._failed += len(pending)
+            return
+        self._file_size += len(data)
+        if self.rotate_if_needed(int(time.time()), self._file_size):
+            try:
+                rotated = await asyncio.to_thread(self._rotate_file)
+            except Exception as e:
+                await aprint_err(f"FileGateway failed to rotate {self.current_file}: {e}")
+                return
+            if self._compressor is None:
+                self._compressor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="LogCompressor")
+            self._compressor.submit(self._compress_and_prune, rotated)
+
+    def _drop_report(self) -> Optional[str]:
+        """A line about the records lost since the last report, if any."""
+        if not self._dropped and not self._failed:
+            return None
+        lost = self._dropped + self._failed
+        self.dropped_total += lost
+        line = self._format((
+            time.time(), "FileGateway", LogLevel.WARNING,
+            "Lost %d log records since the last report: %d did not fit into the queue "
+            "(policy %s), %d could not be written",
+            (lost, self._dropped, self.policy.name, self._failed),
+            None,
+            None,
+        ))
+        self._dropped = 0
+        self._failed = 0
+        return line
+
     async def _stream_process(self):
         """
         Process message stream.
         """
-        should_rotate = False
-        async with aiofiles.open(
-            f"{os.path.splitext(self.file_loc)[0]}_{self._start_stamp}.log",
-            mode="a"
-        ) as IOstream:
-            await IOstream.write(self.boilerplate_message() + "\n" + "-" * 20 + "\n")
-            await IOstream.flush()
-            while self._logging:
-                try:
-                    msg = await self._message_stream.get()
+        await asyncio.to_thread(self._open_file)
+        pending: List[str] = []
+        pending_size = 0
+        deadline: Optional[float] = None
+        next_report = time.monotonic() + self.report_interval
+        stopping = False
+        try:
+            while not stopping:
+                wait_until = deadline
+                if self._dropped or self._failed:
+                    wait_until = min(wait_until or next_report, next_report)
+                if self._repeat_filters:
+                    due = min(repeats.next_due() or 0.0 for repeats in self._repeat_filters)
+                    due = time.monotonic() + max(due - time.time(), 0.0)
+                    wait_until = min(wait_until or due, due)
+                msg = await self._next_message(wait_until)
+                taken = 0
+                # Drain whatever else is already queued without waiting
+                while msg is not False:
                     if msg is None:
+                        stopping = True
+                    elif msg:
+                        line = self._format(msg)
+                        pending.append(line)
+                        pending_size += len(line) + 1
+                    taken += 1
+                    if stopping or pending_size >= self.flush_size or self._message_stream.empty():
                         break
-                    await IOstream.write(msg + "\n")
-                    await IOstream.flush()
-                    if self.rotate_if_needed(int(datetime.now().timestamp()), os.path.getsize(self.file_loc)):
-                        should_rotate = True
-                        break
-
-                except (asyncio.CancelledError, LoggingCancellation):
-                    break
-                except Exception as e:
-                    await aprint_err(
-                        f"FileGateway failed to write message to file: {e}",
-                    )
-
-        if should_rotate:
-            await self._rotate_file()
+                    msg = self._message_stream.get_nowait()
+
+                if self._repeat_filters:
+                    for record in self._repeat_summaries(time.time()):
+                        line = self._format(record)
+                        pending.append(line)
+                        pending_size += len(line) + 1
+                now = time.monotonic()
+                if now >= next_report or stopping:
+                    next_report = now + self.report_interval
+                    report = self._drop_report()
+                    if report is not None:
+                        pending.append(report)
+                        pending_size += len(report) + 1
+                if pending and deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if pending and (
+                    stopping
+                    or pending_size >= self.flush_size
+                    or time.monotonic() >= deadline
+                ):
+                    await self._flush(pending)
+                    pending = []
+                    pending_size = 0
+                    deadline = None
+                for _ in range(taken):
+                    self._message_stream.task_done()
+        finally:
+            if pending:
+                # Cancelled: write what is left without awaiting
+                self._write(("\n".join(pending) + "\n").encode("utf-8"))
+            if self._file is not None:
+                self._file.close()
 
     async def stop(self):
         """
-        Stop the file gateway.
+        Stop the file gateway. Messages queued before the call are written.
         """
         self._logging = False
-        await self._message_stream.join()
+        if self._processing_task is not None:
+            if self._backlog_task is not None:
+                await self._backlog_task
+            await self._message_stream.put(None)
+            try:
+                await self._processing_task
+            except asyncio.CancelledError:
+                pass
+            self._processing_task = None
+        if self._compressor is not None:
+            # Rotated files being compressed are finished, not left half written
+            await asyncio.to_thread(self._compressor.shutdown, wait=True)
+            self._compressor = None
 
-        self._processing_task.cancel()
+_LEVELS_BY_VALUE = MappingProxyType({level.value: level for level in LogLevel})
+_PLAIN_TYPES = (str, int, float, bool, type(None))
+
+
+class ProcessGateway:
+    """
+    Takes the place of FileGateway in a child process: records are formatted here
+    (arguments and callables may not survive pickling) and sent to the LogListener
+    of the parent, which hands them to the FileGateway of the file. A multiprocessing
+    queue sends the records of one process in order, so per-producer order is kept.
+    """
+    def __init__(self, file_loc: str, log_queue: "multiprocessing.Queue"):
+        self.file_loc = file_loc
+        self._queue = log_queue
+        self.dropped_total = 0
+
+    def start(self):
+        pass
+
+    def put(self, record: tuple):
+        created, name, level, message, args, trace_id, extra = record
+        if extra:
+            extra = {
+                str(key): value if isinstance(value, _PLAIN_TYPES) else str(value)
+                for key, value in extra.items()
+            }
         try:
-            await self._processing_task
-        except asyncio.CancelledError:
-            pass
+            self._queue.put_nowait((
+                self.file_loc, created, name, level.value,
+                FileGateway._message(message, args), trace_id, extra,
+            ))
+        except (ValueError, OSError, queue.Full):
+            # The queue was closed, the parent is going away
+            self.dropped_total += 1
+        return _LOGGED
+
+    def watch_repeats(self, repeats: "RepeatFilter"):
+        # No task to wait for the window here: summaries are written
+        # with the next record of the template or when the logger stops
+        pass
+
+    async def stop(self):
+        pass
+
+
+class LogListener:
+    """
+    The single writer for records of child processes. A thread reads them from the
+    queue in batches and hands every batch to the event loop, where each record goes
+    to the composer's ring and to the FileGateway of its file, like a local record.
+    """
+    BATCH = 512
+
+    def __init__(self, composer: LoggerComposer):
+        # A spawn context queue can be handed to spawned and forked children alike
+        self.queue = multiprocessing.get_context("spawn").Queue()
+        self._composer = composer
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Has to be called from the event loop's thread."""
+        self._loop = asyncio.get_running_loop()
+        self._thread = threading.Thread(target=self._receive, name="LogListener", daemon=True)
+        self._thread.start()
+
+    def _receive(self):
+        while True:
+            batch = [self.queue.get()]
+            while batch[-1] is not None and len(batch) < self.BATCH:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._loop.call_soon_threadsafe(self._deliver, batch)
+            except RuntimeError:
+                # The loop is closed
+                return
+            if batch[-1] is None:
+                return
+
+    def _deliver(self, batch: List[Optional[tuple]]):
+        composer = self._composer
+        ring = composer.ring
+        ring_threshold = composer.ring_level.value if ring is not None else _DISABLED
+        threshold = composer.level.value
+        for item in batch:
+            if item is None:
+                break
+            file_loc, created, name, level_value, message, trace_id, extra = item
+            record = (created, name, _LEVELS_BY_VALUE[level_value], message, (), trace_id, extra)
+            if level_value >= ring_threshold:
+                ring.add(level_value, record)
+            if level_value >= threshold:
+                composer.gateway_for(file_loc).put(record)
+
+    async def stop(self):
+        """Write what the children have sent so far and stop."""
+        self.queue.put(None)
+        await asyncio.to_thread(self._thread.join)
+        # Let the batch scheduled last reach the gateways before they are stopped
+        await asyncio.sleep(0)
+        self.queue.close()
+
+
+def init_process_logging(
+    log_queue: "multiprocessing.Queue",
+    loglevel: str = "INFO",
+    repeat_burst: int = 0,
+    repeat_window: float = 10.0
+):
+    """
+    Initializer of a child process (for example of a process pool), the queue comes
+    from LoggerComposer.process_log_queue() in the parent. Loggers created in the child,
+    and the ones it inherited from the parent by fork, send their records to the parent
+    instead of writing the files themselves.
+    """
+    inherited = LoggerComposer._instance
+    composer = LoggerComposer(
+        loglevel=loglevel, repeat_burst=repeat_burst, repeat_window=repeat_window)
+    composer.log_queue = log_queue
+    LoggerComposer._instance = composer
+    ComposerMeta._instance = composer
+    if inherited is None:
+        return
+    for name, (logger, file_location, _) in inherited.get_all().items():
+        logger._logging = True
+        logger._file_gateway = composer.gateway_for(file_location)
+        composer.add_logger(name, logger, file_location, logger._file_gateway)
+
 
 async def aprint(message: str, sep: str = " ",end: str = "\n", *args):
     """
@@ -532,17 +1396,33 @@ async def aprint(message: str, sep: str = " ",end: str = "\n", *args):
         for arg in args:
             message += sep + str(arg)
     message += end
-    await asyncio.to_thread(sys.stdout.write, message.encode("utf-8"))
+    await asyncio.to_thread(sys.stdout.write, message)
 
 async def aprint_err(message: str, sep: str = " ", end: str ="\n", *args):
     if args:
         for arg in args:
             message += sep + str(arg)
     message += end
-    await asyncio.to_thread(sys.stderr.write, message.encode("utf-8"))
+    await asyncio.to_thread(sys.stderr.write, message)
 
-def stop_logging():
+async def dump_recent_records(limit: Optional[int] = None) -> Optional[str]:
+    """
+    Write the last limit records kept in the composer's ring (all of them by default)
+    to a new file in its dump directory. Returns the path, or None if the ring is off.
+    """
+    composer = ComposerMeta._get_composer()
+    if composer.ring is None:
+        return None
+    # Taken in the loop's thread, which is the only one adding records
+    records = composer.ring.snapshot(limit)
+    now = time.time()
+    name = time.strftime("recent-%Y%m%d-%H%M%S", time.localtime(now))
+    path = os.path.join(composer.dump_dir, f"{name}-{int(now * 1000) % 1000:03d}.log")
+    await asyncio.to_thread(RecordRing.write, records, path)
+    return path
+
+async def stop_logging():
     """
     Stop all loggers.
     """
-    ComposerMeta._stop_all_sig()
\ No newline at end of file
+    await ComposerMeta._stop_all_sig()
\ No newline at end of file
@@ -0,0 +1,137 @@
+"""
+Event loop lag monitor.
+
+A heartbeat task sleeps for `interval` and measures how late it wakes up: that lag is how
+long every other coroutine had to wait for the loop. A helper thread watches the heartbeat,
+and while it is overdue by more than `threshold` samples the main thread's stack with
+sys._current_frames(). When the loop gets back, the stall is logged together with the
+sampled stacks, which point at the blocking call (a sync client, model.encode(), ...).
+"""
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from typing import List, Optional, Tuple
+
+from source.Logging import Logger
+from source.Metrics import REGISTRY
+
+
+LOOP_LAG = REGISTRY.histogram(
+    "telerag_event_loop_lag_seconds",
+    "How late the event loop runs a callback that is due.",
+)
+LOOP_STALLS = REGISTRY.counter(
+    "telerag_event_loop_stalls_total",
+    "Times the event loop was blocked for longer than the lag threshold.",
+)
+
+# (filename, lineno, function, line) of every frame, hashable so samples can be counted
+Stack = Tuple[Tuple[str, int, str, str], ...]
+
+
+class LoopLagMonitor:
+    def __init__(
+        self,
+        interval: float = 0.1,
+        threshold: float = 0.25,
+        stack_depth: int = 15,
+    ):
+        self.monitor_logger = Logger("LoopMonitor", "network.log")
+        self.interval = interval
+        self.threshold = threshold
+        self.stack_depth = stack_depth
+
+        self._loop_thread_id: Optional[int] = None
+        self._last_beat = time.monotonic()
+        self._samples: Counter = Counter()
+        self._lock = threading.Lock()
+        self._running = False
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+
+    async def start(self):
+        """
+        Start monitoring the running loop. Has to be called from the loop's thread.
+        """
+        if self._running:
+            return
+        self._running = True
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(
+            target=self._watch, name="LoopLagMonitor", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._running = False
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join)
+            self._thread = None
+
+    async def _heartbeat(self):
+        lag_histogram = LOOP_LAG.labels()
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._last_beat = now
+            lag = max(now - expected, 0.0)
+            lag_histogram.record(lag)
+
+            samples = self._take_samples()
+            if lag >= self.threshold:
+                LOOP_STALLS.labels().inc()
+                self.monitor_logger.warning(self._format_stall(lag, samples))
+
+    def _watch(self):
+        """
+        Runs in the helper thread. Samples the loop thread's stack while the heartbeat is late.
+        """
+        period = max(self.threshold / 4, 0.01)
+        while self._running:
+            time.sleep(period)
+            if time.monotonic() - self._last_beat < self.interval + self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = tuple(
+                (entry.filename, entry.lineno, entry.name, entry.line)
+                for entry in traceback.extract_stack(frame)[-self.stack_depth:]
+            )
+            del frame
+            with self._lock:
+                self._samples[stack] += 1
+
+    def _take_samples(self) -> List[Tuple[Stack, int]]:
+        with self._lock:
+            if not self._samples:
+                return []
+            samples = self._samples.most_common()
+            self._samples = Counter()
+        return samples
+
+    def _format_stall(self, lag: float, samples: List[Tuple[Stack, int]]) -> str:
+        lines = [f"Event loop was blocked for {lag:.3f}s"]
+        if not samples:
+            lines.append("(stall was too short to sample the stack)")
+        total = sum(count for _, count in samples)
+        for stack, count in samples[:3]:
+            lines.append(
+                f"Main thread stack in {count}/{total} samples (innermost last):")
+            lines.extend(
+                line.rstrip("\n")
+                for line in traceback.StackSummary.from_list(list(stack)).format()
+            )
+        return "\n".join(lines)
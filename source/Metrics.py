@@ -0,0 +1,333 @@
+"""
+Metrics of the RAG pipeline.
+
+Latencies are recorded into HDR-style histograms: values are kept in log-linear buckets
+with a fixed relative error (under 1%), so quantiles are accurate from microseconds
+to hours in a few kilobytes per histogram and recording is O(1).
+Everything is exposed in the Prometheus text format by MetricsServer.
+
+    with stage("embed"):
+        embeddings = model.encode(texts)
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+from source.Logging import Logger
+from source.Tracing import record_span
+
+
+# Every power of two range is split into 2**(SUB_BUCKET_BITS - 1) linear buckets
+SUB_BUCKET_BITS = 8
+_SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+_SUB_BUCKET_HALF = _SUB_BUCKET_COUNT >> 1
+# Values are recorded in microseconds, up to about 1.2 hours
+_MAX_VALUE = (1 << 32) - 1
+_BUCKETS = (
+    (_MAX_VALUE.bit_length() - SUB_BUCKET_BITS + 1) * _SUB_BUCKET_HALF
+    + _SUB_BUCKET_HALF
+)
+
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+def _index(value: int) -> int:
+    if value < _SUB_BUCKET_COUNT:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return (shift + 1) * _SUB_BUCKET_HALF + (value >> shift) - _SUB_BUCKET_HALF
+
+
+def _upper_bound(index: int) -> int:
+    """Largest value that falls into the bucket."""
+    if index < _SUB_BUCKET_COUNT:
+        return index
+    shift = index // _SUB_BUCKET_HALF - 1
+    sub_bucket = index - shift * _SUB_BUCKET_HALF
+    return ((sub_bucket + 1) << shift) - 1
+
+
+class Histogram:
+    """
+    Latency histogram in seconds with microsecond resolution.
+    Thread safe, so it can be fed from worker threads.
+    """
+
+    def __init__(self):
+        self._counts: List[int] = [0] * _BUCKETS
+        self._lock = threading.Lock()
+        self.count = 0
+        self.sum = 0.0
+        self.min = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        value = min(max(int(seconds * 1_000_000), 0), _MAX_VALUE)
+        with self._lock:
+            self._counts[_index(value)] += 1
+            if self.count == 0 or seconds < self.min:
+                self.min = seconds
+            if seconds > self.max:
+                self.max = seconds
+            self.count += 1
+            self.sum += seconds
+
+    def quantiles(self, quantiles: Sequence[float] = QUANTILES) -> List[float]:
+        """Values (in seconds) below which the given fractions of recordings fall."""
+        with self._lock:
+            counts = list(self._counts)
+            total = self.count
+            maximum = self.max
+        values = [0.0] * len(quantiles)
+        if total == 0:
+            return values
+        ranks = sorted(
+            (max(int(q * total + 0.5), 1), i) for i, q in enumerate(quantiles))
+        position = 0
+        seen = 0
+        for index, count in enumerate(counts):
+            if not count:
+                continue
+            seen += count
+            while position < len(ranks) and seen >= ranks[position][0]:
+                values[ranks[position][1]] = min(
+                    _upper_bound(index) / 1_000_000, maximum)
+                position += 1
+            if position == len(ranks):
+                break
+        return values
+
+    def reset(self):
+        with self._lock:
+            self._counts = [0] * _BUCKETS
+            self.count = 0
+            self.sum = 0.0
+            self.min = 0.0
+            self.max = 0.0
+
+
+class Counter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+class Gauge:
+    """A value that is either set explicitly or read from a callback at scrape time."""
+
+    def __init__(self):
+        self.value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]):
+        self._function = function
+
+    def get(self) -> float:
+        if self._function is not None:
+            return float(self._function())
+        return self.value
+
+
+class MetricFamily:
+    """
+    A named metric with optional labels. labels() returns the child for a label set.
+    """
+    kind = ""
+    factory: Callable = Histogram
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **labels: str):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self.factory())
+        return child
+
+    def _label_text(self, key: Tuple[str, ...], extra: str = "") -> str:
+        pairs = [
+            f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key)
+        ]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def expose(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for key, child in list(self._children.items()):
+            yield from self._expose_child(key, child)
+
+    def _expose_child(self, key, child) -> Iterator[str]:
+        raise NotImplementedError
+
+
+class HistogramFamily(MetricFamily):
+    # Exposed as a summary: quantiles are what the HDR histogram is accurate at
+    kind = "summary"
+    factory = Histogram
+
+    def _expose_child(self, key, child: Histogram) -> Iterator[str]:
+        for quantile, value in zip(QUANTILES, child.quantiles(QUANTILES)):
+            labels = self._label_text(key, f'quantile="{quantile}"')
+            yield f"{self.name}{labels} {value:.6f}"
+        labels = self._label_text(key)
+        yield f"{self.name}_sum{labels} {child.sum:.6f}"
+        yield f"{self.name}_count{labels} {child.count}"
+
+
+class CounterFamily(MetricFamily):
+    kind = "counter"
+    factory = Counter
+
+    def _expose_child(self, key, child: Counter) -> Iterator[str]:
+        yield f"{self.name}{self._label_text(key)} {child.value}"
+
+
+class GaugeFamily(MetricFamily):
+    kind = "gauge"
+    factory = Gauge
+
+    def _expose_child(self, key, child: Gauge) -> Iterator[str]:
+        try:
+            value = child.get()
+        except Exception:
+            return
+        yield f"{self.name}{self._label_text(key)} {value}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._families: Dict[str, MetricFamily] = {}
+
+    def _register(self, family_class, name: str, documentation: str, labelnames):
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = family_class(name, documentation, labelnames)
+        return family
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> HistogramFamily:
+        return self._register(HistogramFamily, name, documentation, labelnames)
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> CounterFamily:
+        return self._register(CounterFamily, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> GaugeFamily:
+        return self._register(GaugeFamily, name, documentation, labelnames)
+
+    def expose(self) -> str:
+        lines = []
+        for family in list(self._families.values()):
+            lines.extend(family.expose())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "telerag_stage_seconds",
+    "Time spent in a stage of the RAG pipeline.",
+    ("stage",),
+)
+STAGE_ERRORS = REGISTRY.counter(
+    "telerag_stage_errors_total",
+    "Stages of the RAG pipeline that raised.",
+    ("stage",),
+)
+QUEUE_DEPTH = REGISTRY.gauge(
+    "telerag_queue_depth",
+    "Items waiting in an in-process queue.",
+    ("queue",),
+)
+
+
+def record_stage(name: str, seconds: float):
+    """
+    Record a finished stage: into the stage histogram and,
+    if the request is traced, as a span of its trace.
+    """
+    STAGE_SECONDS.labels(stage=name).record(seconds)
+    record_span(name, seconds)
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Time a stage of the pipeline. Failed stages are counted as errors,
+    cancelled ones are not recorded at all.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(stage=name).inc()
+        raise
+    record_stage(name, time.perf_counter() - start)
+
+
+def watch_queue(name: str, queue) -> None:
+    """Export the size of a queue (anything with qsize()) as a gauge."""
+    QUEUE_DEPTH.labels(queue=name).set_function(queue.qsize)
+
+
+class MetricsServer:
+    """
+    Serves REGISTRY in the Prometheus text format at /metrics.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 9470,
+                 registry: MetricsRegistry = REGISTRY):
+        self.metrics_logger = Logger("Metrics", "network.log")
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._runner: Optional[web.AppRunner] = None
+
+        self.app = web.Application()
+        self.app.router.add_get("/metrics", self._handle_metrics)
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        try:
+            await site.start()
+        except OSError as e:
+            # Metrics are not worth failing the service for
+            self.metrics_logger.error(
+                "Metrics are disabled, cannot listen on %s:%s: %s", self.host, self.port, e)
+            await self.stop()
+            return
+        self.metrics_logger.info(
+            "Metrics are served at http://%s:%s/metrics", self.host, self.port)
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(
+            body=self.registry.expose().encode("utf-8"),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
@@ -0,0 +1,113 @@
+"""
+Two-tier admission to a shared resource: interactive work (answering a question) over
+background work (backfills, live posts, re-embedding).
+
+A PriorityScheduler has a number of slots, one per unit of work in flight (a batch for
+the embedding workers, a history fetch for the Pyrogram client). A unit holds its slot
+until it is done, so a running background batch is never interrupted, but the next free
+slot goes to a waiting interactive unit: interactive work preempts background work at
+batch boundaries. So that a steady stream of questions cannot starve a backfill, while
+both classes wait background units get at least background_share of the slots handed out.
+
+    async with scheduler.slot(Priority.BACKGROUND):
+        embeddings = await encode(batch)
+"""
+import asyncio
+import enum
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Tuple
+
+from source.Metrics import REGISTRY, watch_queue
+
+
+PRIORITY_WAIT = REGISTRY.histogram(
+    "telerag_priority_wait_seconds",
+    "Time a unit of work waited for a slot of a shared resource.",
+    ("resource", "priority"),
+)
+
+
+class Priority(enum.IntEnum):
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+class PriorityScheduler:
+    def __init__(self, name: str, slots: int, background_share: float = 0.2):
+        if slots < 1:
+            raise ValueError("PriorityScheduler needs at least one slot.")
+        if not 0.0 <= background_share < 1.0:
+            raise ValueError("Background share must be in [0, 1).")
+        self.name = name
+        self.slots = slots
+        self.background_share = background_share
+        # Background credit earned per interactive admission while background work waits
+        self._stride = background_share / (1.0 - background_share)
+        self._credit = 0.0
+        self._running = 0
+        self._waiting: Tuple[Deque[asyncio.Future], Deque[asyncio.Future]] = (deque(), deque())
+        watch_queue(f"{name}_waiting", self)
+
+    def qsize(self) -> int:
+        return len(self._waiting[Priority.INTERACTIVE]) + len(self._waiting[Priority.BACKGROUND])
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    async def acquire(self, priority: Priority = Priority.INTERACTIVE):
+        """Wait for a slot. Release it with release()."""
+        started = time.perf_counter()
+        # release() hands free slots to waiters right away, so a free slot means nobody waits
+        # for it (except cancelled waiters that have not left the queue yet)
+        if self._running < self.slots:
+            self._running += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._waiting[priority].append(future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # The slot was handed over just before the cancellation
+                    self.release()
+                elif future in self._waiting[priority]:
+                    self._waiting[priority].remove(future)
+                raise
+        PRIORITY_WAIT.labels(
+            resource=self.name, priority=priority.name.lower(),
+        ).record(time.perf_counter() - started)
+
+    def release(self):
+        self._running -= 1
+        while self._running < self.slots:
+            future = self._next()
+            if future is None:
+                return
+            self._running += 1
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority = Priority.INTERACTIVE) -> AsyncIterator[None]:
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def _next(self):
+        # Waiters cancelled before their task got to run are still queued, they get no slot
+        for waiting in self._waiting:
+            while waiting and waiting[0].done():
+                waiting.popleft()
+        interactive, background = self._waiting
+        if not background:
+            self._credit = 0.0
+            return interactive.popleft() if interactive else None
+        if not interactive or self._credit >= 1.0:
+            self._credit = max(self._credit - 1.0, 0.0)
+            return background.popleft()
+        self._credit += self._stride
+        return interactive.popleft()
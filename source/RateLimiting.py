@@ -0,0 +1,105 @@
+"""
+Token buckets for admission control and rate limited sending.
+
+A bucket holds up to `capacity` tokens and refills at `rate` tokens per second.
+try_acquire() never waits and returns how long the caller would have to wait instead,
+acquire() sleeps until the tokens are available.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "_tokens", "_updated")
+
+    def __init__(self, rate: float, capacity: float):
+        if rate <= 0 or capacity <= 0:
+            raise ValueError("Token bucket rate and capacity must be positive.")
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """
+        Take tokens if available. Returns 0.0 on success, otherwise the number
+        of seconds until that many tokens will be available.
+        """
+        self._refill(time.monotonic())
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return 0.0
+        return (tokens - self._tokens) / self.rate
+
+    async def acquire(self, tokens: float = 1.0):
+        """
+        Wait until tokens are available and take them.
+        """
+        while True:
+            delay = self.try_acquire(tokens)
+            if delay == 0.0:
+                return
+            await asyncio.sleep(delay)
+
+    def penalize(self, seconds: float):
+        """
+        Empty the bucket and push it `seconds` into debt,
+        e.g. when the remote side answered with RetryAfter.
+        """
+        self._refill(time.monotonic())
+        self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+
+    @property
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self._tokens >= self.capacity
+
+
+class KeyedTokenBuckets:
+    """
+    One token bucket per key (user, chat). Buckets that are full carry no state
+    and are evicted first once more than `max_keys` keys are tracked.
+    """
+
+    def __init__(self, rate: float, capacity: float, max_keys: int = 100_000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+
+    def get(self, key: Hashable) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.capacity)
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._evict(key)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def try_acquire(self, key: Hashable, tokens: float = 1.0) -> float:
+        return self.get(key).try_acquire(tokens)
+
+    async def acquire(self, key: Hashable, tokens: float = 1.0):
+        await self.get(key).acquire(tokens)
+
+    def penalize(self, key: Hashable, seconds: float):
+        self.get(key).penalize(seconds)
+
+    def _evict(self, keep: Hashable):
+        # The new bucket is full too, but its caller is about to take tokens from it
+        for key in [k for k, b in self._buckets.items() if b.is_full and k != keep]:
+            del self._buckets[key]
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+    def __len__(self):
+        return len(self._buckets)
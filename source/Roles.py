@@ -0,0 +1,417 @@
+"""
+Role-based startup for TeleRag.
+
+The monolith (TeleRagService) runs everything in one process. The roles below split it
+into three independently scalable processes that talk only through the rag_jobs table:
+
+    bot     aiogram frontend. Enqueues questions to "ingest", delivers answers from "delivery".
+            Channel (un)subscriptions are forwarded to the ingest role over the "scrapper" queue.
+    ingest  Pyrogram + embedding model. Fetches and embeds posts, embeds the question,
+            enqueues the result to "query". Serves the "scrapper" queue.
+    query   Retrieval + LLM. Answers "query" jobs and enqueues the answer to "delivery".
+
+Every role imports only the modules it needs, so e.g. the bot never loads torch.
+"""
+import asyncio
+import signal
+from typing import Awaitable, Callable, List, Optional
+
+from source.Logging import Logger, LoggerComposer, dump_recent_records, stop_logging
+from source.DynamicConfigurationLoading import TGConfig
+from source.Database.DBHelper import DataBaseHelper
+from source.Database.JobQueue import JobRecord, RagJobQueue
+from source.ChromaАndRAG.FairQueue import request_cost
+from source.Metrics import MetricsServer
+from source.LoopMonitor import LoopLagMonitor
+from source.SamplingProfiler import SamplingProfiler
+from source import Tracing
+from source.Tracing import continue_trace
+
+
+INGEST_QUEUE = "ingest"
+QUERY_QUEUE = "query"
+DELIVERY_QUEUE = "delivery"
+SCRAPPER_QUEUE = "scrapper"
+
+
+class BaseRole:
+    """
+    Common lifecycle of a role: database, job queues, stop signal and consumer tasks.
+    """
+    name = "base"
+    # Added to METRICS_PORT, the monolith uses METRICS_PORT itself
+    metrics_port_offset = 0
+
+    def __init__(self, settings: TGConfig):
+        self.settings = settings
+
+        self.logger_composer = LoggerComposer(
+            loglevel=settings.LOG_LEVEL,
+            flush_size=settings.LOG_FLUSH_SIZE,
+            flush_interval=settings.LOG_FLUSH_INTERVAL,
+            max_queue=settings.LOG_QUEUE_SIZE,
+            policy=settings.LOG_OVERFLOW_POLICY,
+            report_interval=settings.LOG_DROP_REPORT_INTERVAL,
+            rotation=settings.LOG_ROTATION,
+            rotation_amount=settings.LOG_ROTATION_AMOUNT,
+            compress=settings.LOG_COMPRESS,
+            keep_files=settings.LOG_KEEP_FILES,
+            log_format=settings.LOG_FORMAT,
+            ring_size=settings.LOG_RING_SIZE,
+            ring_level=settings.LOG_RING_LEVEL,
+            dump_dir=settings.LOG_DUMP_DIR,
+            repeat_burst=settings.LOG_REPEAT_BURST,
+            repeat_window=settings.LOG_REPEAT_WINDOW,
+        )
+        # Loggers created from now on pick up the level and flush settings
+        LoggerComposer.set_instance(self.logger_composer)
+        self.role_logger = Logger(f"Role-{self.name}", "network.log")
+        Tracing.configure(
+            settings.TRACE_SAMPLE_RATE, settings.TRACE_SLOW_THRESHOLD, settings.TRACE_FILE)
+
+        self.DataBaseHelper: Optional[DataBaseHelper] = None
+        self.Profiler = SamplingProfiler(
+            directory=settings.PROFILER_DIR,
+            rate=settings.PROFILER_RATE,
+            rotate_interval=settings.PROFILER_ROTATE_INTERVAL,
+            keep_files=settings.PROFILER_KEEP_FILES,
+        )
+        # Every role process serves its own metrics on a port of its own
+        self.MetricsServer = (
+            MetricsServer(settings.METRICS_HOST, settings.METRICS_PORT + self.metrics_port_offset)
+            if settings.METRICS_PORT else None
+        )
+        self.LoopMonitor = (
+            LoopLagMonitor(settings.LOOP_MONITOR_INTERVAL, settings.LOOP_LAG_THRESHOLD)
+            if settings.LOOP_MONITOR_INTERVAL else None
+        )
+        self._queues: List[RagJobQueue] = []
+        self._consumers: List[asyncio.Task] = []
+
+        self.stop_event = asyncio.Event()
+        self.register_stop_signal_handler()
+
+    async def start(self):
+        self.role_logger.info("Starting %s role...", self.name)
+        if self.LoopMonitor is not None:
+            await self.LoopMonitor.start()
+        if self.settings.PROFILER_ENABLED:
+            self.Profiler.start()
+        if self.MetricsServer is not None:
+            await self.MetricsServer.start()
+        self.DataBaseHelper = await DataBaseHelper.create(
+            db_url=self.construct_db_url(self.settings),
+            scrapper=None
+        )
+        await self._start()
+
+    async def _start(self):
+        raise NotImplementedError(
+            "Up to subclasses to implement this method."
+        )
+
+    async def _stop(self):
+        pass
+
+    async def idle(self):
+        self.role_logger.info(
+            "Waiting for stop signal... Press Ctrl+C to stop.")
+        await self.stop_event.wait()
+
+        self.role_logger.info(
+            "Stop signal received. Stopping %s role...", self.name)
+        for queue in self._queues:
+            await queue.stop()
+        for consumer in self._consumers:
+            consumer.cancel()
+        await asyncio.gather(*self._consumers, return_exceptions=True)
+        await self._stop()
+        await self.DataBaseHelper.close()
+        if self.MetricsServer is not None:
+            await self.MetricsServer.stop()
+        if self.LoopMonitor is not None:
+            await self.LoopMonitor.stop()
+        await asyncio.to_thread(self.Profiler.stop)
+
+        self.stop_event.clear()
+        self.role_logger.info("%s role stopped.", self.name)
+        # Last, so that everything logged while stopping is written
+        await stop_logging()
+
+    def job_queue(self, queue: str, **kwargs) -> RagJobQueue:
+        """
+        Create a job queue bound to the role's database.
+        kwargs are passed on to RagJobQueue (admission limits, cost).
+        """
+        job_queue = RagJobQueue(
+            self.DataBaseHelper.db_manager,
+            queue=queue,
+            visibility_timeout=self.settings.RAG_JOB_VISIBILITY_TIMEOUT,
+            max_attempts=self.settings.RAG_JOB_MAX_ATTEMPTS,
+            retry_backoff=self.settings.RAG_JOB_RETRY_BACKOFF,
+            poll_interval=self.settings.RAG_JOB_POLL_INTERVAL,
+            result_retention=self.settings.RAG_JOB_RESULT_RETENTION,
+            **kwargs,
+        )
+        self._queues.append(job_queue)
+        return job_queue
+
+    def consume(
+        self,
+        job_queue: RagJobQueue,
+        handler: Callable[[JobRecord], Awaitable[None]],
+        concurrency: int = 1
+    ):
+        """
+        Run handler for every job of the queue in a background task,
+        up to concurrency jobs at a time.
+        """
+        async def _handle(job: JobRecord):
+            async with job_queue.lease(job):
+                await handler(job)
+
+        async def _consumer():
+            if concurrency == 1:
+                async for job in job_queue.consume():
+                    await _handle(job)
+                return
+
+            slots = asyncio.Semaphore(concurrency)
+            running = set()
+
+            def _done(task: asyncio.Task):
+                running.discard(task)
+                slots.release()
+
+            try:
+                async for job in job_queue.consume():
+                    await slots.acquire()
+                    task = asyncio.create_task(_handle(job))
+                    running.add(task)
+                    task.add_done_callback(_done)
+            finally:
+                for task in running:
+                    task.cancel()
+                await asyncio.gather(*running, return_exceptions=True)
+
+        self._consumers.append(asyncio.create_task(_consumer()))
+
+    def __stop_signal_handler(self):
+        self.stop_event.set()
+
+    def __profiler_signal_handler(self):
+        # Stopping the profiler joins its thread and writes the profile
+        async def _toggle():
+            running = await asyncio.to_thread(self.Profiler.toggle)
+            self.role_logger.info("Profiler %s by SIGUSR2", "started" if running else "stopped")
+
+        asyncio.create_task(_toggle())
+
+    def __log_dump_signal_handler(self):
+        async def _dump():
+            path = await dump_recent_records()
+            self.role_logger.info("Recent log records dumped to %s by SIGUSR1", path)
+
+        asyncio.create_task(_dump())
+
+    def register_stop_signal_handler(self):
+        loop = asyncio.get_event_loop()
+        loop.add_signal_handler(signal.SIGTERM, self.__stop_signal_handler, )
+        loop.add_signal_handler(signal.SIGINT, self.__stop_signal_handler, )
+        loop.add_signal_handler(
+            signal.SIGUSR2, self.__profiler_signal_handler, )
+        loop.add_signal_handler(
+            signal.SIGUSR1, self.__log_dump_signal_handler, )
+
+    @staticmethod
+    def construct_db_url(settings: TGConfig) -> str:
+        return (
+            f"postgresql+asyncpg://"
+            f"{settings.POSTGRES_USER}:"
+            f"{settings.POSTGRES_PASSWORD}@"
+            f"{settings.POSTGRES_HOST}:"
+            f"{settings.POSTGRES_PORT}/"
+            f"{settings.POSTGRES_DB}"
+        )
+
+
+class BotRole(BaseRole):
+    """
+    aiogram frontend. Loads neither Pyrogram nor the embedding model.
+    """
+    name = "bot"
+    metrics_port_offset = 1
+
+    async def _start(self):
+        from source.TgUI.BotApp import BotApp
+        from source.TgUI.Webhook import WebhookSettings
+        from source.TgUI.Delivery import DeliverySettings
+        from source.TelegramMessageScrapper.ScrapperProxy import ScrapperProxy
+
+        self.BotApp = BotApp(
+            token=self.settings.AIOGRAM_API_KEY,
+            rag=None,
+            scrapper=ScrapperProxy(self.job_queue(SCRAPPER_QUEUE)),
+            db_helper=self.DataBaseHelper,
+            webhook=WebhookSettings.from_config(self.settings),
+            handler_workers=self.settings.BOT_HANDLER_WORKERS,
+            user_rate=self.settings.RAG_USER_RATE,
+            user_burst=self.settings.RAG_USER_BURST,
+            supersede=self.settings.RAG_SUPERSEDE_STALE,
+            delivery=DeliverySettings.from_config(self.settings),
+            admins=self.settings.ADMIN_USER_IDS,
+            profiler=self.Profiler,
+        )
+        # Questions enter the pipeline here, so the admission limits apply here
+        questions = self.job_queue(
+            INGEST_QUEUE,
+            max_pending=self.settings.RAG_QUEUE_MAX_SIZE,
+            max_pending_per_user=self.settings.RAG_QUEUE_MAX_PER_USER,
+            cost=request_cost,
+        )
+        self.BotApp.include_job_queue(questions, pipeline=(QUERY_QUEUE,))
+        # Deliveries wait for Telegram rate limits, several are
+        # in flight so that one slow chat does not hold up the others
+        self.consume(
+            self.job_queue(DELIVERY_QUEUE), self._deliver,
+            concurrency=self.settings.DELIVERY_WORKERS)
+        await self.BotApp.start()
+
+    async def _deliver(self, job: JobRecord):
+        await self.BotApp.deliver(job.payload)
+
+    async def _stop(self):
+        await self.BotApp.stop()
+
+
+class IngestRole(BaseRole):
+    """
+    Pyrogram + embedding model. Turns questions into embedded collections and query jobs.
+    """
+    name = "ingest"
+    metrics_port_offset = 2
+
+    async def _start(self):
+        from source.TelegramMessageScrapper.PyroClient import PyroClient
+        from source.ChromaАndRAG.Rag import RagClient
+        from source.TaskScheduling import TaskScheduler
+
+        self.Scrapper = PyroClient(
+            api_id=self.settings.PYRO_API_ID,
+            api_hash=self.settings.PYRO_API_HASH,
+            history_limit=self.settings.PYRO_HISTORY_LIMIT,
+            fetch_concurrency=self.settings.PYRO_FETCH_CONCURRENCY,
+            background_share=self.settings.RAG_BACKGROUND_SHARE,
+        )
+        self.RagClient = RagClient(
+            host=self.settings.RAG_HOST,
+            port=self.settings.RAG_PORT,
+            n_result=self.settings.RAG_N_RESULT,
+            model=self.settings.SENTENCE_TRANSFORMER_MODEL,
+            mistral_api_key="",
+            mistral_model="",
+            scrapper=self.Scrapper,
+            route_channels=self.settings.RAG_ROUTE_CHANNELS,
+            routing_centers=self.settings.RAG_ROUTING_CENTERS,
+            dedup_threshold=self.settings.RAG_DEDUP_THRESHOLD,
+        )
+        self.TaskScheduler = None
+        if self.settings.RAG_PROCESS_POOL:
+            self.TaskScheduler = TaskScheduler(
+                self.settings.RAG_WORKER_PROCESSES,
+                self.settings.LOG_LEVEL,
+                shared_memory_size=self.settings.RAG_SHARED_MEMORY_MB * 1024 * 1024,
+                background_share=self.settings.RAG_BACKGROUND_SHARE,
+            )
+            await self.TaskScheduler.start()
+            self.RagClient.include_scheduler(self.TaskScheduler)
+        await asyncio.gather(
+            self.RagClient.load_model(),
+            self.RagClient.connect(),
+            self.Scrapper.scrapper_start(),
+        )
+
+        self._query_queue = self.job_queue(QUERY_QUEUE)
+        self.consume(self.job_queue(INGEST_QUEUE), self._ingest)
+        self.consume(self.job_queue(SCRAPPER_QUEUE), self._scrapper_call)
+
+    async def _ingest(self, job: JobRecord):
+        self.RagClient.collection_name(job.payload, job.id)
+        try:
+            with continue_trace(job.payload) as trace:
+                query_task = await self.RagClient.ingest(job.payload)
+            if trace is not None:
+                trace.enqueued(QUERY_QUEUE, query_task)
+            await self._query_queue.enqueue(query_task, user_id=job.user_id)
+        except BaseException:
+            # The question does not reach the query role, which deletes the collection
+            self.RagClient.drop_collection(job.payload)
+            raise
+
+    async def _scrapper_call(self, job: JobRecord):
+        from source.TelegramMessageScrapper.ScrapperProxy import ScrapperProxy
+
+        method = job.payload["method"]
+        if method not in ScrapperProxy.methods:
+            raise ValueError(f"Scrapper method {method} is not allowed")
+        job.result = await getattr(self.Scrapper, method)(*job.payload["args"])
+        if (method == "subscribe_to_channel"
+                and job.result.get("status") in ("success", "already_subscribed")):
+            # Questions can be routed to the channel from the first one on
+            self.RagClient.backfill([{
+                "channel_id": int(job.result["channel_id"]),
+                "channel_name": job.result["channel_name"],
+            }])
+
+    async def _stop(self):
+        await self.RagClient.stop_backfills()
+        await self.Scrapper.scrapper_stop()
+        if self.TaskScheduler is not None:
+            await self.TaskScheduler.stop()
+
+
+class QueryRole(BaseRole):
+    """
+    Retrieval + LLM. Uses the question embedding computed by the ingest role.
+    """
+    name = "query"
+    metrics_port_offset = 3
+
+    async def _start(self):
+        from source.ChromaАndRAG.Rag import RagClient
+
+        self.RagClient = RagClient(
+            host=self.settings.RAG_HOST,
+            port=self.settings.RAG_PORT,
+            n_result=self.settings.RAG_N_RESULT,
+            model=self.settings.SENTENCE_TRANSFORMER_MODEL,
+            mistral_api_key=self.settings.MISTRAL_API_KEY,
+            mistral_model=self.settings.MISTRAL_API_MODEL,
+            scrapper=None,
+            context_tokens=self.settings.RAG_CONTEXT_TOKENS,
+            passage_tokens=self.settings.RAG_PASSAGE_TOKENS,
+            context_tokenizer=self.settings.RAG_CONTEXT_TOKENIZER,
+        )
+        await self.RagClient.connect()
+        self._delivery_queue = self.job_queue(DELIVERY_QUEUE)
+        self.consume(self.job_queue(QUERY_QUEUE), self._answer)
+
+    async def _answer(self, job: JobRecord):
+        with continue_trace(job.payload) as trace:
+            response = await self.RagClient.answer(job.payload)
+        if trace is not None:
+            trace.enqueued(DELIVERY_QUEUE, response)
+        await self._delivery_queue.enqueue(response, user_id=job.user_id)
+
+
+roles = {
+    BotRole.name: BotRole,
+    IngestRole.name: IngestRole,
+    QueryRole.name: QueryRole,
+}
+
+
+def create_role(name: str, settings: TGConfig) -> BaseRole:
+    if name not in roles:
+        raise ValueError(f"Unknown role {name}. Expected one of: {', '.join(roles)}")
+    return roles[name](settings)
@@ -0,0 +1,171 @@
+"""
+Statistical sampling profiler.
+
+A daemon thread wakes up `rate` times a second, walks the stack of every other thread
+via sys._current_frames() and counts the stack. Nothing is installed into the profiled
+code, so the overhead is the sampling itself and does not grow with the load.
+
+Counts are written as collapsed stacks, one "thread;outer;...;inner count" line per
+distinct stack, which flamegraph.pl, speedscope and inferno read directly:
+
+    flamegraph.pl profiles/profile-20250101-120000-000.collapsed > flame.svg
+
+Every `rotate_interval` seconds the window is written to a new file and the oldest
+files beyond `keep_files` are deleted. The profiler can be started and stopped at any
+time (SIGUSR2 or the /profile admin command), so a live bot is profiled without restart.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from types import CodeType, FrameType
+from typing import Dict, Optional
+
+
+class SamplingProfiler:
+    def __init__(
+        self,
+        directory: str = "profiles",
+        rate: float = 100.0,
+        rotate_interval: float = 60.0,
+        keep_files: int = 60,
+        max_depth: int = 128,
+    ):
+        self.directory = directory
+        self.interval = 1.0 / rate
+        self.rotate_interval = rotate_interval
+        self.keep_files = keep_files
+        self.max_depth = max_depth
+
+        self._stacks: Counter = Counter()
+        self._samples = 0
+        self._labels: Dict[CodeType, str] = {}
+        self._thread_names: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> bool:
+        """Start sampling. Returns False if the profiler is already running."""
+        with self._lock:
+            if self.running:
+                return False
+            os.makedirs(self.directory, exist_ok=True)
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="SamplingProfiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self) -> Optional[str]:
+        """
+        Stop sampling and write the current window.
+        Returns the path of the written file, if any.
+        """
+        with self._lock:
+            if not self.running:
+                return None
+            self._stop.set()
+            thread = self._thread
+            self._thread = None
+        thread.join()
+        return self._flush()
+
+    def toggle(self) -> bool:
+        """Start the profiler if it is stopped and vice versa. Returns the new state."""
+        if self.running:
+            self.stop()
+            return False
+        return self.start()
+
+    def status(self) -> str:
+        if not self.running:
+            return "Profiler is stopped."
+        return (
+            f"Profiler is running at {1 / self.interval:.0f} Hz, "
+            f"{self._samples} samples in the current window, "
+            f"files are written to {os.path.abspath(self.directory)}."
+        )
+
+    def _run(self):
+        own_id = threading.get_ident()
+        window_started = time.monotonic()
+        next_sample = window_started
+        while not self._stop.is_set():
+            self._sample(own_id)
+            next_sample += self.interval
+            now = time.monotonic()
+            if now - window_started >= self.rotate_interval:
+                self._flush()
+                window_started = now
+            if next_sample > now:
+                self._stop.wait(next_sample - now)
+            else:
+                # We are late (GIL contention), do not try to catch up
+                next_sample = now
+
+    def _sample(self, own_id: int):
+        frames = sys._current_frames()
+        for thread_id, frame in frames.items():
+            if thread_id == own_id:
+                continue
+            self._stacks[self._collapse(thread_id, frame)] += 1
+        self._samples += 1
+        del frames
+
+    def _collapse(self, thread_id: int, frame: Optional[FrameType]) -> str:
+        labels = []
+        while frame is not None and len(labels) < self.max_depth:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = (
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}"
+                    f":{code.co_firstlineno})"
+                ).replace(";", ":")
+            labels.append(label)
+            frame = frame.f_back
+        thread_name = self._thread_names.get(thread_id)
+        if thread_name is None:
+            self._thread_names = {
+                thread.ident: thread.name for thread in threading.enumerate()}
+            thread_name = self._thread_names.get(thread_id, f"thread-{thread_id}")
+        labels.append(thread_name)
+        labels.reverse()
+        return ";".join(labels)
+
+    def _flush(self) -> Optional[str]:
+        """Write the current window to a new file and start a new window."""
+        stacks, self._stacks = self._stacks, Counter()
+        self._samples = 0
+        self._thread_names = {}
+        if not stacks:
+            return None
+        now = time.time()
+        name = time.strftime("profile-%Y%m%d-%H%M%S", time.localtime(now))
+        name += f"-{int(now * 1000) % 1000:03d}.collapsed"
+        path = os.path.join(self.directory, name)
+        temporary = path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            for stack, count in stacks.most_common():
+                file.write(f"{stack} {count}\n")
+        # Readers never see a half written profile
+        os.replace(temporary, path)
+        self._prune()
+        return path
+
+    def _prune(self):
+        files = sorted(
+            name for name in os.listdir(self.directory)
+            if name.startswith("profile-") and name.endswith(".collapsed")
+        )
+        for name in files[:max(len(files) - self.keep_files, 0)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
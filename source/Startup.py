@@ -0,0 +1,100 @@
+"""
+Startup orchestration.
+
+Components of the service are started as named phases with explicit dependencies.
+Phases whose dependencies are satisfied run concurrently, so e.g. the embedding model
+loads in a worker thread while the database connects and Pyrogram authenticates.
+Every phase is timed and the timings are logged once startup finishes.
+"""
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from source.Logging import Logger
+
+
+@dataclass
+class StartupPhase:
+    name: str
+    func: Callable[[], Awaitable[None]]
+    depends_on: Tuple[str, ...] = ()
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+    @property
+    def elapsed(self) -> float:
+        if self.started is None or self.finished is None:
+            return 0.0
+        return self.finished - self.started
+
+
+class StartupOrchestrator:
+    """
+    Runs startup phases as a dependency graph.
+    """
+
+    def __init__(self, logger: Logger):
+        self.logger = logger
+        self._phases: Dict[str, StartupPhase] = {}
+
+    def add(
+        self,
+        name: str,
+        func: Callable[[], Awaitable[None]],
+        depends_on: Iterable[str] = ()
+    ) -> "StartupOrchestrator":
+        """
+        Register a phase. Dependencies must be registered before the phase itself.
+        """
+        if name in self._phases:
+            raise ValueError(f"Startup phase {name} already exists.")
+        depends_on = tuple(depends_on)
+        for dependency in depends_on:
+            if dependency not in self._phases:
+                raise ValueError(
+                    f"Startup phase {name} depends on unknown phase {dependency}.")
+        self._phases[name] = StartupPhase(name, func, depends_on)
+        return self
+
+    async def run(self):
+        """
+        Start all phases. If one of them fails, the rest are cancelled and the error is raised.
+        """
+        origin = time.monotonic()
+        for phase in self._phases.values():
+            phase.task = asyncio.create_task(self._run_phase(phase))
+        try:
+            await asyncio.gather(*(phase.task for phase in self._phases.values()))
+        except BaseException:
+            for phase in self._phases.values():
+                phase.task.cancel()
+            await asyncio.gather(
+                *(phase.task for phase in self._phases.values()),
+                return_exceptions=True
+            )
+            raise
+        total = time.monotonic() - origin
+        self.logger.info(self.report(origin, total))
+
+    async def _run_phase(self, phase: StartupPhase):
+        if phase.depends_on:
+            await asyncio.gather(
+                *(self._phases[name].task for name in phase.depends_on))
+        phase.started = time.monotonic()
+        await phase.func()
+        phase.finished = time.monotonic()
+
+    def report(self, origin: float, total: float) -> str:
+        serial = sum(phase.elapsed for phase in self._phases.values())
+        lines = [
+            f"Startup finished in {total:.2f}s "
+            f"(phases sum to {serial:.2f}s when run serially):"
+        ]
+        for phase in sorted(self._phases.values(), key=lambda p: p.started):
+            lines.append(
+                f"  {phase.name}: {phase.elapsed:.2f}s "
+                f"(started at +{phase.started - origin:.2f}s)"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,524 @@
+"""
+Process pool for the CPU-bound stages of the pipeline (text preprocessing, embedding).
+
+Every worker process has its own task queue and tasks go to the worker with the fewest
+outstanding tasks. submit() pickles the task on the loop, so that a task that cannot be
+pickled fails its future, and hands the bytes to the queue's feeder thread, which only
+sends them, so the event loop never blocks on dispatch. Results come back over a pipe
+per worker: a collector thread waits on all pipes and on the workers' sentinels and
+resolves the asyncio futures with call_soon_threadsafe. A worker that dies fails its
+outstanding tasks with BrokenProcessPool and is replaced.
+
+Without a worker count the pool is sized by the CPUs the process may run on
+(sched_getaffinity, so --cpus and container cpusets are respected). Every worker limits
+the threads of the numeric libraries so that the workers do not fight over the cores.
+Workers log through the LogListener of the parent.
+
+Arrays (embedding batches) do not have to be pickled back: submit_shared() and
+map_shared() give the task a slot of a SharedArena, the worker writes the result there
+and only sends its shape and dtype. The caller gets a zero-copy view of the slot and
+releases it once the array is consumed. A result that does not fit, or a task that
+finds no free slot, falls back to pickling.
+
+Chunks of map() and map_shared(), and tasks of run(), are admitted by a PriorityScheduler
+with a couple of slots per worker: chunks of a question go ahead of the chunks of a
+backfill that are still waiting, and the backfill keeps its minimum share.
+
+    scheduler = TaskScheduler()
+    await scheduler.start()
+    tokenized = await scheduler.map(preprocess_batch, texts)
+    with await scheduler.map_shared(encode_batch, tokenized, model_name, row_bytes=1536) as batch:
+        collection.add(embeddings=batch.rows, ...)
+"""
+import asyncio
+import itertools
+import math
+import multiprocessing as mp
+import os
+import pickle
+import signal
+import threading
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from multiprocessing import shared_memory
+from multiprocessing.connection import Connection, wait
+from multiprocessing.reduction import ForkingPickler
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from source.Logging import Logger, LoggerComposer, init_process_logging
+from source.Metrics import watch_queue
+from source.PriorityScheduling import Priority, PriorityScheduler
+
+
+# Thread pools of torch, numpy and tokenizers in the workers
+_THREAD_VARIABLES = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+# Largest chunk of map(): interactive work waits at most for chunks of this size to finish
+_MAX_CHUNK = 256
+
+
+def available_cpus() -> int:
+    """CPUs this process is allowed to run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class SharedArena:
+    """
+    Fixed size slots in one shared memory segment. Slots are allocated and released
+    by the parent only, a worker writes into the slot its task was given.
+    """
+
+    def __init__(self, slots: int, slot_size: int):
+        self.slot_size = slot_size
+        self._memory = shared_memory.SharedMemory(create=True, size=slots * slot_size)
+        self._free = deque(range(slots))
+
+    @property
+    def name(self) -> str:
+        return self._memory.name
+
+    def allocate(self) -> Optional[int]:
+        return self._free.popleft() if self._free else None
+
+    def release(self, slot: int):
+        self._free.append(slot)
+
+    def view(self, slot: int, shape: Tuple[int, ...], dtype: str) -> np.ndarray:
+        return np.ndarray(
+            shape, dtype=dtype, buffer=self._memory.buf, offset=slot * self.slot_size)
+
+    def close(self):
+        try:
+            self._memory.close()
+        except BufferError:
+            # Views are still alive, the mapping goes away with them
+            pass
+        self._memory.unlink()
+
+
+class _SharedArray(NamedTuple):
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+# Shared memory of the parent's arenas, attached once per worker
+_attached: Dict[str, shared_memory.SharedMemory] = {}
+
+
+def _write_shared(function: Callable, args: tuple, arena: str, offset: int, size: int):
+    """Runs in a worker: puts the array returned by function into the slot."""
+    result = np.asarray(function(*args))
+    if result.nbytes > size:
+        return result
+    memory = _attached.get(arena)
+    if memory is None:
+        memory = _attached[arena] = shared_memory.SharedMemory(name=arena)
+    view = np.ndarray(result.shape, dtype=result.dtype, buffer=memory.buf, offset=offset)
+    view[...] = result
+    del view
+    return _SharedArray(result.shape, result.dtype.str)
+
+
+class SharedResult:
+    """
+    An array returned by a task. A view of a SharedArena slot stays valid
+    until release(), a pickled array (no slot was used) does not need it.
+    """
+    __slots__ = ("array", "_arena", "_slot")
+
+    def __init__(self, array: np.ndarray, arena: Optional[SharedArena] = None, slot: int = -1):
+        self.array = array
+        self._arena = arena
+        self._slot = slot
+
+    def release(self):
+        if self._arena is not None:
+            self.array = None
+            self._arena.release(self._slot)
+            self._arena = None
+
+    def __enter__(self) -> np.ndarray:
+        return self.array
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class SharedBatch:
+    """Results of map_shared() in order. rows are views, valid until release()."""
+
+    def __init__(self, parts: List[SharedResult]):
+        self.parts = parts
+
+    @property
+    def rows(self) -> List[np.ndarray]:
+        return [row for part in self.parts for row in part.array]
+
+    def release(self):
+        for part in self.parts:
+            part.release()
+
+    def __enter__(self) -> "SharedBatch":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def _worker_main(
+    tasks: mp.Queue,
+    results: Connection,
+    log_queue: Optional[mp.Queue],
+    loglevel: str,
+    threads: int
+):
+    for variable in _THREAD_VARIABLES:
+        os.environ[variable] = str(threads)
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    # Ctrl+C is for the parent, it stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if log_queue is not None:
+        init_process_logging(log_queue, loglevel)
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        # The task was pickled by the parent, see TaskScheduler._submit_to()
+        task_id, payload = task
+        try:
+            function, args, kwargs = pickle.loads(payload)
+            result = (task_id, True, function(*args, **kwargs))
+        except Exception as e:
+            result = (task_id, False, e)
+        try:
+            results.send(result)
+        except Exception as e:
+            # The result or the exception could not be pickled
+            results.send((task_id, False, RuntimeError(f"Task result could not be sent: {e!r}")))
+    results.close()
+
+
+@dataclass(eq=False)
+class _WorkerRecord:
+    number: int
+    process: mp.Process
+    tasks: mp.Queue
+    results: Connection
+    outstanding: Set[int] = field(default_factory=set)
+
+
+class TaskScheduler:
+    """
+    Runs picklable functions in worker processes, results are awaitable futures.
+    """
+
+    def __init__(
+        self,
+        workers: int = 0,
+        loglevel: str = "INFO",
+        shared_memory_size: int = 0,
+        background_share: float = 0.2
+    ):
+        self.scheduler_logger = Logger("TaskScheduler", "runtime.log")
+        cpus = available_cpus()
+        self.workers = workers if workers > 0 else cpus
+        self._threads = max(cpus // self.workers, 1)
+        self._loglevel = loglevel
+        # Workers start from a fresh interpreter: forking a process
+        # with an event loop and running threads is not safe
+        self._context = mp.get_context("spawn")
+        self._log_queue: Optional[mp.Queue] = None
+        self._workers: List[_WorkerRecord] = []
+        self._futures: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._collector: Optional[threading.Thread] = None
+        # Written to wake the collector up when the pool changes or stops
+        self._wakeup_reader, self._wakeup_writer = mp.Pipe(duplex=False)
+        self._running = False
+        # A few slots per worker, so that every worker can have results waiting to be consumed
+        self._shared_slots = self.workers * 4
+        self._shared_memory_size = shared_memory_size
+        self._arena: Optional[SharedArena] = None
+        # Two chunks per worker in flight: one running, one queued behind it
+        self.priorities = PriorityScheduler(
+            "process_pool", self.workers * 2, background_share)
+        watch_queue("process_pool", self)
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    async def start(self):
+        if self._running:
+            return
+        self._loop = asyncio.get_running_loop()
+        if self._shared_memory_size > 0:
+            # Slots start at cache line boundaries
+            slot_size = self._shared_memory_size // self._shared_slots // 64 * 64
+            self._arena = SharedArena(self._shared_slots, slot_size)
+        try:
+            self._log_queue = LoggerComposer.get_instance().process_log_queue()
+        except RuntimeError:
+            self._log_queue = None
+        self._workers = await asyncio.to_thread(
+            lambda: [self._start_worker(number) for number in range(self.workers)])
+        self._running = True
+        self._collector = threading.Thread(
+            target=self._collect, name="TaskSchedulerCollector", daemon=True)
+        self._collector.start()
+        self.scheduler_logger.info(
+            "Started %s worker processes, %s threads each", self.workers, self._threads)
+
+    async def stop(self, timeout: float = 10.0):
+        """
+        Let the workers finish the queued tasks for up to timeout seconds, then stop them.
+        Futures of tasks that did not finish are cancelled.
+        """
+        if not self._running:
+            return
+        self._running = False
+        for record in self._workers:
+            record.tasks.put(None)
+        await asyncio.to_thread(self._join_workers, timeout)
+        self._wakeup_writer.send(None)
+        await asyncio.to_thread(self._collector.join)
+        self._collector = None
+        for record in self._workers:
+            record.tasks.close()
+            record.results.close()
+        self._workers = []
+        for future in self._futures.values():
+            future.cancel()
+        self._futures.clear()
+        if self._arena is not None:
+            self._arena.close()
+            self._arena = None
+        self.scheduler_logger.info("Worker processes stopped")
+
+    def qsize(self) -> int:
+        return len(self._futures)
+
+    def submit(self, function: Callable, *args, **kwargs) -> asyncio.Future:
+        """
+        Run function(*args, **kwargs) in the least busy worker.
+        The function and its arguments have to be picklable.
+        """
+        if not self._running:
+            raise RuntimeError("TaskScheduler is not running")
+        record = min(self._workers, key=lambda worker: len(worker.outstanding))
+        return self._submit_to(record, function, args, kwargs)
+
+    async def run(
+        self,
+        function: Callable,
+        *args,
+        priority: Priority = Priority.INTERACTIVE
+    ) -> Any:
+        """submit() once a slot of the priority scheduler is free, and wait for the result."""
+        async with self.priorities.slot(priority):
+            return await self.submit(function, *args)
+
+    def _chunk_size(self, items: Sequence) -> int:
+        # A few chunks per worker, so that uneven chunks still keep every worker busy
+        return min(max(math.ceil(len(items) / (self.workers * 4)), 1), _MAX_CHUNK)
+
+    async def map(
+        self,
+        function: Callable[..., Sequence],
+        items: Sequence,
+        *args,
+        chunk_size: int = 0,
+        priority: Priority = Priority.INTERACTIVE
+    ) -> list:
+        """
+        function(chunk, *args) for chunks of items spread over the workers.
+        function returns one result per item, the results are returned in order.
+        """
+        if not items:
+            return []
+        if chunk_size <= 0:
+            chunk_size = self._chunk_size(items)
+        parts = await asyncio.gather(*(
+            self.run(function, items[start:start + chunk_size], *args, priority=priority)
+            for start in range(0, len(items), chunk_size)
+        ))
+        return [result for part in parts for result in part]
+
+    async def submit_shared(self, function: Callable, *args) -> SharedResult:
+        """
+        Run function(*args), which returns an array, and get the array through shared memory.
+        """
+        arena = self._arena
+        slot = arena.allocate() if arena is not None else None
+        if slot is None:
+            return SharedResult(np.asarray(await self.submit(function, *args)))
+        future = self.submit(
+            _write_shared, function, args, arena.name, slot * arena.slot_size, arena.slot_size)
+        try:
+            result = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The worker may still be writing, the slot is free once it is done
+            future.add_done_callback(lambda _: arena.release(slot))
+            raise
+        except BaseException:
+            arena.release(slot)
+            raise
+        if isinstance(result, _SharedArray):
+            return SharedResult(arena.view(slot, result.shape, result.dtype), arena, slot)
+        arena.release(slot)
+        return SharedResult(result)
+
+    async def map_shared(
+        self,
+        function: Callable[..., np.ndarray],
+        items: Sequence,
+        *args,
+        row_bytes: int = 0,
+        priority: Priority = Priority.INTERACTIVE
+    ) -> SharedBatch:
+        """
+        Like map() for a function that returns an array with a row per item.
+        With row_bytes the chunks are sized to fit into a shared memory slot.
+        """
+        chunk_size = self._chunk_size(items)
+        if self._arena is not None and row_bytes > 0:
+            chunk_size = max(min(chunk_size, self._arena.slot_size // row_bytes), 1)
+
+        async def _chunk(start: int) -> SharedResult:
+            async with self.priorities.slot(priority):
+                return await self.submit_shared(function, items[start:start + chunk_size], *args)
+
+        results = await asyncio.gather(*(
+            _chunk(start) for start in range(0, len(items), chunk_size)
+        ), return_exceptions=True)
+        parts = [result for result in results if isinstance(result, SharedResult)]
+        if len(parts) < len(results):
+            for part in parts:
+                part.release()
+            raise next(result for result in results if isinstance(result, BaseException))
+        return SharedBatch(parts)
+
+    async def broadcast(self, function: Callable, *args) -> List[Any]:
+        """Run function(*args) once in every worker, e.g. to load a model ahead of time."""
+        return list(await asyncio.gather(*(
+            self._submit_to(record, function, args, {}) for record in self._workers)))
+
+    def _submit_to(self, record: _WorkerRecord, function: Callable, args: tuple, kwargs: dict):
+        future = self._loop.create_future()
+        # mp.Queue pickles in its feeder thread, where an error would only be printed
+        # and the future would never resolve. Pickling here fails the future instead.
+        try:
+            payload = bytes(ForkingPickler.dumps((function, args, kwargs)))
+        except Exception as e:
+            future.set_exception(e)
+            return future
+        task_id = next(self._ids)
+        self._futures[task_id] = future
+        record.outstanding.add(task_id)
+        record.tasks.put((task_id, payload))
+        return future
+
+    def _start_worker(self, number: int) -> _WorkerRecord:
+        tasks = self._context.Queue()
+        reader, writer = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_worker_main,
+            args=(tasks, writer, self._log_queue, self._loglevel, self._threads),
+            name=f"TaskWorker-{number}",
+            daemon=True,
+        )
+        process.start()
+        # The worker has its own copy, the pipe reports EOF once the worker exits
+        writer.close()
+        return _WorkerRecord(number, process, tasks, reader)
+
+    def _join_workers(self, timeout: float):
+        for record in self._workers:
+            record.process.join(timeout)
+            if record.process.is_alive():
+                record.process.terminate()
+                record.process.join()
+
+    def _collect(self):
+        """Runs in the collector thread. Hands results and dead workers to the loop."""
+        closed: Set[Connection] = set()
+        # Sentinels of workers that exited during stop(). They stay ready, waiting on them
+        # again would spin until stop() wakes the collector up
+        exited: Set[int] = set()
+        # The collector's own view of the pool. Only the loop changes self._workers,
+        # replacements are handed to it with call_soon_threadsafe()
+        workers = list(self._workers)
+        while True:
+            waitables = [self._wakeup_reader]
+            for record in workers:
+                if record.results not in closed:
+                    waitables.append(record.results)
+                if record.process.sentinel not in exited:
+                    waitables.append(record.process.sentinel)
+            for ready in wait(waitables):
+                if ready is self._wakeup_reader:
+                    self._wakeup_reader.recv()
+                    if not self._running:
+                        return
+                    continue
+                for index, record in enumerate(workers):
+                    if ready is record.results:
+                        self._receive(record, closed)
+                    elif ready == record.process.sentinel:
+                        if self._running:
+                            workers[index] = self._replace(record, closed)
+                        else:
+                            exited.add(ready)
+
+    def _receive(self, record: _WorkerRecord, closed: Set[Connection]):
+        # Everything that is already in the pipe, results of a task come in order
+        try:
+            while record.results.poll():
+                task_id, ok, value = record.results.recv()
+                self._loop.call_soon_threadsafe(self._resolve, record, task_id, ok, value)
+        except (EOFError, OSError):
+            closed.add(record.results)
+
+    def _replace(self, record: _WorkerRecord, closed: Set[Connection]) -> _WorkerRecord:
+        # Results the worker sent before it died
+        if record.results not in closed:
+            self._receive(record, closed)
+        record.process.join()
+        # Starting a process takes a while, it is done here rather than on the loop
+        replacement = self._start_worker(record.number)
+        self._loop.call_soon_threadsafe(self._worker_died, record, replacement)
+        return replacement
+
+    def _resolve(self, record: _WorkerRecord, task_id: int, ok: bool, value: Any):
+        record.outstanding.discard(task_id)
+        future = self._futures.pop(task_id, None)
+        if future is None or future.done():
+            return
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+
+    def _worker_died(self, record: _WorkerRecord, replacement: _WorkerRecord):
+        self._workers[self._workers.index(record)] = replacement
+        if not self._running:
+            # stop() has already told the other workers to exit
+            replacement.tasks.put(None)
+        exitcode = record.process.exitcode
+        self.scheduler_logger.error(
+            "Worker %d exited with code %s, %d tasks failed, the worker was replaced",
+            record.number, exitcode, len(record.outstanding))
+        for task_id in record.outstanding:
+            future = self._futures.pop(task_id, None)
+            if future is not None and not future.done():
+                future.set_exception(BrokenProcessPool(
+                    f"Worker {record.number} exited with code {exitcode}"))
+        record.outstanding.clear()
+        record.tasks.close()
+        record.results.close()
@@ -1,13 +1,21 @@
 import asyncio
+import importlib
 
-from source.Logging import Logger, LoggerComposer
+from source.Logging import Logger, LoggerComposer, dump_recent_records, stop_logging
 
 from source.Database.DBHelper import DataBaseHelper
+from source.Database.JobQueue import RagJobQueue
 from source.TgUI.BotApp import BotApp
+from source.TgUI.Webhook import WebhookSettings
+from source.TgUI.Delivery import DeliverySettings
 from source.ChromaАndRAG.Rag import RagClient
-
-# from source.TelegramMessageScrapper.Base import Scrapper
-from source.TelegramMessageScrapper.PyroClient import PyroClient
+from source.ChromaАndRAG.FairQueue import request_cost
+from source.Startup import StartupOrchestrator
+from source.TaskScheduling import TaskScheduler
+from source.Metrics import MetricsServer
+from source.LoopMonitor import LoopLagMonitor
+from source.SamplingProfiler import SamplingProfiler
+from source import Tracing
 
 from source.DynamicConfigurationLoading import TGConfig
 
@@ -23,15 +31,32 @@ class TeleRagService:
 
         self.logger_composer = LoggerComposer(
             loglevel=settings.LOG_LEVEL,
+            flush_size=settings.LOG_FLUSH_SIZE,
+            flush_interval=settings.LOG_FLUSH_INTERVAL,
+            max_queue=settings.LOG_QUEUE_SIZE,
+            policy=settings.LOG_OVERFLOW_POLICY,
+            report_interval=settings.LOG_DROP_REPORT_INTERVAL,
+            rotation=settings.LOG_ROTATION,
+            rotation_amount=settings.LOG_ROTATION_AMOUNT,
+            compress=settings.LOG_COMPRESS,
+            keep_files=settings.LOG_KEEP_FILES,
+            log_format=settings.LOG_FORMAT,
+            ring_size=settings.LOG_RING_SIZE,
+            ring_level=settings.LOG_RING_LEVEL,
+            dump_dir=settings.LOG_DUMP_DIR,
+            repeat_burst=settings.LOG_REPEAT_BURST,
+            repeat_window=settings.LOG_REPEAT_WINDOW,
         )
+        # Loggers created from now on pick up the level and flush settings
+        LoggerComposer.set_instance(self.logger_composer)
 
         self.tele_rag_logger = Logger("TeleRag", "network.log")
+        Tracing.configure(
+            settings.TRACE_SAMPLE_RATE, settings.TRACE_SLOW_THRESHOLD, settings.TRACE_FILE)
 
-        self.Scrapper = PyroClient(
-            api_id=settings.PYRO_API_ID,
-            api_hash=settings.PYRO_API_HASH,
-            history_limit=settings.PYRO_HISTORY_LIMIT,
-        )
+        # Heavy components (Pyrogram, the embedding model, ChromaDB and LLM clients)
+        # are imported and created in start(), concurrently with each other.
+        self.Scrapper = None
 
         self.RagClient = RagClient(
             host=settings.RAG_HOST,
@@ -40,16 +65,60 @@ class TeleRagService:
             model=settings.SENTENCE_TRANSFORMER_MODEL,
             mistral_api_key=settings.MISTRAL_API_KEY,
             mistral_model=settings.MISTRAL_API_MODEL,
-            scrapper=self.Scrapper,
+            scrapper=None,
+            queue_size=settings.RAG_QUEUE_MAX_SIZE,
+            queue_per_user=settings.RAG_QUEUE_MAX_PER_USER,
+            posts_per_channel=settings.PYRO_HISTORY_LIMIT,
+            route_channels=settings.RAG_ROUTE_CHANNELS,
+            routing_centers=settings.RAG_ROUTING_CENTERS,
+            dedup_threshold=settings.RAG_DEDUP_THRESHOLD,
+            context_tokens=settings.RAG_CONTEXT_TOKENS,
+            passage_tokens=settings.RAG_PASSAGE_TOKENS,
+            context_tokenizer=settings.RAG_CONTEXT_TOKENIZER,
         )
+        self.TaskScheduler = (
+            TaskScheduler(
+                settings.RAG_WORKER_PROCESSES,
+                settings.LOG_LEVEL,
+                shared_memory_size=settings.RAG_SHARED_MEMORY_MB * 1024 * 1024,
+                background_share=settings.RAG_BACKGROUND_SHARE,
+            )
+            if settings.RAG_PROCESS_POOL else None
+        )
+        if self.TaskScheduler is not None:
+            self.RagClient.include_scheduler(self.TaskScheduler)
 
         self.DataBaseHelper = None
 
+        self.Profiler = SamplingProfiler(
+            directory=settings.PROFILER_DIR,
+            rate=settings.PROFILER_RATE,
+            rotate_interval=settings.PROFILER_ROTATE_INTERVAL,
+            keep_files=settings.PROFILER_KEEP_FILES,
+        )
+
         self.BotApp = BotApp(
             token=settings.AIOGRAM_API_KEY,
             rag=self.RagClient,
-            scrapper=self.Scrapper,
+            scrapper=None,
             db_helper=self.DataBaseHelper,
+            webhook=WebhookSettings.from_config(settings),
+            handler_workers=settings.BOT_HANDLER_WORKERS,
+            user_rate=settings.RAG_USER_RATE,
+            user_burst=settings.RAG_USER_BURST,
+            supersede=settings.RAG_SUPERSEDE_STALE,
+            delivery=DeliverySettings.from_config(settings),
+            admins=settings.ADMIN_USER_IDS,
+            profiler=self.Profiler,
+        )
+
+        self.MetricsServer = (
+            MetricsServer(settings.METRICS_HOST, settings.METRICS_PORT)
+            if settings.METRICS_PORT else None
+        )
+        self.LoopMonitor = (
+            LoopLagMonitor(settings.LOOP_MONITOR_INTERVAL, settings.LOOP_LAG_THRESHOLD)
+            if settings.LOOP_MONITOR_INTERVAL else None
         )
 
         self.logger_composer.set_level_if_not_set()
@@ -58,30 +127,80 @@ class TeleRagService:
         self.register_stop_signal_handler()
 
     async def start(self):
-        await self.__create_db(self.settings)
-        await self.tele_rag_logger.info("Starting TeleRagService...")
-        await self.RagClient.start_rag()
-        await self.Scrapper.scrapper_start()
-        await self.BotApp.start()
+        self.tele_rag_logger.info("Starting TeleRagService...")
+        # Started first so that blocking calls during startup are caught too
+        if self.LoopMonitor is not None:
+            await self.LoopMonitor.start()
+        if self.settings.PROFILER_ENABLED:
+            self.Profiler.start()
+        orchestrator = StartupOrchestrator(self.tele_rag_logger)
+        if self.MetricsServer is not None:
+            orchestrator.add("metrics", self.MetricsServer.start)
+        orchestrator.add("database", lambda: self.__create_db(self.settings))
+        if self.TaskScheduler is not None:
+            orchestrator.add("process_pool", self.TaskScheduler.start)
+            orchestrator.add(
+                "embedding_model", self.RagClient.load_model, depends_on=("process_pool",))
+        else:
+            orchestrator.add("embedding_model", self.RagClient.load_model)
+        orchestrator.add("vector_store", self.RagClient.connect)
+        orchestrator.add("scrapper", self.__start_scrapper)
+        orchestrator.add(
+            "rag", self.RagClient.start_rag,
+            depends_on=("database", "embedding_model", "vector_store", "scrapper")
+        )
+        orchestrator.add(
+            "bot", self.BotApp.start,
+            depends_on=("database", "scrapper")
+        )
+        await orchestrator.run()
+
+        # Удаляем settings для очистки памяти
+        del self.settings
 
     async def idle(self):
-        await self.tele_rag_logger.info(
+        self.tele_rag_logger.info(
             "Waiting for stop signal... Press Ctrl+C to stop.")
         await self.stop_event.wait()
 
-        await self.tele_rag_logger.info(
+        self.tele_rag_logger.info(
             "Stop signal received. Stopping TeleRagService...")
-        await self.Scrapper.scrapper_stop()
-        await self.RagClient.stop()
         await self.BotApp.stop()
+        await self.RagClient.stop_rag()
+        if self.TaskScheduler is not None:
+            await self.TaskScheduler.stop()
+        await self.Scrapper.scrapper_stop()
+        await self.DataBaseHelper.close()
+        if self.MetricsServer is not None:
+            await self.MetricsServer.stop()
+        if self.LoopMonitor is not None:
+            await self.LoopMonitor.stop()
+        await asyncio.to_thread(self.Profiler.stop)
 
         self.stop_event.clear()
 
-        await self.tele_rag_logger.info("TeleRagService stopped.")
+        self.tele_rag_logger.info("TeleRagService stopped.")
+        # Last, so that everything logged while stopping is written
+        await stop_logging()
 
     def __stop_signal_handler(self):
         self.stop_event.set()
 
+    def __profiler_signal_handler(self):
+        # Stopping the profiler joins its thread and writes the profile
+        async def _toggle():
+            running = await asyncio.to_thread(self.Profiler.toggle)
+            self.tele_rag_logger.info("Profiler %s by SIGUSR2", "started" if running else "stopped")
+
+        asyncio.create_task(_toggle())
+
+    def __log_dump_signal_handler(self):
+        async def _dump():
+            path = await dump_recent_records()
+            self.tele_rag_logger.info("Recent log records dumped to %s by SIGUSR1", path)
+
+        asyncio.create_task(_dump())
+
     def register_stop_signal_handler(self):
         """
         Register a signal handler for stopping the service.
@@ -91,6 +210,10 @@ class TeleRagService:
         loop = asyncio.get_event_loop()
         loop.add_signal_handler(signal.SIGTERM, self.__stop_signal_handler, )
         loop.add_signal_handler(signal.SIGINT, self.__stop_signal_handler, )
+        loop.add_signal_handler(
+            signal.SIGUSR2, self.__profiler_signal_handler, )
+        loop.add_signal_handler(
+            signal.SIGUSR1, self.__log_dump_signal_handler, )
 
     async def __create_db(self, settings: TGConfig):
         """
@@ -102,13 +225,44 @@ class TeleRagService:
 
         self.DataBaseHelper = await DataBaseHelper.create(
             db_url=db_url,
-            scrapper=self.Scrapper
+            scrapper=None
         )
 
         self.BotApp.include_db(self.DataBaseHelper)
 
-        # Удаляем settings для очистки памяти
-        del self.settings
+        if settings.RAG_QUEUE_BACKEND == "postgres":
+            job_queue = RagJobQueue(
+                self.DataBaseHelper.db_manager,
+                visibility_timeout=settings.RAG_JOB_VISIBILITY_TIMEOUT,
+                max_attempts=settings.RAG_JOB_MAX_ATTEMPTS,
+                retry_backoff=settings.RAG_JOB_RETRY_BACKOFF,
+                poll_interval=settings.RAG_JOB_POLL_INTERVAL,
+                result_retention=settings.RAG_JOB_RESULT_RETENTION,
+                max_pending=settings.RAG_QUEUE_MAX_SIZE,
+                max_pending_per_user=settings.RAG_QUEUE_MAX_PER_USER,
+                cost=request_cost,
+            )
+            self.BotApp.include_job_queue(job_queue)
+            self.RagClient.include_job_queue(job_queue)
+
+    async def __start_scrapper(self):
+        """
+        Import Pyrogram off the event loop, then create and authenticate the scrapper.
+        """
+        pyro_module = await asyncio.to_thread(
+            importlib.import_module,
+            "source.TelegramMessageScrapper.PyroClient"
+        )
+        self.Scrapper = pyro_module.PyroClient(
+            api_id=self.settings.PYRO_API_ID,
+            api_hash=self.settings.PYRO_API_HASH,
+            history_limit=self.settings.PYRO_HISTORY_LIMIT,
+            fetch_concurrency=self.settings.PYRO_FETCH_CONCURRENCY,
+            background_share=self.settings.RAG_BACKGROUND_SHARE,
+        )
+        self.RagClient.include_scrapper(self.Scrapper)
+        self.BotApp.include_scrapper(self.Scrapper)
+        await self.Scrapper.scrapper_start()
 
     @staticmethod
     def construct_db_url(settings: TGConfig) -> str:
@@ -61,7 +61,7 @@ class Scrapper:
         if not self.running:
             return
 
-        await self.scrapper_logger.debug("Got update request... Updating channels...")
+        self.scrapper_logger.debug("Got update request... Updating channels...")
 
         print("RECORDS:", records)
 
@@ -117,7 +117,7 @@ class Scrapper:
                     del self.channels_and_messages[record.channel_id]
                     await self.update_or_create_message_handler()
             except self.ScrapperException as e:
-                await self.scrapper_logger.warning("An error occurred while updating the scrapper: " + str(e) + "Skipping this channel.")
+                self.scrapper_logger.warning("An error occurred while updating the scrapper: %s. Skipping this channel.", e)
 
     async def fetch(self, channel_id: int):
         """
@@ -133,15 +133,16 @@ class Scrapper:
                 if message.text:
                     msgs.append(message.text)
                 else:
-                    await self.scrapper_logger.debug(f"Message {message.message_id} in channel {channel_id} is not a text message. Skipping.")
+                    self.scrapper_logger.debug("Message %s in channel %s is not a text message. Skipping.", message.message_id, channel_id)
         except Exception as e:
-            await self.scrapper_logger.warning(f"An error occurred while fetching messages from channel {channel_id}: {e}")
+            self.scrapper_logger.warning(
+                "An error occurred while fetching messages from channel %s: %s", channel_id, e)
         finally:
             if msgs:
                 self.channels_and_messages[channel_id][1].extend(msgs)
-                await self.scrapper_logger.debug(f"Fetched {len(msgs)} messages from channel {channel_id}.")
+                self.scrapper_logger.debug("Fetched %s messages from channel %s.", len(msgs), channel_id)
             else:
-                await self.scrapper_logger.debug(f"No messages fetched from channel {channel_id}.")
+                self.scrapper_logger.debug("No messages fetched from channel %s.", channel_id)
 
     async def update_or_create_message_handler(self) -> None:
         """
@@ -196,7 +197,7 @@ class Scrapper:
         The main loop of the scrapper. It runs in a separate process and handles the incoming messages.
         """
         await self.pyro_client.start()
-        await self.scrapper_logger.debug("Scrapper started.")
+        self.scrapper_logger.debug("Scrapper started.")
         self.running = True
 
     async def scrapper_stop(self):
@@ -204,5 +205,5 @@ class Scrapper:
         Stops the scrapper.
         """
         await self.pyro_client.stop()
-        await self.scrapper_logger.debug("Scrapper stopped.")
+        self.scrapper_logger.debug("Scrapper stopped.")
         self.running = False
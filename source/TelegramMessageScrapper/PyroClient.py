@@ -3,15 +3,27 @@ import re
 
 from pyrogram import Client, errors
 
+from source.PriorityScheduling import Priority, PriorityScheduler
+
 
 class PyroClient:
-    def __init__(self, api_id: int, api_hash: str, history_limit: int):
+    def __init__(
+        self,
+        api_id: int,
+        api_hash: str,
+        history_limit: int,
+        fetch_concurrency: int = 2,
+        background_share: float = 0.2
+    ):
         self.pyro_client = Client(
             name="TELERAG-MessageScrapper",
             api_id=api_id,
             api_hash=api_hash
         )
         self.message_hist_limit = history_limit
+        # History fetches of questions go ahead of the ones of background ingestion
+        self.priorities = PriorityScheduler(
+            "scrapper", fetch_concurrency, background_share)
 
     async def scrapper_start(self):
         await self.pyro_client.start()
@@ -136,10 +148,18 @@ class PyroClient:
                 "description": f"Error unsubscribing from {channel_identifier}"
             }
 
-    async def fetch(self, channel_identifier: str):
+    async def fetch(
+        self,
+        channel_identifier: str,
+        priority: Priority = Priority.INTERACTIVE
+    ):
         """
         Fetches the messages from the channel.
         """
+        async with self.priorities.slot(priority):
+            return await self._fetch(channel_identifier)
+
+    async def _fetch(self, channel_identifier: str):
         msgs = []
         try:
             async for message in self.pyro_client.get_chat_history(
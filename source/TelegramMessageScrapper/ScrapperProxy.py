@@ -0,0 +1,35 @@
+from source.Database.JobQueue import RagJobQueue
+from source.Logging import Logger
+
+
+class ScrapperProxy:
+    """
+    Stand-in for PyroClient in processes that do not run Pyrogram (the bot role).
+    Every call is sent as a job to the scrapper queue and executed by the ingest role,
+    the caller waits for the stored result.
+    """
+    methods = ("subscribe_to_channel", "unsubscribe_from_channel")
+
+    def __init__(self, job_queue: RagJobQueue, timeout: float = 60.0):
+        self.proxy_logger = Logger("ScrapperProxy", "network.log")
+        self.job_queue = job_queue
+        self.timeout = timeout
+
+    async def subscribe_to_channel(self, channel_identifier: str) -> dict:
+        return await self._call("subscribe_to_channel", str(channel_identifier))
+
+    async def unsubscribe_from_channel(self, channel_identifier: str) -> dict:
+        return await self._call("unsubscribe_from_channel", str(channel_identifier))
+
+    async def _call(self, method: str, *args) -> dict:
+        job_id = await self.job_queue.enqueue({"method": method, "args": list(args)})
+        try:
+            return await self.job_queue.wait_result(job_id, timeout=self.timeout)
+        except (TimeoutError, RuntimeError) as e:
+            self.proxy_logger.error("Remote scrapper call %s%s failed: %s", method, args, e)
+            return {
+                "status": "error",
+                "description": str(e),
+                "channel_id": None,
+                "channel_name": None
+            }
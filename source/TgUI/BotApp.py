@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Iterable, Optional, TYPE_CHECKING
 
 from aiogram.client.default import DefaultBotProperties
 from aiogram import Bot, Dispatcher, F, Router
@@ -13,22 +13,41 @@ from aiogram.types import (
     BotCommand,
     ReplyKeyboardMarkup,
     KeyboardButton,
+    FSInputFile,
 )
 
 from source.TgUI.States import AddSourceStates
-from source.Logging import Logger
+from source.TgUI.Webhook import WebhookServer, WebhookSettings
+from source.TgUI.Delivery import DeliverySettings, ResponseSender
+from source.Logging import Logger, dump_recent_records
+from source.Metrics import record_stage
+from source.Tracing import Trace, continue_trace, use_trace
+from source.RateLimiting import KeyedTokenBuckets
+from source.SamplingProfiler import SamplingProfiler
 from source.Database.DBHelper import DataBaseHelper
-from source.ChromaАndRAG.Rag import RagClient
-from source.TelegramMessageScrapper.PyroClient import PyroClient
+from source.Database.JobQueue import RagJobQueue
 import asyncio
+import time
+
+if TYPE_CHECKING:
+    from source.ChromaАndRAG.Rag import RagClient
+    from source.TelegramMessageScrapper.PyroClient import PyroClient
 
 
 class BotApp:
     def __init__(
         self, token: str,
         db_helper: Optional[DataBaseHelper],
-        scrapper: Optional[PyroClient],
-        rag: RagClient
+        scrapper: Optional["PyroClient"],
+        rag: Optional["RagClient"],
+        webhook: Optional[WebhookSettings] = None,
+        handler_workers: int = 16,
+        user_rate: float = 0.0,
+        user_burst: int = 1,
+        supersede: bool = False,
+        delivery: Optional[DeliverySettings] = None,
+        admins: Iterable[int] = (),
+        profiler: Optional[SamplingProfiler] = None,
     ):
         self.telegram_ui_logger = Logger("TelegramUI", "network.log")
         self.bot = Bot(
@@ -40,16 +59,81 @@ class BotApp:
         self.dispatcher = Dispatcher(storage=MemoryStorage())
         self.router = Router()
         self.dispatcher.include_router(self.router)
+        self.admins = frozenset(admins)
+        self.Profiler = profiler
         self.__include_handlers()
 
         self.DataBaseHelper = db_helper
         self.RagClient = rag
         self.Scrapper = scrapper
+        self.JobQueue: Optional[RagJobQueue] = None
+        # Queues a question passes through before its answer is ready
+        self._pipeline_queues: tuple = ()
+        self._response_task: Optional[asyncio.Task] = None
+        self._polling_task: Optional[asyncio.Task] = None
+
+        self.handler_workers = handler_workers
+        # Per-user admission control for RAG questions, disabled with user_rate=0
+        self.user_buckets: Optional[KeyedTokenBuckets] = (
+            KeyedTokenBuckets(user_rate, user_burst) if user_rate > 0 else None
+        )
+        # A new question cancels the user's older ones that are still in work
+        self.supersede = supersede
+        self.webhook_server: Optional[WebhookServer] = None
+        if webhook is not None:
+            self.webhook_server = WebhookServer(
+                self.bot,
+                self.dispatcher,
+                webhook,
+                workers=handler_workers,
+            )
+        # Answers are sent by a rate limited worker pool
+        self.sender = ResponseSender(self.bot, delivery or DeliverySettings())
+        # Without a local RagClient (bot role) answers are put here by whoever
+        # consumes the delivery queue.
+        self.response_queue: asyncio.Queue = (
+            rag.response_queue if rag is not None else asyncio.Queue()
+        )
 
     def include_db(self, db_helper: DataBaseHelper):
         if self.DataBaseHelper is None:
             self.DataBaseHelper = db_helper
 
+    def include_scrapper(self, scrapper: "PyroClient"):
+        if self.Scrapper is None:
+            self.Scrapper = scrapper
+
+    def include_job_queue(
+        self,
+        job_queue: RagJobQueue,
+        pipeline: tuple = ()
+    ):
+        """
+        Questions are enqueued to job_queue. pipeline names the further queues
+        a question goes through (the split roles), so that superseding a question
+        also reaches the stages it has already moved on to.
+        """
+        if self.JobQueue is None:
+            self.JobQueue = job_queue
+            self._pipeline_queues = (job_queue.queue, *pipeline)
+
+    async def cancel_user_work(self, user_id: int, supersede: bool = False) -> int:
+        """
+        Cancel the user's queued and running questions.
+        With supersede=True answers that are already computed are still delivered,
+        otherwise (the user left) everything of the user is dropped.
+        Returns the number of cancelled questions.
+        """
+        cancelled = 0
+        if self.JobQueue is not None:
+            cancelled += await self.JobQueue.cancel_user(
+                user_id,
+                queues=self._pipeline_queues if supersede else None
+            )
+        if self.RagClient is not None:
+            cancelled += self.RagClient.cancel_user(user_id)
+        return cancelled
+
     def __include_handlers(self):
         # --- Хэндлеры для сообщений ---
         self.router.message.register(self.__start_handler, F.text == "/start")
@@ -65,6 +149,16 @@ class BotApp:
         )
         self.router.message.register(
             self.__get_channels, F.text == "/get_channels")
+        self.router.message.register(
+            self.__profile_handler,
+            F.text.startswith("/profile"),
+            F.from_user.id.in_(self.admins),
+        )
+        self.router.message.register(
+            self.__log_dump_handler,
+            F.text.startswith("/logdump"),
+            F.from_user.id.in_(self.admins),
+        )
         self.router.message.register(
             self.__handle_source, AddSourceStates.waiting_for_source
         )
@@ -77,8 +171,8 @@ class BotApp:
         self.router.callback_query.register(self.__inline_button_handler)
 
     async def __start_handler(self, message: Message):
-        await self.telegram_ui_logger.info(
-            f"User {message.from_user.id} started the bot.")
+        self.telegram_ui_logger.info(
+            "User %s started the bot.", message.from_user.id)
 
         await self.bot.set_my_commands([
             BotCommand(command="/start", description="Начать работу с ботом"),
@@ -113,11 +207,49 @@ class BotApp:
             "https://www.gnu.org/licenses/agpl-3.0.txt"
         )
 
+    async def __profile_handler(self, message: Message):
+        """
+        /profile start|stop|status - управление профилировщиком, только для администраторов.
+        """
+        if self.Profiler is None:
+            await message.answer("Профилировщик не настроен.")
+            return
+        command = message.text.split()[1:2] or ["status"]
+        if command[0] == "start":
+            self.Profiler.start()
+            self.telegram_ui_logger.info(
+                "Profiler started by admin %s", message.from_user.id)
+        elif command[0] == "stop":
+            path = await asyncio.to_thread(self.Profiler.stop)
+            self.telegram_ui_logger.info(
+                "Profiler stopped by admin %s", message.from_user.id)
+            if path:
+                await message.answer(f"Последний профиль: {path}")
+        await message.answer(self.Profiler.status())
+
+    async def __log_dump_handler(self, message: Message):
+        """
+        /logdump [N] - последние N записей логов всех уровней файлом, только для администраторов.
+        """
+        limit = message.text.split()[1:2]
+        path = await dump_recent_records(
+            int(limit[0]) if limit and limit[0].isdigit() else None)
+        if path is None:
+            await message.answer("Буфер последних записей отключён.")
+            return
+        self.telegram_ui_logger.info(
+            "Recent log records dumped to %s by admin %s", path, message.from_user.id)
+        await message.answer_document(FSInputFile(path))
+
     async def __end_handler(self, message: Message):
         await message.answer(
             "Вы успешно вышли из сервиса. Все данные будут удалены.",
             reply_markup=ReplyKeyboardRemove()
         )
+        cancelled = await self.cancel_user_work(message.from_user.id)
+        if cancelled:
+            self.telegram_ui_logger.info(
+                "Cancelled %s requests of user %s on /end", cancelled, message.from_user.id)
         channels = await self.DataBaseHelper.delete_user(message.from_user.id)
 
         for channel in channels:
@@ -172,6 +304,12 @@ class BotApp:
                 message.from_user.id,
                 add=[int(channel_info["channel_id"])]
             )
+            if self.RagClient is not None:
+                # Split roles: the ingest role backfills when it serves the subscription
+                self.RagClient.backfill([{
+                    "channel_id": int(channel_info["channel_id"]),
+                    "channel_name": channel_info["channel_name"],
+                }])
         elif channel_info["status"] == "private_channel":
             await message.answer(
                 "Приватные каналы пока не поддерживаются."
@@ -251,14 +389,27 @@ class BotApp:
 
     async def _response_loop(self):
         while True:
-            response = await self.RagClient.response_queue.get()
+            response = await self.response_queue.get()
             if response is None:
                 continue
-            await self.bot.send_message(
-                response["user_id"],
-                response["response_text"],
-            )
-            print(f"Got response: {response}")
+            with continue_trace(response) as trace:
+                self.sender.submit(
+                    response["user_id"], self.__response_text(response), trace)
+
+    async def deliver(self, response: dict):
+        """
+        Send an answer and wait until it is delivered or given up on.
+        """
+        with continue_trace(response) as trace:
+            await self.sender.send(
+                response["user_id"], self.__response_text(response), trace)
+
+    @staticmethod
+    def __response_text(response: dict) -> str:
+        # The pipeline returns no text when retrieval or the LLM failed
+        return response.get("response_text") or (
+            "Не удалось получить ответ. Пожалуйста, повторите запрос позже."
+        )
 
     @staticmethod
     async def __send_paginated_channels(
@@ -342,6 +493,11 @@ class BotApp:
         await callback_query.answer()
 
     async def __message_handler(self, message: Message):
+        # Every question gets a trace that follows it until the answer is delivered
+        with use_trace(Trace.start(message.from_user.id)) as trace:
+            await self.__handle_question(message, trace)
+
+    async def __handle_question(self, message: Message, trace: Trace):
         if not message.text:
             await message.answer(
                 "Пожалуйста, отправьте текстовое сообщение."
@@ -356,10 +512,20 @@ class BotApp:
             )
             return
 
+        if self.user_buckets is not None:
+            retry_after = self.user_buckets.try_acquire(message.from_user.id)
+            if retry_after:
+                await message.answer(
+                    "Слишком много запросов. Пожалуйста, повторите"
+                    f" через {int(retry_after) + 1} сек."
+                )
+                return
+
+        db_started = time.perf_counter()
         try:
             user = await self.DataBaseHelper.get_user(message.from_user.id)
         except ValueError:
-            await self.telegram_ui_logger.error("Could not get user from DB.")
+            self.telegram_ui_logger.error("Could not get user from DB.")
             await message.answer(
                 "Вы не зарегистрированы в системе. Пожалуйста,"
                 " добавьте источник, чтобы получить доступ к этой функции."
@@ -368,7 +534,7 @@ class BotApp:
 
         user_channels: list[int] = user['channels'] if user else []
         if not user_channels:
-            await self.telegram_ui_logger.error(
+            self.telegram_ui_logger.error(
                 "User has no channels. Or there is something wrong with DB."
             )
             await message.answer(
@@ -377,39 +543,89 @@ class BotApp:
             )
             return
 
-        await message.answer(
-            "Сообщение получено! Ожидайте ответа RAG."
-        )
-
-        texts = []
+        channels = []
         for channel in user_channels:
             channel_info = await self.DataBaseHelper.get_channel(channel)
-            posts = await self.Scrapper.fetch(channel)
-            texts.append(
+            channels.append(
                 {
                     "channel_id": channel,
                     "channel_name": channel_info['name'],
-                    "posts": posts
                 }
             )
+        record_stage("db_lookup", time.perf_counter() - db_started)
+
+        # Posts are fetched by the RAG side, so the bot frontend never has to
+        # talk to Pyrogram on the hot path.
+        task = {
+            "user_id": message.from_user.id,
+            "request_text": message.text,
+            "channels": channels
+        }
+        cancelled = 0
+        try:
+            if self.JobQueue is not None:
+                if self.supersede:
+                    cancelled = await self.cancel_user_work(
+                        message.from_user.id, supersede=True)
+                trace.enqueued(self.JobQueue.queue, task)
+                await self.JobQueue.enqueue(task, user_id=message.from_user.id)
+            else:
+                trace.enqueued("request_queue", task)
+                cancelled = self.RagClient.submit(task, supersede=self.supersede)
+        except asyncio.QueueFull:
+            self.telegram_ui_logger.warning(
+                "Request queue is full, rejected request of user %s", message.from_user.id)
+            await message.answer(
+                "Сервис сейчас перегружен. Пожалуйста,"
+                " повторите запрос немного позже."
+            )
+            return
 
-        self.RagClient.request_queue.put_nowait(
-            {
-                "user_id": message.from_user.id,
-                "request_text": message.text,
-                "texts": texts
-            }
+        if cancelled:
+            self.telegram_ui_logger.info(
+                "Question of user %s superseded %s older ones", message.from_user.id, cancelled)
+            await message.answer(
+                "Сообщение получено! Предыдущий вопрос отменён,"
+                " ожидайте ответа RAG на новый."
+            )
+            return
+        await message.answer(
+            "Сообщение получено! Ожидайте ответа RAG."
         )
 
     async def start(self):
+        """
+        Starts the response loop and the update intake (webhook server or polling) and returns.
+        Signals are handled by the owning service, not by aiogram.
+        """
+        self.sender.start()
         self._response_task = asyncio.create_task(self._response_loop())
-        await self.dispatcher.start_polling(self.bot)
+        if self.webhook_server is not None:
+            await self.webhook_server.start()
+            return
+        await self.bot.delete_webhook()
+        self._polling_task = asyncio.create_task(
+            self.dispatcher.start_polling(
+                self.bot,
+                handle_signals=False,
+                tasks_concurrency_limit=self.handler_workers,
+            )
+        )
 
     async def stop(self):
+        if self.webhook_server is not None:
+            await self.webhook_server.stop()
+        if self._polling_task:
+            try:
+                await self.dispatcher.stop_polling()
+            except RuntimeError:
+                pass  # polling has already finished
+            await asyncio.gather(self._polling_task, return_exceptions=True)
         if self._response_task:
             self._response_task.cancel()
             try:
                 await self._response_task
             except asyncio.CancelledError:
                 pass
+        await self.sender.stop()
         await self.bot.session.close()
@@ -0,0 +1,378 @@
+"""
+Delivery of answers to Telegram.
+
+Answers are split into messages that fit Telegram's length limit and sent by a pool
+of workers. Sending is bounded by a global token bucket (messages per second per bot)
+and a token bucket per chat, so throughput is limited by Telegram's limits rather
+than by awaiting every send in turn. Messages to the same chat keep their order.
+"""
+import asyncio
+import re
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from source.Logging import Logger
+from source import Tracing
+from source.Metrics import STAGE_ERRORS, record_stage, watch_queue
+from source.Tracing import Trace, use_trace
+from source.DynamicConfigurationLoading import TGConfig
+from source.RateLimiting import KeyedTokenBuckets, TokenBucket
+
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Tags supported by Telegram's HTML parse mode
+_TAG_RE = re.compile(
+    r"</?(b|strong|i|em|u|ins|s|strike|del|span|tg-spoiler|a|code|pre"
+    r"|blockquote|tg-emoji)(?:\s[^<>]*)?>",
+    re.IGNORECASE,
+)
+_SEPARATORS = ("\n\n", "\n", ". ")
+
+
+def _utf16_len(text: str) -> int:
+    # Telegram counts message length in UTF-16 code units
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _fit(text: str, room: int) -> int:
+    """Number of leading characters of text that fit into room UTF-16 units."""
+    if room <= 0:
+        return 0
+    if _utf16_len(text) <= room:
+        return len(text)
+    used = 0
+    for index, char in enumerate(text):
+        used += 2 if ord(char) > 0xFFFF else 1
+        if used > room:
+            return index
+    return len(text)
+
+
+def _cut_position(text: str, room: int) -> Tuple[int, bool]:
+    """
+    Where to cut text so that the first part fits into room.
+    Prefers paragraph, line, sentence and word boundaries.
+    Returns the position and whether it is a natural boundary.
+    """
+    end = _fit(text, room)
+    window = text[:end]
+    for separator in _SEPARATORS:
+        index = window.rfind(separator)
+        if index >= end // 2:
+            return index + len(separator), True
+    index = window.rfind(" ")
+    if index > 0:
+        return index + 1, True
+    # Do not cut an HTML entity such as &amp; in half
+    amp = window.rfind("&")
+    if amp > window.rfind(";") and end - amp < 10 and amp > 0:
+        end = amp
+    return end, False
+
+
+def split_html_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """
+    Split an HTML formatted message into parts of at most limit characters.
+    Parts are cut at text boundaries, never inside a tag or an entity.
+    Tags that are open at a cut are closed at the end of the part
+    and opened again at the start of the next one.
+    """
+    if _utf16_len(text) <= limit:
+        return [text]
+
+    chunks: List[str] = []
+    stack: List[Tuple[str, str]] = []  # (name, opening tag) of open tags
+    parts: List[str] = []
+    size = 0
+    has_text = False
+
+    def reserved() -> int:
+        return sum(len(name) + 3 for name, _ in stack)
+
+    def flush():
+        nonlocal parts, size, has_text
+        if has_text:
+            chunks.append("".join(parts) + "".join(
+                f"</{name}>" for name, _ in reversed(stack)))
+        parts = [tag for _, tag in stack]
+        size = sum(_utf16_len(tag) for tag in parts)
+        has_text = False
+
+    def add_text(segment: str):
+        nonlocal size, has_text
+        while segment:
+            room = limit - size - reserved()
+            if _utf16_len(segment) <= room:
+                parts.append(segment)
+                size += _utf16_len(segment)
+                has_text = has_text or bool(segment.strip())
+                return
+            cut, natural = _cut_position(segment, room)
+            if (not natural or cut == 0) and has_text:
+                # Better to start a new part than to cut a word
+                flush()
+                continue
+            cut = max(cut, 1)
+            parts.append(segment[:cut])
+            has_text = True
+            flush()
+            segment = segment[cut:].lstrip()
+
+    position = 0
+    for match in _TAG_RE.finditer(text):
+        add_text(text[position:match.start()])
+        position = match.end()
+        tag, name = match.group(0), match.group(1).lower()
+        tag_size = _utf16_len(tag)
+        if tag.startswith("</"):
+            parts.append(tag)
+            size += tag_size
+            for index in range(len(stack) - 1, -1, -1):
+                if stack[index][0] == name:
+                    del stack[index]
+                    break
+            continue
+        if size + tag_size + reserved() + len(name) + 3 > limit:
+            flush()
+        parts.append(tag)
+        size += tag_size
+        stack.append((name, tag))
+    add_text(text[position:])
+    flush()
+    return chunks
+
+
+@dataclass
+class DeliverySettings:
+    workers: int = 8
+    global_rate: float = 30.0
+    chat_rate: float = 1.0
+    chat_burst: int = 3
+    max_retries: int = 5
+
+    @classmethod
+    def from_config(cls, settings: TGConfig) -> "DeliverySettings":
+        return cls(
+            workers=settings.DELIVERY_WORKERS,
+            global_rate=settings.DELIVERY_GLOBAL_RATE,
+            chat_rate=settings.DELIVERY_CHAT_RATE,
+            chat_burst=settings.DELIVERY_CHAT_BURST,
+            max_retries=settings.DELIVERY_MAX_RETRIES,
+        )
+
+
+@dataclass
+class OutgoingMessage:
+    chat_id: int
+    chunks: List[str]
+    future: asyncio.Future
+    submitted: float = 0.0
+    trace: Optional[Trace] = None
+    sent: int = 0
+    attempts: int = 0
+    # HTML could not be parsed by Telegram, the rest is sent as plain text
+    plain: bool = False
+
+
+class ResponseSender:
+    """
+    Sends answers with a pool of workers.
+
+    Every chat has a FIFO of outgoing messages. A chat is handed to one worker at a time,
+    which keeps the order within the chat, while different chats are sent concurrently.
+    A chat whose bucket is empty, or that got RetryAfter, is put aside with a timer
+    instead of occupying a worker.
+    """
+
+    def __init__(self, bot: Bot, settings: DeliverySettings):
+        self.delivery_logger = Logger("Delivery", "network.log")
+        self.bot = bot
+        self.workers = settings.workers
+        self.max_retries = settings.max_retries
+
+        # One second worth of burst for the bot, chat_burst messages for a chat
+        self.global_bucket = TokenBucket(settings.global_rate, settings.global_rate)
+        self.chat_buckets = KeyedTokenBuckets(settings.chat_rate, settings.chat_burst)
+
+        self._pending: Dict[int, Deque[OutgoingMessage]] = {}
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._timers: Set[asyncio.TimerHandle] = set()
+        self._worker_tasks: List[asyncio.Task] = []
+        self._idle = asyncio.Event()
+        self._idle.set()
+        watch_queue("delivery", self)
+
+    def start(self):
+        for i in range(self.workers):
+            self._worker_tasks.append(asyncio.create_task(self._worker(i)))
+
+    async def stop(self, drain_timeout: float = 10.0):
+        """
+        Let queued messages go out for up to drain_timeout seconds, then stop.
+        Futures of messages that were not sent are cancelled.
+        """
+        try:
+            await asyncio.wait_for(self._idle.wait(), drain_timeout)
+        except asyncio.TimeoutError:
+            self.delivery_logger.warning(
+                "Dropping undelivered messages for %s chats on shutdown", len(self._pending))
+        for timer in self._timers:
+            timer.cancel()
+        self._timers.clear()
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        for messages in self._pending.values():
+            for message in messages:
+                message.future.cancel()
+        self._pending.clear()
+        self._idle.set()
+
+    def submit(
+        self,
+        chat_id: int,
+        text: str,
+        trace: Optional[Trace] = None
+    ) -> asyncio.Future:
+        """
+        Queue a message. The returned future resolves once all of its parts were
+        sent, to None, or to the exception that made the delivery give up.
+        The trace of the request, if given, is finished once the message is delivered.
+        """
+        message = OutgoingMessage(
+            chat_id=chat_id,
+            chunks=split_html_message(text),
+            future=asyncio.get_running_loop().create_future(),
+            submitted=time.perf_counter(),
+            trace=trace,
+        )
+        messages = self._pending.get(chat_id)
+        if messages is None:
+            self._pending[chat_id] = deque([message])
+            self._idle.clear()
+            self._ready.put_nowait(chat_id)
+        else:
+            messages.append(message)
+        return message.future
+
+    async def send(
+        self,
+        chat_id: int,
+        text: str,
+        trace: Optional[Trace] = None
+    ) -> Optional[Exception]:
+        """Queue a message and wait until it is delivered."""
+        return await self.submit(chat_id, text, trace)
+
+    def qsize(self) -> int:
+        return sum(len(messages) for messages in self._pending.values())
+
+    async def _worker(self, number: int):
+        while True:
+            chat_id = await self._ready.get()
+            if chat_id not in self._pending:
+                continue
+            delay = self.chat_buckets.try_acquire(chat_id)
+            if delay == 0.0:
+                await self.global_bucket.acquire()
+                try:
+                    with use_trace(self._pending[chat_id][0].trace):
+                        delay = await self._send_next(chat_id)
+                except Exception as e:
+                    self.delivery_logger.error(
+                        "Worker %s failed to send to chat %s: %s", number, chat_id, e)
+                    self._finish(chat_id, e)
+            if chat_id in self._pending:
+                self._schedule(chat_id, delay)
+
+    def _schedule(self, chat_id: int, delay: float):
+        if delay <= 0:
+            self._ready.put_nowait(chat_id)
+            return
+        timer = None
+
+        def _wake():
+            self._timers.discard(timer)
+            self._ready.put_nowait(chat_id)
+
+        timer = asyncio.get_running_loop().call_later(delay, _wake)
+        self._timers.add(timer)
+
+    async def _send_next(self, chat_id: int) -> float:
+        """
+        Send the next part of the chat's oldest message.
+        Returns how long the chat has to wait before its next send.
+        """
+        message = self._pending[chat_id][0]
+        try:
+            if message.plain:
+                await self.bot.send_message(
+                    chat_id, message.chunks[message.sent], parse_mode=None)
+            else:
+                await self.bot.send_message(chat_id, message.chunks[message.sent])
+        except TelegramRetryAfter as e:
+            self.delivery_logger.warning(
+                "Flood control for chat %s, retrying in %ss", chat_id, e.retry_after)
+            self.chat_buckets.penalize(chat_id, e.retry_after)
+            return e.retry_after
+        except TelegramForbiddenError as e:
+            # The user blocked the bot, nothing more can be sent to the chat
+            self.delivery_logger.warning(
+                "Chat %s is not reachable: %s", chat_id, e.message)
+            while chat_id in self._pending:
+                self._finish(chat_id, e)
+            return 0.0
+        except TelegramBadRequest as e:
+            if not message.plain and "can't parse entities" in e.message:
+                self.delivery_logger.warning(
+                    "Answer for chat %s is not valid HTML, sending as plain text", chat_id)
+                message.plain = True
+                return 0.0
+            self.delivery_logger.error(
+                "Telegram rejected a message for chat %s: %s", chat_id, e.message)
+            self._finish(chat_id, e)
+            return 0.0
+        except (TelegramNetworkError, TelegramServerError) as e:
+            message.attempts += 1
+            if message.attempts > self.max_retries:
+                self.delivery_logger.error(
+                    "Giving up on a message for chat %s: %s", chat_id, e)
+                self._finish(chat_id, e)
+                return 0.0
+            return min(2 ** message.attempts, 30)
+
+        message.sent += 1
+        if message.sent == len(message.chunks):
+            self._finish(chat_id)
+        return 0.0
+
+    def _finish(self, chat_id: int, error: Optional[Exception] = None):
+        messages = self._pending[chat_id]
+        message = messages.popleft()
+        if not messages:
+            del self._pending[chat_id]
+            if not self._pending:
+                self._idle.set()
+        # Delivery time includes waiting for the rate limits
+        if error is None:
+            with use_trace(message.trace):
+                record_stage("delivery", time.perf_counter() - message.submitted)
+        else:
+            STAGE_ERRORS.labels(stage="delivery").inc()
+        if message.trace is not None:
+            asyncio.create_task(Tracing.finish(message.trace))
+        if not message.future.done():
+            message.future.set_result(error)
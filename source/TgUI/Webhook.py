@@ -0,0 +1,141 @@
+import asyncio
+import hmac
+from dataclasses import dataclass
+from typing import List, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from source.Logging import Logger
+from source.Metrics import watch_queue
+from source.DynamicConfigurationLoading import TGConfig
+
+
+@dataclass
+class WebhookSettings:
+    base_url: str
+    path: str = "/webhook"
+    host: str = "0.0.0.0"
+    port: int = 8080
+    secret: str = ""
+    queue_size: int = 1000
+
+    @classmethod
+    def from_config(cls, settings: TGConfig) -> Optional["WebhookSettings"]:
+        """
+        Returns webhook settings if the bot is configured for webhook mode, otherwise None.
+        """
+        if settings.BOT_MODE != "webhook":
+            return None
+        return cls(
+            base_url=settings.WEBHOOK_BASE_URL,
+            path=settings.WEBHOOK_PATH,
+            host=settings.WEBHOOK_HOST,
+            port=settings.WEBHOOK_PORT,
+            secret=settings.WEBHOOK_SECRET,
+            queue_size=settings.BOT_UPDATE_QUEUE_SIZE,
+        )
+
+
+class WebhookServer:
+    """
+    Receives updates from Telegram over HTTP and feeds them to the dispatcher.
+
+    The request handler only validates the update and puts it into a bounded queue,
+    so Telegram gets its 200 immediately. A fixed pool of workers drains the queue,
+    which makes handler concurrency an explicit setting. When the queue is full the
+    update is refused with 503 and Telegram redelivers it later.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        dispatcher: Dispatcher,
+        settings: WebhookSettings,
+        workers: int = 16,
+    ):
+        self.webhook_logger = Logger("Webhook", "network.log")
+        self.bot = bot
+        self.dispatcher = dispatcher
+        self.settings = settings
+        self.workers = workers
+
+        self.update_queue: asyncio.Queue[Update] = asyncio.Queue(
+            maxsize=settings.queue_size)
+        watch_queue("webhook_updates", self.update_queue)
+        self._worker_tasks: List[asyncio.Task] = []
+        self._runner: Optional[web.AppRunner] = None
+
+        self.app = web.Application()
+        self.app.router.add_post(settings.path, self._handle_update)
+
+    async def start(self, register: bool = True):
+        """
+        Start the HTTP server and the worker pool.
+        With register=True the webhook URL is also registered at Telegram.
+        """
+        for i in range(self.workers):
+            self._worker_tasks.append(
+                asyncio.create_task(self._worker(i)))
+
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(
+            self._runner, self.settings.host, self.settings.port)
+        await site.start()
+
+        if register and self.settings.base_url:
+            await self.bot.set_webhook(
+                url=self.settings.base_url.rstrip("/") + self.settings.path,
+                secret_token=self.settings.secret or None,
+                allowed_updates=self.dispatcher.resolve_used_update_types(),
+                max_connections=100,
+            )
+        self.webhook_logger.info(
+            "Webhook server listening on %s:%s%s with %s workers",
+            self.settings.host, self.settings.port, self.settings.path, self.workers)
+
+    async def stop(self, drain_timeout: float = 10.0):
+        """
+        Stop accepting updates, let workers finish what is queued, then stop them.
+        """
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        try:
+            await asyncio.wait_for(self.update_queue.join(), drain_timeout)
+        except asyncio.TimeoutError:
+            self.webhook_logger.warning(
+                "Dropping %s queued updates on shutdown", self.update_queue.qsize())
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    async def _handle_update(self, request: web.Request) -> web.Response:
+        if self.settings.secret:
+            token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+            if not hmac.compare_digest(token, self.settings.secret):
+                return web.Response(status=401)
+        try:
+            update = Update.model_validate(
+                await request.json(), context={"bot": self.bot})
+        except Exception:
+            return web.Response(status=400)
+        try:
+            self.update_queue.put_nowait(update)
+        except asyncio.QueueFull:
+            return web.Response(status=503)
+        return web.Response()
+
+    async def _worker(self, number: int):
+        while True:
+            update = await self.update_queue.get()
+            try:
+                await self.dispatcher.feed_update(self.bot, update)
+            except Exception as e:
+                self.webhook_logger.error(
+                    "Worker %s failed to handle update %s: %s", number, update.update_id, e)
+            finally:
+                self.update_queue.task_done()
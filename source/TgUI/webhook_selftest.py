@@ -0,0 +1,131 @@
+"""
+Local self-test of the webhook intake.
+
+Starts a WebhookServer on localhost with a dispatcher whose only handler counts
+messages, posts synthetic updates to it and reports intake throughput and latency.
+Nothing is sent to Telegram.
+
+    python -m source.TgUI.webhook_selftest --updates 2000 --concurrency 50 --workers 16
+
+With --url the updates are posted to an already running instance instead
+(its handlers will run against the synthetic users, so only use it on a test bot).
+"""
+import argparse
+import asyncio
+import time
+
+import aiohttp
+from aiogram import Bot, Dispatcher, Router
+from aiogram.types import Message
+
+from source.TgUI.Webhook import WebhookServer, WebhookSettings
+
+FAKE_TOKEN = "123456:SELFTEST-selftest-selftest-selftest"
+
+
+def synthetic_update(update_id: int) -> dict:
+    user_id = 100000 + update_id % 97
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Selftest"},
+            "text": f"synthetic question #{update_id}",
+        },
+    }
+
+
+async def post_updates(url: str, updates: int, concurrency: int, secret: str):
+    statuses = {}
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+
+    async with aiohttp.ClientSession() as session:
+        async def post(update_id: int):
+            async with semaphore:
+                start = time.perf_counter()
+                async with session.post(
+                    url, json=synthetic_update(update_id), headers=headers
+                ) as response:
+                    await response.read()
+                latencies.append(time.perf_counter() - start)
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(post(i) for i in range(1, updates + 1)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return statuses, latencies, elapsed
+
+
+async def main(args: argparse.Namespace):
+    handled = 0
+    all_handled = asyncio.Event()
+    server = None
+
+    if args.url is None:
+        bot = Bot(token=FAKE_TOKEN)
+        dispatcher = Dispatcher()
+        router = Router()
+
+        async def count(message: Message):
+            nonlocal handled
+            await asyncio.sleep(args.handler_delay)
+            handled += 1
+            if handled == args.updates:
+                all_handled.set()
+
+        router.message.register(count)
+        dispatcher.include_router(router)
+        settings = WebhookSettings(
+            base_url="",
+            host="127.0.0.1",
+            port=args.port,
+            secret=args.secret,
+            queue_size=args.queue_size,
+        )
+        server = WebhookServer(bot, dispatcher, settings, workers=args.workers)
+        await server.start(register=False)
+        url = f"http://127.0.0.1:{args.port}{settings.path}"
+    else:
+        url = args.url
+
+    try:
+        statuses, latencies, elapsed = await post_updates(
+            url, args.updates, args.concurrency, args.secret)
+        print(f"Posted {args.updates} updates in {elapsed:.2f}s "
+              f"({args.updates / elapsed:.0f} updates/s)")
+        print(f"HTTP statuses: {statuses}")
+        print(f"Intake latency p50={latencies[len(latencies) // 2] * 1000:.1f}ms "
+              f"p99={latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f}ms")
+        if server is not None:
+            accepted = statuses.get(200, 0)
+            if accepted == args.updates:
+                await asyncio.wait_for(all_handled.wait(), timeout=60)
+            else:
+                await server.update_queue.join()
+            print(f"Handled {handled}/{accepted} accepted updates "
+                  f"with {args.workers} workers")
+    finally:
+        if server is not None:
+            await server.stop()
+            await server.bot.session.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Webhook intake self-test")
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--queue-size", type=int, default=1000)
+    parser.add_argument("--handler-delay", type=float, default=0.01,
+                        help="Simulated handler time in seconds.")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--secret", default="selftest")
+    parser.add_argument("--url", default=None,
+                        help="Post to a running webhook instead of a local one.")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,186 @@
+"""
+Request tracing.
+
+A Trace is created for every question in BotApp and travels with it: it is stored under
+"trace" in every queue payload (in-memory queues and rag_jobs alike), so it survives the
+hop between the bot, ingest and query processes. While a stage runs, its trace is the
+current one (a context variable), which lets Metrics.stage() add a span for the stage
+and the Logger tag log lines with the trace id.
+
+Time spent waiting in a queue is recorded as a "queue:<name>" span between
+Trace.enqueued() and Trace.dequeued(). When the answer is delivered the trace is
+finished and written as one JSON line if it was sampled (TRACE_SAMPLE_RATE) or took
+longer than TRACE_SLOW_THRESHOLD, so slow requests are always kept.
+"""
+import asyncio
+import json
+import os
+import random
+import secrets
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List, Optional
+
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar(
+    "current_trace", default=None)
+
+_sample_rate = 0.01
+_slow_threshold = 30.0
+_trace_file = "./logs/traces.jsonl"
+
+
+def configure(sample_rate: float, slow_threshold: float, trace_file: str):
+    global _sample_rate, _slow_threshold, _trace_file
+    _sample_rate = sample_rate
+    _slow_threshold = slow_threshold
+    _trace_file = trace_file
+
+
+class Trace:
+    __slots__ = ("trace_id", "user_id", "sampled", "started", "spans", "_queue")
+
+    def __init__(
+        self,
+        trace_id: str,
+        user_id: Optional[int],
+        sampled: bool,
+        started: float,
+        spans: Optional[List[dict]] = None,
+        queue: Optional[list] = None,
+    ):
+        self.trace_id = trace_id
+        self.user_id = user_id
+        self.sampled = sampled
+        self.started = started
+        self.spans: List[dict] = spans if spans is not None else []
+        # [queue name, wall time it was put there] while the request waits in a queue
+        self._queue = queue
+
+    @classmethod
+    def start(cls, user_id: Optional[int] = None) -> "Trace":
+        return cls(
+            trace_id=secrets.token_hex(8),
+            user_id=user_id,
+            sampled=random.random() < _sample_rate,
+            started=time.time(),
+        )
+
+    @classmethod
+    def from_payload(cls, payload: dict) -> Optional["Trace"]:
+        data = payload.get("trace")
+        if data is None:
+            return None
+        return cls(
+            trace_id=data["id"],
+            user_id=data.get("user_id"),
+            sampled=data.get("sampled", False),
+            started=data["started"],
+            spans=data.get("spans"),
+            queue=data.get("queue"),
+        )
+
+    def to_payload(self) -> dict:
+        return {
+            "id": self.trace_id,
+            "user_id": self.user_id,
+            "sampled": self.sampled,
+            "started": self.started,
+            "spans": self.spans,
+            "queue": self._queue,
+        }
+
+    def add_span(self, name: str, start: float, duration: float):
+        """Add a span; start is wall clock time."""
+        self.spans.append({
+            "name": name,
+            "start_ms": round((start - self.started) * 1000, 3),
+            "duration_ms": round(duration * 1000, 3),
+            "pid": os.getpid(),
+        })
+
+    def enqueued(self, queue: str, payload: dict) -> dict:
+        """Mark the request as put into a queue and store the trace in its payload."""
+        self._queue = [queue, time.time()]
+        payload["trace"] = self.to_payload()
+        return payload
+
+    def dequeued(self):
+        """Close the span of the queue the request was waiting in."""
+        if self._queue is None:
+            return
+        queue, since = self._queue
+        self._queue = None
+        self.add_span(f"queue:{queue}", since, max(time.time() - since, 0.0))
+
+    @property
+    def elapsed(self) -> float:
+        return time.time() - self.started
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "trace_id": self.trace_id,
+            "user_id": self.user_id,
+            "started": self.started,
+            "total_ms": round(self.elapsed * 1000, 3),
+            "spans": self.spans,
+        }, ensure_ascii=False)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.trace_id if trace is not None else None
+
+
+@contextmanager
+def use_trace(trace: Optional[Trace]) -> Iterator[Optional[Trace]]:
+    """Make trace the current one for the block."""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def continue_trace(payload: dict) -> Iterator[Optional[Trace]]:
+    """
+    Resume the trace of a payload taken from a queue and make it current.
+    The time it spent in the queue becomes a span.
+    """
+    trace = Trace.from_payload(payload)
+    if trace is not None:
+        trace.dequeued()
+    with use_trace(trace):
+        yield trace
+
+
+def record_span(name: str, duration: float):
+    """Add a span that just ended to the current trace, if any."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(name, time.time() - duration, duration)
+
+
+def _append(line: str):
+    directory = os.path.dirname(_trace_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(_trace_file, "a", encoding="utf-8") as file:
+        file.write(line + "\n")
+
+
+async def finish(trace: Optional[Trace]):
+    """
+    The request is done. Write the trace if it is sampled or slow.
+    """
+    if trace is None:
+        return
+    if not trace.sampled and trace.elapsed < _slow_threshold:
+        return
+    await asyncio.to_thread(_append, trace.to_json())
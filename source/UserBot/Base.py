@@ -59,7 +59,7 @@ class Scrapper:
         if not self.running:
             return
 
-        await scrapper_logger.debug("Got update request... Updating channels...")
+        scrapper_logger.debug("Got update request... Updating channels...")
         for record in records:
             try:
                 chat = await self.pyro_client.get_chat(record.channel_id)
@@ -89,7 +89,7 @@ class Scrapper:
                     del self.channels_and_messages[record.channel_id]
                     await self.update_or_create_message_handler()
             except self.ScrapperException as e:
-                await scrapper_logger.warning("An error occurred while updating the scrapper: " + str(e) + "Skipping this channel.")
+                scrapper_logger.warning("An error occurred while updating the scrapper: %s. Skipping this channel.", e)
 
     async def fetch(self, channel_id: int):
         """
@@ -105,15 +105,16 @@ class Scrapper:
                 if message.text:
                     msgs.append(message.text)
                 else:
-                    await scrapper_logger.debug(f"Message {message.message_id} in channel {channel_id} is not a text message. Skipping.")
+                    scrapper_logger.debug("Message %s in channel %s is not a text message. Skipping.", message.message_id, channel_id)
         except Exception as e:
-            await scrapper_logger.warning(f"An error occurred while fetching messages from channel {channel_id}: {e}")
+            scrapper_logger.warning(
+                "An error occurred while fetching messages from channel %s: %s", channel_id, e)
         finally:
             if msgs:
                 self.channels_and_messages[channel_id][1].extend(msgs)
-                await scrapper_logger.debug(f"Fetched {len(msgs)} messages from channel {channel_id}.")
+                scrapper_logger.debug("Fetched %s messages from channel %s.", len(msgs), channel_id)
             else:
-                await scrapper_logger.debug(f"No messages fetched from channel {channel_id}.")
+                scrapper_logger.debug("No messages fetched from channel %s.", channel_id)
 
     async def update_or_create_message_handler(self) -> None:
         """
@@ -138,9 +139,9 @@ class Scrapper:
                 else:
                     self.channels_and_messages[message.chat.id][1].append(
                         message.text)
-                await scrapper_logger.debug(f"Got new message from channel {message.chat.id}: {message.text}")
+                scrapper_logger.debug("Got new message from channel %s: %s", message.chat.id, message.text)
             else:
-                await scrapper_logger.debug(f"Message {message.message_id} in channel {message.chat.id} is not a text message. Skipping.")
+                scrapper_logger.debug("Message %s in channel %s is not a text message. Skipping.", message.message_id, message.chat.id)
 
         self.message_handler = message_handler
 
@@ -177,7 +178,7 @@ class Scrapper:
         The main loop of the scrapper. It runs in a separate process and handles the incoming messages.
         """
         await self.pyro_client.start()
-        await scrapper_logger.debug("Scrapper started.")
+        scrapper_logger.debug("Scrapper started.")
         self.running = True
 
     async def scrapper_stop(self):
@@ -185,5 +186,5 @@ class Scrapper:
         Stops the scrapper.
         """
         await self.pyro_client.stop()
-        await scrapper_logger.debug("Scrapper stopped.")
+        scrapper_logger.debug("Scrapper stopped.")
         self.running = False
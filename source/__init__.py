@@ -1,2 +1,10 @@
-from source.TeleRagService import TeleRagService  # noqa
 from source.DynamicConfigurationLoading import get_config  # noqa
+
+
+def __getattr__(name):
+    # TeleRagService pulls in the whole stack (torch, chromadb, pyrogram),
+    # so it is only imported when asked for. Role entry points stay light.
+    if name == "TeleRagService":
+        from source.TeleRagService import TeleRagService
+        return TeleRagService
+    raise AttributeError(f"module 'source' has no attribute '{name}'")
@@ -0,0 +1,59 @@
+import unittest
+
+import numpy as np
+
+from source.ChromaАndRAG.ChannelRouting import ChannelIndex
+
+
+def axis(index: int, size: int = 4) -> np.ndarray:
+    vector = np.zeros(size, dtype=np.float32)
+    vector[index] = 1.0
+    return vector
+
+
+class ChannelIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = ChannelIndex(centers=2)
+        # Every channel writes about its own direction, one center of two is seeded
+        for channel_id in range(3):
+            self.index.add([channel_id], [1], np.stack([axis(channel_id)]))
+
+    def test_route_keeps_the_top_channels_in_their_order(self):
+        routed = self.index.route(axis(2) + 0.5 * axis(0), [0, 1, 2], top=2)
+
+        self.assertEqual(routed, [0, 2])
+
+    def test_channels_not_indexed_are_always_searched(self):
+        routed = self.index.route(axis(0), [7, 0, 1, 2, 8], top=1)
+
+        self.assertEqual(routed, [7, 0, 8])
+
+    def test_few_channels_are_all_searched(self):
+        self.assertEqual(self.index.route(axis(0), [1, 2], top=2), [1, 2])
+        self.assertEqual(self.index.route(axis(0), [0, 1, 2], top=0), [0, 1, 2])
+
+    def test_scores_use_the_best_center(self):
+        self.index.add([1], [2], np.stack([axis(3)]))
+
+        scores = self.index.scores(axis(3))
+
+        self.assertAlmostEqual(scores[1], 1.0, places=5)
+        self.assertAlmostEqual(scores[0], 0.0, places=5)
+
+    def test_posts_already_indexed_are_skipped(self):
+        # Fetched again for another question, the post must not change the centers
+        self.index.add([0], [1], np.stack([axis(1)]))
+        self.assertAlmostEqual(self.index.scores(axis(1))[0], 0.0, places=5)
+
+        self.index.add([0, 0], [1, 2], np.stack([axis(1), axis(1)]))
+        self.assertAlmostEqual(self.index.scores(axis(1))[0], 1.0, places=5)
+
+    def test_forget(self):
+        self.index.forget(0)
+
+        self.assertNotIn(0, self.index)
+        self.assertEqual(self.index.route(axis(1), [0, 1, 2], top=1), [0, 1])
+
+    def test_needs_a_center(self):
+        with self.assertRaises(ValueError):
+            ChannelIndex(centers=0)
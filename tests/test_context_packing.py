@@ -0,0 +1,80 @@
+import unittest
+
+from source.ChromaАndRAG.ContextPacking import ContextPacker, TokenCounter
+
+
+def words(prefix: str, count: int) -> str:
+    return " ".join(f"{prefix}{n}" for n in range(count))
+
+
+class TokenCounterTest(unittest.TestCase):
+    def test_estimate_errs_on_the_high_side(self):
+        counter = TokenCounter()
+        self.assertFalse(counter.exact)
+        self.assertEqual(counter.count("a bb ccc dddd"), 5)
+        self.assertEqual(counter.count("Hi, there!"), 5)
+
+    def test_truncate_cuts_between_words(self):
+        counter = TokenCounter()
+        text = "alpha beta gamma delta"
+
+        self.assertEqual(counter.truncate(text, 5), "alpha beta")
+        self.assertEqual(counter.truncate(text, 100), text)
+        self.assertEqual(counter.truncate(text, 0), "")
+
+
+class ContextPackerTest(unittest.TestCase):
+    def test_passages_are_grouped_by_source_in_rank_order(self):
+        packer = ContextPacker(budget=1000)
+        documents = [
+            "!ПОСТ С КАНАЛА news! " + words("first", 10),
+            words("second", 10),
+            "!ПОСТ С КАНАЛОВ news, other! " + words("third", 10),
+        ]
+        metadatas = [{"channel_name": "news"}, {"channel_name": "sport"}, {"channel_name": "news"}]
+
+        context, used = packer.pack(documents, metadatas)
+
+        self.assertEqual(context, (
+            f"news:\n- {words('first', 10)}\n- !ПОСТ С КАНАЛОВ news, other! {words('third', 10)}\n"
+            f"sport:\n- {words('second', 10)}\n"
+        ))
+        self.assertEqual(used, packer.counter.count(context))
+
+    def test_repeated_passages_are_dropped(self):
+        packer = ContextPacker(budget=1000)
+        story = words("story", 20)
+
+        context, _ = packer.pack(
+            [story, story + " update", words("other", 20)],
+            [{"channel_name": "a"}, {"channel_name": "b"}, {"channel_name": "c"}])
+
+        self.assertNotIn("b:", context)
+        self.assertIn("c:", context)
+
+    def test_long_passages_are_cut(self):
+        packer = ContextPacker(budget=1000, passage_budget=40)
+
+        context, used = packer.pack([words("w", 100)], [{"channel_name": "a"}])
+
+        self.assertLessEqual(used, 40 + packer.counter.count("a:\n- \n"))
+        self.assertTrue(context.startswith("a:\n- w0 w1"))
+
+    def test_context_stays_within_the_budget(self):
+        packer = ContextPacker(budget=100, passage_budget=400)
+        documents = [words(f"doc{n}x", 15) for n in range(10)]
+
+        context, used = packer.pack(documents, [{"channel_name": "a"}] * 10)
+
+        self.assertLessEqual(used, 100)
+        self.assertEqual(used, packer.counter.count(context))
+        self.assertIn("doc0x0", context)
+
+    def test_missing_metadata_and_empty_passages_are_skipped(self):
+        packer = ContextPacker()
+
+        context, used = packer.pack(
+            ["lost passage", "   ", "kept passage"], [None, {"channel_name": "a"}, {}])
+
+        self.assertEqual(context, "Unknown:\n- kept passage\n")
+        self.assertEqual(used, packer.counter.count(context))
@@ -0,0 +1,69 @@
+import unittest
+
+import numpy as np
+
+from source.ChromaАndRAG.Deduplication import (
+    NUM_PERM, NearDuplicateIndex, cluster_near_duplicates, minhash,
+)
+
+
+STORY = (
+    "the central bank raised its key rate by two points on friday citing inflation "
+    "that stayed above the target for the third month in a row analysts expect "
+    "another hike before the end of the year"
+)
+OTHER = (
+    "the football club signed a new striker from the spanish league for a record fee "
+    "the player is expected to make his debut in the cup match next weekend"
+)
+
+
+def jaccard(first: str, second: str) -> float:
+    def shingles(text):
+        words = text.split()
+        return {tuple(words[i:i + 3]) for i in range(len(words) - 2)}
+    first, second = shingles(first), shingles(second)
+    return len(first & second) / len(first | second)
+
+
+class MinHashTest(unittest.TestCase):
+    def test_signature(self):
+        signature = minhash(STORY)
+
+        self.assertEqual(signature.shape, (NUM_PERM,))
+        self.assertEqual(signature.dtype, np.uint32)
+        # Deterministic, signatures are compared across processes
+        np.testing.assert_array_equal(signature, minhash(STORY))
+
+    def test_post_without_words_has_no_signature(self):
+        self.assertEqual(len(minhash("   ")), 0)
+
+    def test_estimates_jaccard_similarity(self):
+        edited = STORY.replace("friday", "thursday").replace("analysts", "economists")
+
+        estimate = np.count_nonzero(minhash(STORY) == minhash(edited)) / NUM_PERM
+
+        self.assertAlmostEqual(estimate, jaccard(STORY, edited), delta=0.15)
+        self.assertLess(np.count_nonzero(minhash(STORY) == minhash(OTHER)) / NUM_PERM, 0.1)
+
+
+class NearDuplicateIndexTest(unittest.TestCase):
+    def test_reposts_join_the_cluster_of_the_first_post(self):
+        repost = STORY + " via our channel"
+        clusters = cluster_near_duplicates([STORY, OTHER, repost, OTHER])
+
+        self.assertEqual(clusters, [[0, 2], [1, 3]])
+
+    def test_threshold(self):
+        edited = STORY.replace("friday", "thursday").replace("analysts", "economists")
+        similarity = jaccard(STORY, edited)
+
+        self.assertEqual(cluster_near_duplicates([STORY, edited], threshold=similarity - 0.2), [[0, 1]])
+        self.assertEqual(cluster_near_duplicates([STORY, edited], threshold=0.99), [[0], [1]])
+
+    def test_posts_without_signature_are_their_own_clusters(self):
+        index = NearDuplicateIndex()
+        self.assertEqual(index.add(minhash("")), 0)
+        self.assertEqual(index.add(minhash("")), 1)
+        self.assertEqual(index.add(minhash(STORY)), 2)
+        self.assertEqual(index.clusters(), [[0], [1], [2]])
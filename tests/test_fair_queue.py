@@ -0,0 +1,81 @@
+import asyncio
+import unittest
+
+from source.ChromaАndRAG.FairQueue import FairRequestQueue, request_cost
+
+
+def request(user_id: int, channels: int, name: str = "") -> dict:
+    return {"user_id": user_id, "name": name, "channels": [{"channel_id": i} for i in range(channels)]}
+
+
+class FairRequestQueueTest(unittest.IsolatedAsyncioTestCase):
+    def test_request_cost_counts_channels(self):
+        self.assertEqual(request_cost(request(1, 5)), 5)
+        self.assertEqual(request_cost({"user_id": 1, "texts": [{}, {}]}), 2)
+        self.assertEqual(request_cost({"user_id": 1, "channels": []}), 1)
+
+    def test_expensive_requests_wait_more_turns(self):
+        queue = FairRequestQueue(cost=request_cost)
+        queue.put_nowait(request(1, 3, "big"))
+        queue.put_nowait(request(1, 1, "small"))
+        queue.put_nowait(request(2, 1, "a"))
+        queue.put_nowait(request(2, 1, "b"))
+
+        order = [queue.get_nowait()["name"] for _ in range(4)]
+
+        # Deficit round robin: the 3-channel request needs three turns of user 1
+        self.assertEqual(order, ["a", "b", "big", "small"])
+        self.assertTrue(queue.empty())
+
+    def test_users_alternate_with_equal_costs(self):
+        queue = FairRequestQueue()
+        for name in ("a1", "a2", "a3"):
+            queue.put_nowait({"user_id": 1, "name": name})
+        queue.put_nowait({"user_id": 2, "name": "b1"})
+
+        order = [queue.get_nowait()["name"] for _ in range(4)]
+
+        self.assertEqual(order, ["a1", "b1", "a2", "a3"])
+
+    def test_queue_limit(self):
+        queue = FairRequestQueue(maxsize=2)
+        queue.put_nowait({"user_id": 1})
+        queue.put_nowait({"user_id": 2})
+        with self.assertRaises(asyncio.QueueFull):
+            queue.put_nowait({"user_id": 3})
+        queue.get_nowait()
+        queue.put_nowait({"user_id": 3})
+        self.assertEqual(queue.qsize(), 2)
+
+    def test_user_limit(self):
+        queue = FairRequestQueue(max_per_user=2)
+        queue.put_nowait({"user_id": 1})
+        queue.put_nowait({"user_id": 1})
+        with self.assertRaises(asyncio.QueueFull):
+            queue.put_nowait({"user_id": 1})
+        queue.put_nowait({"user_id": 2})
+        self.assertEqual(queue.user_qsize(1), 2)
+        self.assertEqual(queue.user_qsize(2), 1)
+
+    def test_remove_drops_the_users_requests(self):
+        queue = FairRequestQueue()
+        queue.put_nowait({"user_id": 1, "name": "a"})
+        queue.put_nowait({"user_id": 2, "name": "b"})
+        queue.put_nowait({"user_id": 1, "name": "c"})
+
+        removed = queue.remove(1)
+
+        self.assertEqual([item["name"] for item in removed], ["a", "c"])
+        self.assertEqual(queue.qsize(), 1)
+        self.assertEqual(queue.get_nowait()["name"], "b")
+        self.assertEqual(queue.remove(1), [])
+
+    async def test_get_waits_for_put(self):
+        queue = FairRequestQueue()
+        getter = asyncio.create_task(queue.get())
+        await asyncio.sleep(0)
+        self.assertFalse(getter.done())
+
+        queue.put_nowait({"user_id": 1, "name": "a"})
+
+        self.assertEqual((await asyncio.wait_for(getter, 1))["name"], "a")
@@ -0,0 +1,252 @@
+"""
+RagJobQueue against a real PostgreSQL. Set TEST_DATABASE_URL to a throwaway database,
+e.g. postgresql+asyncpg://postgres@/postgres?host=/tmp/pgdata, the rag_jobs table in it
+is dropped and created again.
+"""
+import asyncio
+import os
+import unittest
+
+from sqlalchemy import text
+
+from source.ChromaАndRAG.FairQueue import request_cost
+from source.Database.database import DatabaseManager, RagJob
+from source.Database.JobQueue import RagJobQueue
+
+
+DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+
+def request(user_id: int, channels: int, name: str = "") -> dict:
+    return {"user_id": user_id, "name": name, "channels": [{"channel_id": i} for i in range(channels)]}
+
+
+@unittest.skipUnless(DATABASE_URL, "TEST_DATABASE_URL is not set")
+class JobQueueTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.db_manager = DatabaseManager(DATABASE_URL)
+        await self.db_manager.init()
+        async with self.db_manager.engine.begin() as connection:
+            await connection.run_sync(RagJob.__table__.drop, checkfirst=True)
+            await connection.run_sync(RagJob.__table__.create)
+
+    async def asyncTearDown(self):
+        await self.db_manager.engine.dispose()
+
+    def job_queue(self, **kwargs) -> RagJobQueue:
+        return RagJobQueue(self.db_manager, queue="test", **kwargs)
+
+    async def execute(self, query: str, **params):
+        async with self.db_manager.get_session() as session:
+            await session.execute(text(query), params)
+
+    async def fetch(self, query: str, **params) -> list:
+        async with self.db_manager.get_session() as session:
+            return (await session.execute(text(query), params)).all()
+
+    async def expire_leases(self):
+        await self.execute(
+            "UPDATE rag_jobs SET locked_until = now() - interval '1 second' WHERE status = 'running'")
+
+    async def claim_all(self, job_queue: RagJobQueue) -> list:
+        jobs = []
+        while True:
+            claimed = await job_queue.claim()
+            if not claimed:
+                return jobs
+            jobs.extend(claimed)
+
+
+class JobQueueLeaseTest(JobQueueTestCase):
+    async def test_claimed_job_is_invisible_until_the_lease_expires(self):
+        job_queue = self.job_queue()
+        other = self.job_queue()
+        other.worker_id = "other"
+        await job_queue.enqueue({"n": 1}, user_id=1)
+
+        [job] = await job_queue.claim()
+        self.assertEqual(await other.claim(), [])
+
+        await self.expire_leases()
+        [reclaimed] = await other.claim()
+
+        self.assertEqual((reclaimed.id, reclaimed.attempts), (job.id, 2))
+        # The first worker lost the job: its complete and extend do nothing
+        await job_queue.complete(job)
+        self.assertFalse(await job_queue.extend(job))
+        self.assertTrue(await other.extend(reclaimed))
+        [row] = await self.fetch("SELECT status, locked_by FROM rag_jobs")
+        self.assertEqual(tuple(row), ("running", "other"))
+
+    async def test_expired_lease_without_attempts_left_fails_the_job(self):
+        job_queue = self.job_queue(max_attempts=1)
+        job_id = await job_queue.enqueue({"n": 1}, user_id=1)
+        await job_queue.claim()
+
+        await self.expire_leases()
+
+        self.assertEqual(await job_queue.claim(), [])
+        with self.assertRaisesRegex(RuntimeError, "visibility timeout expired"):
+            await job_queue.wait_result(job_id, timeout=1)
+
+    async def test_lease_completes_the_job(self):
+        job_queue = self.job_queue()
+        await job_queue.enqueue({"n": 1}, user_id=1)
+        job_id = await job_queue.enqueue({"n": 2}, user_id=1)
+
+        [job] = await job_queue.claim()
+        async with job_queue.lease(job):
+            pass
+        [job] = await job_queue.claim()
+        async with job_queue.lease(job):
+            job.result = {"answer": 42}
+
+        # Jobs without a result are deleted, results wait for wait_result()
+        self.assertEqual(await job_queue.wait_result(job_id, timeout=1), {"answer": 42})
+        self.assertEqual(await self.fetch("SELECT id FROM rag_jobs"), [])
+
+    async def test_failed_job_is_retried_after_a_backoff(self):
+        job_queue = self.job_queue(max_attempts=2, retry_backoff=60)
+        job_id = await job_queue.enqueue({"n": 1}, user_id=1)
+
+        [job] = await job_queue.claim()
+        async with job_queue.lease(job):
+            raise ValueError("broken")
+
+        self.assertEqual(await job_queue.claim(), [])
+        [row] = await self.fetch(
+            "SELECT status, last_error, available_at - now() > interval '50 seconds' AS delayed "
+            "FROM rag_jobs")
+        self.assertEqual(tuple(row), ("pending", "ValueError('broken')", True))
+
+        await self.execute("UPDATE rag_jobs SET available_at = now()")
+        [job] = await job_queue.claim()
+        self.assertEqual(job.attempts, 2)
+        async with job_queue.lease(job):
+            raise ValueError("broken again")
+
+        with self.assertRaisesRegex(RuntimeError, "broken again"):
+            await job_queue.wait_result(job_id, timeout=1)
+
+    async def test_cancelled_lease_releases_the_attempt(self):
+        job_queue = self.job_queue()
+        await job_queue.enqueue({"n": 1}, user_id=1)
+        [job] = await job_queue.claim()
+
+        async def work():
+            async with job_queue.lease(job):
+                await asyncio.sleep(10)
+
+        task = asyncio.create_task(work())
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+        [job] = await job_queue.claim()
+        self.assertEqual(job.attempts, 1)
+
+    async def test_cancel_user_interrupts_the_lease(self):
+        job_queue = self.job_queue(poll_interval=1)
+        await job_queue.enqueue({"n": 1}, user_id=1)
+        await job_queue.enqueue({"n": 2}, user_id=2)
+        [job] = await job_queue.claim()
+
+        async def work():
+            async with job_queue.lease(job):
+                await asyncio.sleep(10)
+
+        task = asyncio.create_task(work())
+        self.assertEqual(await job_queue.cancel_user(1), 1)
+
+        # The heartbeat finds the row gone and stops the body, the cancel stays inside
+        await asyncio.wait_for(task, 5)
+        self.assertTrue(job.cancelled)
+        [job] = await job_queue.claim()
+        self.assertEqual(job.user_id, 2)
+
+    async def test_wait_result_times_out(self):
+        job_queue = self.job_queue(poll_interval=0.1)
+        job_id = await job_queue.enqueue({"n": 1}, user_id=1)
+        with self.assertRaises(TimeoutError):
+            await job_queue.wait_result(job_id, timeout=0.3)
+        await job_queue.stop()
+
+    async def test_purge_removes_old_finished_jobs(self):
+        job_queue = self.job_queue(result_retention=60)
+        await job_queue.enqueue({"n": 1}, user_id=1)
+        await job_queue.enqueue({"n": 2}, user_id=1)
+        for job in await self.claim_all(job_queue):
+            job.result = {"n": job.payload["n"]}
+            await job_queue.complete(job)
+        await self.execute(
+            "UPDATE rag_jobs SET updated_at = now() - interval '2 minutes' "
+            "WHERE payload->>'n' = '1'")
+
+        self.assertEqual(await job_queue.purge(), 1)
+        [row] = await self.fetch("SELECT payload->>'n' AS n FROM rag_jobs")
+        self.assertEqual(row.n, "2")
+
+
+class JobQueueAdmissionTest(JobQueueTestCase):
+    async def test_queue_limit(self):
+        job_queue = self.job_queue(max_pending=2)
+        await job_queue.enqueue({"n": 1}, user_id=1)
+        await job_queue.enqueue({"n": 2}, user_id=2)
+        with self.assertRaises(asyncio.QueueFull):
+            await job_queue.enqueue({"n": 3}, user_id=3)
+
+        # A claimed job is no longer waiting in the queue
+        await job_queue.claim()
+        await job_queue.enqueue({"n": 3}, user_id=3)
+
+    async def test_user_limit(self):
+        job_queue = self.job_queue(max_pending_per_user=1)
+        await job_queue.enqueue({"n": 1}, user_id=1)
+        with self.assertRaises(asyncio.QueueFull):
+            await job_queue.enqueue({"n": 2}, user_id=1)
+        await job_queue.enqueue({"n": 3}, user_id=2)
+
+    async def test_other_queues_do_not_count(self):
+        job_queue = self.job_queue(max_pending=1)
+        other = RagJobQueue(self.db_manager, queue="other")
+        await other.enqueue({"n": 1}, user_id=1)
+        await job_queue.enqueue({"n": 2}, user_id=1)
+
+    async def test_concurrent_enqueues_respect_the_limit(self):
+        job_queue = self.job_queue(max_pending=3)
+        results = await asyncio.gather(
+            *(job_queue.enqueue({"n": n}, user_id=n) for n in range(10)),
+            return_exceptions=True)
+
+        self.assertEqual(sum(not isinstance(result, Exception) for result in results), 3)
+        self.assertTrue(all(
+            isinstance(result, (int, asyncio.QueueFull)) for result in results))
+
+
+class JobQueueFairnessTest(JobQueueTestCase):
+    async def test_expensive_requests_wait_more_turns(self):
+        job_queue = self.job_queue(cost=request_cost)
+        for name in ("big1", "big2", "big3"):
+            await job_queue.enqueue(request(1, 3, name), user_id=1)
+        for name in ("a", "b", "c"):
+            await job_queue.enqueue(request(2, 1, name), user_id=2)
+
+        order = [job.payload["name"] for job in await self.claim_all(job_queue)]
+
+        # FIFO would serve all of user 1 first
+        self.assertEqual(order, ["big1", "a", "b", "c", "big2", "big3"])
+
+    async def test_new_user_does_not_overtake_waiting_jobs(self):
+        job_queue = self.job_queue()
+        for n in range(3):
+            await job_queue.enqueue({"name": f"a{n}"}, user_id=1)
+        [first] = await job_queue.claim()
+        [second] = await job_queue.claim()
+        await job_queue.enqueue({"name": "b0"}, user_id=2)
+
+        order = [job.payload["name"] for job in await self.claim_all(job_queue)]
+
+        self.assertEqual((first.payload["name"], second.payload["name"]), ("a0", "a1"))
+        # b0 starts at the virtual time of the queue, not before the jobs already served
+        self.assertEqual(order, ["a2", "b0"])
@@ -0,0 +1,93 @@
+import socket
+import unittest
+
+from source.Metrics import (
+    _BUCKETS, _MAX_VALUE, Histogram, MetricsRegistry, MetricsServer, _index, _upper_bound,
+)
+
+
+class HistogramTest(unittest.TestCase):
+    def test_buckets_cover_the_range(self):
+        self.assertEqual(_index(_MAX_VALUE), _BUCKETS - 1)
+        previous = -1
+        for value in (0, 1, 255, 256, 257, 511, 512, 1000, 123_456, 10_000_000, _MAX_VALUE):
+            index = _index(value)
+            self.assertGreaterEqual(index, previous)
+            self.assertLessEqual(value, _upper_bound(index))
+            if index:
+                self.assertGreater(value, _upper_bound(index - 1))
+            previous = index
+
+    def test_relative_error_is_under_one_percent(self):
+        for value in range(256, 1_000_000, 997):
+            upper = _upper_bound(_index(value))
+            self.assertLess((upper - value) / value, 0.01)
+
+    def test_quantiles(self):
+        histogram = Histogram()
+        for ms in range(1, 1001):
+            histogram.record(ms / 1000)
+
+        p50, p90, p99, p999 = histogram.quantiles()
+
+        self.assertAlmostEqual(p50, 0.5, delta=0.005)
+        self.assertAlmostEqual(p90, 0.9, delta=0.009)
+        self.assertAlmostEqual(p99, 0.99, delta=0.01)
+        self.assertLessEqual(p999, histogram.max)
+        self.assertEqual(histogram.count, 1000)
+        self.assertAlmostEqual(histogram.min, 0.001)
+
+    def test_out_of_range_values_are_clamped(self):
+        histogram = Histogram()
+        histogram.record(-1)
+        histogram.record(10 ** 6)
+        self.assertEqual(histogram.count, 2)
+        self.assertEqual(histogram.quantiles((0.0,)), [0.0])
+
+    def test_empty_and_reset(self):
+        histogram = Histogram()
+        self.assertEqual(histogram.quantiles(), [0.0] * 4)
+        histogram.record(0.1)
+        histogram.reset()
+        self.assertEqual((histogram.count, histogram.sum), (0, 0.0))
+
+
+class RegistryTest(unittest.TestCase):
+    def test_text_format(self):
+        registry = MetricsRegistry()
+        registry.histogram("stage_seconds", "Stage time.", ("stage",)).labels(stage="embed").record(0.25)
+        registry.counter("errors_total", "Errors.", ("stage",)).labels(stage='say "hi"\n').inc(2)
+        registry.gauge("queue_depth", "Queue size.").labels().set_function(lambda: 3)
+        registry.gauge("broken", "Raises.").labels().set_function(lambda: 1 / 0)
+
+        lines = registry.expose().splitlines()
+
+        self.assertEqual(lines[:2], ["# HELP stage_seconds Stage time.", "# TYPE stage_seconds summary"])
+        self.assertIn('stage_seconds{stage="embed",quantile="0.5"} 0.250000', lines)
+        self.assertIn('stage_seconds_sum{stage="embed"} 0.250000', lines)
+        self.assertIn('stage_seconds_count{stage="embed"} 1', lines)
+        self.assertIn("# TYPE errors_total counter", lines)
+        self.assertIn('errors_total{stage="say \\"hi\\"\\n"} 2.0', lines)
+        self.assertIn("queue_depth 3.0", lines)
+        # A failing gauge callback only drops its own sample
+        self.assertIn("# TYPE broken gauge", lines)
+        self.assertFalse(any(line.startswith("broken ") for line in lines))
+
+    def test_families_are_registered_once(self):
+        registry = MetricsRegistry()
+        family = registry.counter("errors_total", "Errors.")
+        self.assertIs(registry.counter("errors_total", "Errors."), family)
+        self.assertIs(family.labels(), family.labels())
+
+
+class MetricsServerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_busy_port_does_not_fail_the_start(self):
+        with socket.socket() as busy:
+            busy.bind(("127.0.0.1", 0))
+            busy.listen()
+            server = MetricsServer("127.0.0.1", busy.getsockname()[1], MetricsRegistry())
+
+            await server.start()
+
+            self.assertIsNone(server._runner)
+            await server.stop()
@@ -0,0 +1,53 @@
+import asyncio
+import unittest
+
+from source.PriorityScheduling import Priority, PriorityScheduler
+
+
+class PrioritySchedulerCancellationTest(unittest.IsolatedAsyncioTestCase):
+    async def test_waiter_cancelled_before_release(self):
+        # A waiter is cancelled and the slot is released before the waiter's task resumes
+        scheduler = PriorityScheduler("test_cancel_before_release", 1)
+        await scheduler.acquire()
+        waiter = asyncio.create_task(scheduler.acquire(Priority.BACKGROUND))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        scheduler.release()
+
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        self.assertEqual(scheduler.running, 0)
+        self.assertEqual(scheduler.qsize(), 0)
+        await asyncio.wait_for(scheduler.acquire(), 1)
+        self.assertEqual(scheduler.running, 1)
+
+    async def test_waiter_cancelled_after_handover(self):
+        # The slot is handed to a waiter, then the waiter is cancelled before it resumes
+        scheduler = PriorityScheduler("test_cancel_after_handover", 1)
+        await scheduler.acquire()
+        waiter = asyncio.create_task(scheduler.acquire())
+        await asyncio.sleep(0)
+        scheduler.release()
+        waiter.cancel()
+
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        self.assertEqual(scheduler.running, 0)
+        await asyncio.wait_for(scheduler.acquire(), 1)
+
+    async def test_new_caller_while_cancelled_waiter_is_queued(self):
+        scheduler = PriorityScheduler("test_cancel_new_caller", 1)
+        await scheduler.acquire()
+        waiter = asyncio.create_task(scheduler.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        scheduler.release()
+        # The cancelled waiter has not left the queue yet
+        await asyncio.wait_for(scheduler.acquire(), 1)
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        self.assertEqual(scheduler.running, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
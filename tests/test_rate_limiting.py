@@ -0,0 +1,72 @@
+import unittest
+from unittest import mock
+
+from source.RateLimiting import KeyedTokenBuckets, TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch("source.RateLimiting.time.monotonic", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_then_refill(self):
+        bucket = TokenBucket(rate=2.0, capacity=3)
+        for _ in range(3):
+            self.assertEqual(bucket.try_acquire(), 0.0)
+        self.assertAlmostEqual(bucket.try_acquire(), 0.5)
+
+        self.clock.now += 0.5
+        self.assertEqual(bucket.try_acquire(), 0.0)
+
+    def test_refill_is_capped(self):
+        bucket = TokenBucket(rate=1.0, capacity=2)
+        bucket.try_acquire(2)
+        self.clock.now += 100
+        self.assertTrue(bucket.is_full)
+        self.assertEqual(bucket.try_acquire(2), 0.0)
+        self.assertAlmostEqual(bucket.try_acquire(), 1.0)
+
+    def test_penalize_puts_the_bucket_into_debt(self):
+        bucket = TokenBucket(rate=1.0, capacity=5)
+        bucket.penalize(3)
+        # 3 seconds of debt, then 1 second for the token itself
+        self.assertAlmostEqual(bucket.try_acquire(), 4.0)
+
+    def test_invalid_parameters(self):
+        with self.assertRaises(ValueError):
+            TokenBucket(rate=0, capacity=1)
+
+
+class KeyedTokenBucketsTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch("source.RateLimiting.time.monotonic", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_keys_have_their_own_buckets(self):
+        buckets = KeyedTokenBuckets(rate=1.0, capacity=1)
+        self.assertEqual(buckets.try_acquire("a"), 0.0)
+        self.assertGreater(buckets.try_acquire("a"), 0.0)
+        self.assertEqual(buckets.try_acquire("b"), 0.0)
+
+    def test_full_buckets_are_evicted_first(self):
+        buckets = KeyedTokenBuckets(rate=1.0, capacity=1, max_keys=2)
+        buckets.try_acquire("busy")
+        buckets.get("idle")
+
+        buckets.try_acquire("new")
+
+        # "idle" is full and carries no state, "busy" still has to wait
+        self.assertEqual(len(buckets), 2)
+        self.assertGreater(buckets.try_acquire("busy"), 0.0)
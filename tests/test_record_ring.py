@@ -0,0 +1,90 @@
+import gc
+import os
+import tempfile
+import time
+import unittest
+import weakref
+
+from source.Logging import LogLevel, RecordRing
+
+
+class Payload:
+    def __init__(self):
+        self.posts = ["post"] * 100_000
+
+    def __repr__(self):
+        return f"Payload({len(self.posts)} posts)"
+
+
+def record(message, *args, extra=None, created=None, level=LogLevel.DEBUG) -> tuple:
+    return (created or time.time(), "Test", level, message, args, None, extra)
+
+
+class RecordRingTest(unittest.TestCase):
+    def test_ring_does_not_keep_arguments_alive(self):
+        ring = RecordRing(10)
+        payload = Payload()
+        collected = weakref.ref(payload)
+
+        ring.add(LogLevel.DEBUG.value, record("Retrieved task %s", payload, extra={"task": payload}))
+        del payload
+        gc.collect()
+
+        self.assertIsNone(collected())
+        [(_, _, _, message, args, _, extra)] = ring.snapshot()
+        self.assertEqual(message % args, "Retrieved task Payload(100000 posts)")
+        self.assertEqual(extra, {"task": "Payload(100000 posts)"})
+
+    def test_ring_does_not_keep_exceptions_alive(self):
+        ring = RecordRing(10)
+        payload = Payload()
+        collected = weakref.ref(payload)
+
+        def fail(payload):
+            raise ValueError("broken")
+
+        try:
+            fail(payload)
+        except ValueError as e:
+            # The traceback references the frame that holds payload
+            ring.add(LogLevel.ERROR.value, record("Request failed: %s", e))
+            ring.add(LogLevel.ERROR.value, record(e))
+            ring.add(LogLevel.ERROR.value, record(lambda: f"Request failed: {e}"))
+        del payload
+        gc.collect()
+
+        self.assertIsNone(collected())
+        messages = [message % args if args else message for _, _, _, message, args, _, _ in ring.snapshot()]
+        self.assertEqual(
+            messages, ["Request failed: ValueError('broken')", "broken", "Request failed: broken"])
+
+    def test_ring_keeps_the_state_at_log_time(self):
+        ring = RecordRing(10)
+        posts = ["first"]
+
+        ring.add(LogLevel.DEBUG.value, record("Posts: %s, count %d, share %.1f", posts, 1, 0.5))
+        posts.append("second")
+
+        [(_, _, _, message, args, _, _)] = ring.snapshot()
+        self.assertEqual(message % args, "Posts: ['first'], count 1, share 0.5")
+
+    def test_ring_keeps_the_last_records_of_every_level(self):
+        ring = RecordRing(3)
+        for n in range(5):
+            ring.add(LogLevel.DEBUG.value, record("debug %d", n, created=100 + n))
+        ring.add(LogLevel.INFO.value, record("info", created=102.5, level=LogLevel.INFO))
+
+        messages = [message % args if args else message for _, _, _, message, args, _, _ in ring.snapshot()]
+
+        self.assertEqual(messages, ["debug 2", "info", "debug 3", "debug 4"])
+        self.assertEqual(len(ring.snapshot(2)), 2)
+
+    def test_write(self):
+        ring = RecordRing(3)
+        ring.add(LogLevel.INFO.value, record("Answer for %s", 42, extra={"user_id": 7}, level=LogLevel.INFO))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "dump.log")
+            RecordRing.write(ring.snapshot(), path)
+            with open(path, encoding="utf-8") as file:
+                line = file.read()
+        self.assertIn("Test/INFO] -> Answer for 42 | user_id=7", line)
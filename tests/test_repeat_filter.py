@@ -0,0 +1,107 @@
+import gc
+import unittest
+import weakref
+from unittest import mock
+
+from source.Logging import Logger, LogLevel, RepeatFilter
+
+
+class Gateway:
+    def __init__(self):
+        self.records = []
+        self.watched = []
+
+    def put(self, record):
+        self.records.append(record)
+
+    def watch_repeats(self, repeats):
+        self.watched.append(repeats)
+
+
+class Broken(Exception):
+    pass
+
+
+def messages(records) -> list:
+    return [message % args if args else message for _, _, _, message, args, _, _ in records]
+
+
+class RepeatFilterTest(unittest.TestCase):
+    def test_burst_then_summary(self):
+        repeats = RepeatFilter("Test", burst=2, window=10)
+        key = (LogLevel.ERROR.value, "Request failed: %s")
+
+        self.assertEqual([repeats.allow(key, 100 + n) for n in range(5)], [0, 0, -1, -1, -1])
+        self.assertEqual(repeats.next_due(), 110)
+        self.assertEqual(repeats.summaries(105), [])
+        [summary] = repeats.summaries(110)
+
+        self.assertEqual(messages([summary]), ["Message repeated 3 more times in 10s: Request failed: %s"])
+        self.assertIs(summary[2], LogLevel.ERROR)
+        self.assertIsNone(repeats.next_due())
+
+    def test_next_window_reports_the_previous_one(self):
+        repeats = RepeatFilter("Test", burst=1, window=10)
+        key = (LogLevel.ERROR.value, "Request failed: %s")
+        repeats.allow(key, 100)
+        repeats.allow(key, 101)
+        repeats.allow(key, 102)
+
+        self.assertEqual(repeats.allow(key, 111), 2)
+        self.assertIsNone(repeats.next_due())
+
+    def test_keys_are_capped(self):
+        repeats = RepeatFilter("Test", burst=1, window=10)
+        suppressed = (LogLevel.ERROR.value, "suppressed")
+        repeats.allow(suppressed, 100)
+        repeats.allow(suppressed, 100)
+        with mock.patch("source.Logging._REPEAT_KEYS", 3):
+            for n in range(10):
+                repeats.allow((LogLevel.ERROR.value, f"message {n}"), 101)
+
+            self.assertLessEqual(len(repeats._windows), 3)
+        # Suppressed records are still summarized
+        self.assertEqual(len(repeats.summaries(110)), 1)
+
+
+class LoggerRepeatsTest(unittest.TestCase):
+    def setUp(self):
+        with mock.patch("builtins.print"):
+            self.logger = Logger("Test", "test.log")
+        self.logger._repeats = RepeatFilter("Test", burst=1, window=10)
+        self.gateway = self.logger._file_gateway = Gateway()
+
+    def test_dict_messages_are_keyed_by_type(self):
+        self.assertTrue(self.logger._check_repeats(LogLevel.ERROR.value, {"error": 1}, 100))
+        self.assertFalse(self.logger._check_repeats(LogLevel.ERROR.value, {"error": 2}, 101))
+        self.assertEqual(self.gateway.watched, [self.logger._repeats])
+
+        [summary] = self.logger._repeats.summaries(110)
+
+        self.assertEqual(messages([summary]), ["Message repeated 1 more times in 10s: dict message"])
+
+    def test_exception_messages_are_not_kept_alive(self):
+        error = Broken("broken")
+        collected = weakref.ref(error)
+
+        self.assertTrue(self.logger._check_repeats(LogLevel.ERROR.value, error, 100))
+        self.assertFalse(self.logger._check_repeats(LogLevel.ERROR.value, Broken("other"), 101))
+        del error
+        gc.collect()
+
+        self.assertIsNone(collected())
+        self.assertIn((LogLevel.ERROR.value, Broken), self.logger._repeats._windows)
+
+    def test_callable_messages_are_keyed_by_code(self):
+        for n in range(3):
+            self.assertEqual(
+                self.logger._check_repeats(LogLevel.ERROR.value, lambda: f"failed {n}", 100 + n), n == 0)
+
+        [summary] = self.logger._repeats.summaries(110)
+
+        self.assertIn("<lambda> at test_repeat_filter.py:", messages([summary])[0])
+
+    def test_levels_are_separate(self):
+        self.assertTrue(self.logger._check_repeats(LogLevel.ERROR.value, "failed", 100))
+        self.assertTrue(self.logger._check_repeats(LogLevel.WARNING.value, "failed", 100))
+        self.assertFalse(self.logger._check_repeats(LogLevel.ERROR.value, "failed", 101))
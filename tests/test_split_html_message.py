@@ -0,0 +1,64 @@
+import re
+import unittest
+
+from source.TgUI.Delivery import _utf16_len, split_html_message
+
+
+def plain(text: str) -> str:
+    return re.sub(r"<[^>]+>", "", text)
+
+
+class SplitHtmlMessageTest(unittest.TestCase):
+    def assertFits(self, chunks, limit):
+        for chunk in chunks:
+            self.assertLessEqual(_utf16_len(chunk), limit, chunk)
+
+    def test_short_message_is_not_split(self):
+        self.assertEqual(split_html_message("<b>Hi</b>", 10), ["<b>Hi</b>"])
+
+    def test_cuts_at_paragraphs_then_words(self):
+        text = "First paragraph here.\n\nSecond one, a bit longer than the first."
+
+        chunks = split_html_message(text, 40)
+
+        self.assertEqual(chunks[0], "First paragraph here.\n\n")
+        self.assertFits(chunks, 40)
+        self.assertEqual(" ".join(chunks).split(), text.split())
+
+    def test_limit_counts_utf16_code_units(self):
+        # Every emoji outside the BMP takes two code units
+        text = "😀" * 30
+
+        chunks = split_html_message(text, 16)
+
+        self.assertEqual([len(chunk) for chunk in chunks], [8, 8, 8, 6])
+        self.assertFits(chunks, 16)
+        self.assertEqual("".join(chunks), text)
+
+    def test_open_tags_are_closed_and_reopened(self):
+        text = '<b>bold <a href="https://t.me/x">link words that go on and on</a> tail</b>'
+
+        chunks = split_html_message(text, 50)
+
+        self.assertFits(chunks, 50)
+        for chunk in chunks:
+            self.assertTrue(chunk.startswith("<b>"), chunk)
+            self.assertTrue(chunk.endswith("</b>"), chunk)
+            self.assertEqual(chunk.count("<a "), chunk.count("</a>"))
+        self.assertIn('<a href="https://t.me/x">', chunks[1])
+        self.assertEqual(" ".join(plain(chunk) for chunk in chunks).split(), plain(text).split())
+
+    def test_entities_are_not_cut(self):
+        text = "x" * 18 + "&amp;" + "y" * 10
+
+        chunks = split_html_message(text, 20)
+
+        self.assertEqual(chunks[0], "x" * 18)
+        self.assertTrue(chunks[1].startswith("&amp;"))
+        self.assertEqual("".join(chunks), text)
+
+    def test_parts_without_text_are_dropped(self):
+        chunks = split_html_message("<i>" + "word " * 20 + "</i>", 30)
+
+        self.assertFits(chunks, 30)
+        self.assertTrue(all(plain(chunk).strip() for chunk in chunks))